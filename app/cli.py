@@ -1,29 +1,107 @@
 
-import typer, json, requests, os
+import typer, json, requests, os, time, uuid
 
 app = typer.Typer(help="CLI для BitD GM AI")
 
 API = os.getenv("GM_API", "http://127.0.0.1:8000/chat")
 
 @app.command()
-def chat():
-    history: list[dict[str,str]] = []
-    typer.echo("Начали. Пишите сообщения. /exit для выхода.")
+def chat(session: str = typer.Option(None, help="id серверной сессии — продолжить прежний стол")):
+    # история хранится на сервере (сессия × кампания), сюда уходит только новая реплика
+    session = session or uuid.uuid4().hex
+    typer.echo(f"Начали (сессия {session}; продолжить: --session {session}). Пишите сообщения. /exit для выхода.")
     while True:
         user = input("> ")
         if user.strip() == "/exit":
             break
-        payload = {"history": history, "user": user}
+        payload = {"session": session, "user": user}
         r = requests.post(API, json=payload, timeout=120)
         r.raise_for_status()
         data = r.json()
-        history.append({"role": "user", "content": user})
-        history.append({"role": "assistant", "content": data["narration"]})
         typer.echo("\n--- НАРРАТИВ ---\n" + data["narration"])
         if data.get("intent"):
             typer.echo("\n--- INTENT ---\n" + json.dumps(data["intent"], ensure_ascii=False, indent=2))
         if data.get("tool_result"):
             typer.echo("\n--- TOOL RESULT ---\n" + json.dumps(data["tool_result"], ensure_ascii=False, indent=2))
 
+def _batch_items(path: str):
+    """Пункты из JSONL: `user` (или `body`, как в файлах заявок), `history` (необязательно),
+    `id` (или `request_id`; иначе — номер строки, чтобы --resume узнавал пункт)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            user = rec.get("user") or rec.get("body")
+            if not user:
+                typer.echo(f"строка {n}: нет user — пропущена", err=True)
+                continue
+            yield {"id": str(rec.get("id") or rec.get("request_id") or n), "history": rec.get("history") or [], "user": user}
+
+def _post_batch(payload: dict):
+    # пока модель грузится, сервер отвечает 503 с Retry-After — ждём
+    while True:
+        r = requests.post(API + "/batch", json=payload, stream=True, timeout=(5, None))
+        if r.status_code != 503:
+            r.raise_for_status()
+            r.encoding = "utf-8"
+            return r
+        time.sleep(int(r.headers.get("Retry-After", "2")))
+        r.close()
+
+@app.command()
+def batch(input: str = typer.Argument(..., help="JSONL с пунктами (например, data/logs/chat.jsonl)"),
+          output: str = typer.Option("data/batch_results.jsonl", help="куда дописывать результаты (JSONL)"),
+          concurrency: int = typer.Option(4, help="одновременных ходов на сервере"),
+          chunk: int = typer.Option(32, help="пунктов в одном запросе /chat/batch"),
+          resume: bool = typer.Option(True, help="пропускать пункты, уже успешно записанные в output"),
+          apply_state: bool = typer.Option(False, help="применять броски к текущей кампании"),
+          limit: int = typer.Option(0, help="взять не больше N пунктов (0 — все)")):
+    """Прогон сценариев через POST /chat/batch: результаты дописываются в output по мере готовности,
+    повторный запуск продолжает с недоделанных, в конце — сводка пропускной способности."""
+    done = set()
+    if resume and os.path.exists(output):
+        with open(output, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    if rec.get("ok"):
+                        done.add(rec["id"])
+    items = [it for it in _batch_items(input) if it["id"] not in done]
+    if limit:
+        items = items[:limit]
+    typer.echo(f"пунктов: {len(items)}, уже готово: {len(done)}, параллельно: {concurrency}")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    t0 = time.perf_counter()
+    ok, latencies, stages = 0, [], {}
+    with open(output, "a", encoding="utf-8") as out:
+        for i in range(0, len(items), chunk):
+            payload = {"items": items[i:i + chunk], "concurrency": concurrency, "apply_state": apply_state}
+            with _post_batch(payload) as r:
+                for line in r.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    rec = json.loads(line)
+                    if "summary" in rec:
+                        continue
+                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    out.flush()
+                    latencies.append(rec["latency_ms"])
+                    if rec["ok"]:
+                        ok += 1
+                        for stage, ms in (rec.get("timings") or {}).items():
+                            stages.setdefault(stage, []).append(ms)
+            typer.echo(f"  {min(i + chunk, len(items))}/{len(items)} за {time.perf_counter() - t0:.1f} с")
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    typer.echo("\n--- СВОДКА ---")
+    typer.echo(f"готово: {ok}, ошибок: {len(latencies) - ok}, пропущено (--resume): {len(done)}")
+    if latencies:
+        typer.echo(f"время: {wall:.1f} с, {len(latencies) / wall:.2f} ходов/с")
+        typer.echo(f"задержка хода, мс: p50 {latencies[len(latencies) // 2]:.0f}, "
+                   f"p95 {latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]:.0f}")
+    for stage, xs in stages.items():
+        typer.echo(f"  {stage}: в среднем {sum(xs) / len(xs):.0f} мс")
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+import functools, hashlib, json, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from .llm_backends import LLM, ChatTurn
+from .prompts import SUMMARY_PROMPT_RU
+from .utils import getenv_int
+
+_PER_MESSAGE = 4        # служебные токены шаблона чата на одно сообщение
+_SUMMARY_PRIORITY = 10  # конспект уступает очередь живым ходам
+_SUMMARY_HEADER = "Прежний конспект:\n{summary}\n\nНовые реплики:\n"
+_ANCHOR = 4             # сколько последних свёрнутых реплик сверяется с историей
+
+
+def _digest(turn: Dict[str, str]) -> str:
+    return hashlib.sha1(json.dumps(turn, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _Summary:
+    __slots__ = ("covered", "anchor", "text")
+
+    def __init__(self, covered: int, anchor: tuple, text: str):
+        # номера реплик — абсолютные, с начала сессии: обрезка истории (Session.offset) их не сдвигает
+        self.covered = covered  # сколько первых реплик свёрнуто
+        self.anchor = anchor    # хэши последних из них: конспект годится только для той же истории
+        self.text = text
+
+    @classmethod
+    def of(cls, folded: List[Dict[str, str]], base: int, end: int, text: str) -> "_Summary":
+        """Конспект folded[:end], где folded[0] — реплика номер base."""
+        return cls(base + end, tuple(_digest(t) for t in folded[max(0, end - _ANCHOR):end]), text)
+
+    def matches(self, history: List[Dict[str, str]], offset: int) -> bool:
+        """history[0] — реплика номер offset. Сверяются уцелевшие реплики якоря; если история обрезана
+        дальше конспекта, сверять нечего — конспект продолжает её как есть."""
+        if self.covered > offset + len(history):
+            return False
+        first = self.covered - len(self.anchor)
+        return all(_digest(history[i - offset]) == self.anchor[i - first]
+                   for i in range(max(first, offset), self.covered))
+
+
+class ContextWindow:
+    """Окно контекста для GMAgent.
+
+    Токены считаются токенизатором бэкенда. Свежие реплики идут в модель как есть, старые
+    сворачиваются в конспект кампании. Конспект обновляется инкрементально (прежний конспект +
+    новые свёрнутые реплики) в фоне, с низким приоритетом в очереди модели, — ход его не ждёт.
+    Свёртка запускается заранее, на 5/6 бюджета; если конспект всё же не успел, лишние старые
+    реплики хода просто отбрасываются.
+
+    Бюджет — `BITD_CONTEXT_TOKENS` (по умолчанию размер контекста модели) минус ответ и системный
+    промпт; `BITD_SUMMARY_TOKENS` (400) — длина конспекта. Сворачивается с запасом: после свёртки
+    дословная часть занимает около 2/3 бюджета, поэтому конспект пересчитывается раз в несколько ходов,
+    а префикс промпта между пересчётами не меняется (кэш llama_cpp продолжает попадать).
+    """
+
+    def __init__(self, llm: LLM, budget: int | None = None, reply_tokens: int = 800, max_campaigns: int = 64):
+        self.llm = llm
+        self.budget = budget or getenv_int("BITD_CONTEXT_TOKENS", 0) or llm.n_ctx
+        self.reply_tokens = reply_tokens
+        self.summary_tokens = getenv_int("BITD_SUMMARY_TOKENS", 400)
+        self.max_campaigns = max_campaigns
+        self._count = functools.lru_cache(maxsize=4096)(llm.count_tokens)
+        self._summaries: "OrderedDict[str, _Summary]" = OrderedDict()
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+        self.stats = {"turns": 0, "summarized_turns": 0, "dropped_turns": 0, "summaries": 0, "summary_failed": 0}
+
+    def _tokens(self, turn: Dict[str, str]) -> int:
+        return self._count(turn["content"]) + _PER_MESSAGE
+
+    def _summary_for(self, key: str, history: List[Dict[str, str]], offset: int) -> _Summary | None:
+        with self._lock:
+            s = self._summaries.get(key)
+            if s is not None:
+                self._summaries.move_to_end(key)
+        if s is None or not s.matches(history, offset):
+            return None
+        return s
+
+    def forget(self, key: str) -> None:
+        """Стол начат заново (DELETE /session): его конспект больше не нужен."""
+        with self._lock:
+            self._summaries.pop(key, None)
+
+    def build(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, key: str,
+              offset: int = 0) -> List[ChatTurn]:
+        """Реплики для модели (без системного промпта): [конспект] + свежая история + user_input.
+        offset — сколько первых реплик сессии уже обрезано (Session.offset): history[0] — реплика номер offset."""
+        user = {"role": "user", "content": user_input}
+        avail = self.budget - self.reply_tokens - self._tokens({"content": system_prompt}) - self._tokens(user)
+        summary = self._summary_for(key, history, offset)
+        covered = max(summary.covered - offset, 0) if summary else 0  # индекс в history
+        head: List[Dict[str, str]] = []
+        if summary is not None:
+            head = [{"role": "system", "content": "Краткое содержание предыдущих событий:\n" + summary.text}]
+        recent = history[covered:]
+        costs = [self._tokens(t) for t in recent]
+        room = avail - sum(self._tokens(t) for t in head)
+        total = sum(costs)
+        if total > room * 5 // 6:
+            # окно почти заполнено: свернуть старые реплики так, чтобы осталось ~2/3 бюджета, —
+            # в фоне, заранее, чтобы к переполнению конспект уже был готов
+            target = (avail - self.summary_tokens - _PER_MESSAGE) * 2 // 3
+            split, rest = covered, total
+            while split < len(history) and rest > target:
+                rest -= costs[split - covered]
+                split += 1
+            self._schedule(key, summary, history[covered:split], offset + covered)
+        if total > room:
+            # конспект не успел — этот ход без лишних старых реплик
+            drop = 0
+            while drop < len(recent) and total > room:
+                total -= costs[drop]
+                drop += 1
+            recent = recent[drop:]
+            with self._lock:
+                self.stats["dropped_turns"] += drop
+        with self._lock:
+            self.stats["turns"] += 1
+        return [ChatTurn(**t) for t in head + recent + [user]]
+
+    # ---- фоновый конспект ----
+    def _schedule(self, key: str, summary: _Summary | None, folded: List[Dict[str, str]], base: int) -> None:
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._summarize, key, summary, folded, base)
+
+    def _chunk(self, text: str, folded: List[Dict[str, str]], start: int) -> tuple[int, List[str]]:
+        """Сколько реплик с start влезает в один запрос конспекта: бюджет минус ответ, промпт и прежний
+        конспект. Хотя бы одна реплика берётся всегда — слишком длинная обрезается."""
+        room = (self.budget - self.summary_tokens - self._count(SUMMARY_PROMPT_RU) - self._count(text)
+                - self._count(_SUMMARY_HEADER) - 3 * _PER_MESSAGE)
+        lines: List[str] = []
+        end = start
+        while end < len(folded):
+            line = f"{folded[end]['role']}: {folded[end]['content']}"
+            cost = self._count(line) + 1
+            if cost > room:
+                if not lines:
+                    lines.append(line[:max(1, len(line) * max(room, 1) // cost)])
+                    end += 1
+                break
+            lines.append(line)
+            room -= cost
+            end += 1
+        return end, lines
+
+    def _summarize(self, key: str, summary: _Summary | None, folded: List[Dict[str, str]], base: int) -> None:
+        """Дописывает в конспект folded — реплики с номера base. Запрос не больше бюджета окна: длинный хвост
+        сворачивается за несколько проходов, и после каждого конспект уже годится для ходов."""
+        covered = 0
+        text = summary.text if summary else "(пусто)"
+        while covered < len(folded):
+            end, lines = self._chunk(text, folded, covered)
+            prompt = _SUMMARY_HEADER.format(summary=text) + "\n".join(lines)
+            try:
+                text = self.llm.chat(SUMMARY_PROMPT_RU, [ChatTurn(role="user", content=prompt)],
+                                     max_tokens=self.summary_tokens, key=key, priority=_SUMMARY_PRIORITY).strip()
+            except Exception:  # очередь полна, бэкенд недоступен — попробуем на следующем ходу
+                with self._lock:
+                    self.stats["summary_failed"] += 1
+                    self._pending.discard(key)
+                return
+            with self._lock:
+                self._summaries[key] = _Summary.of(folded, base, end, text)
+                self._summaries.move_to_end(key)
+                while len(self._summaries) > self.max_campaigns:
+                    self._summaries.popitem(last=False)
+                self.stats["summaries"] += 1
+                self.stats["summarized_turns"] += end - covered
+            covered = end
+        with self._lock:
+            self._pending.discard(key)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"budget": self.budget, "summary_tokens": self.summary_tokens,
+                    "campaigns": {k: s.covered for k, s in self._summaries.items()},
+                    "pending": sorted(self._pending), **self.stats}
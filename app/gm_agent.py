@@ -1,15 +1,138 @@
 
 from __future__ import annotations
-import json, re, os
-from typing import Dict, Any, List
+import asyncio, json, re, os, threading, time
+from collections import deque
+from typing import Dict, Any, Iterator, List
 
 from .llm_backends import LLM, ChatTurn
-from .prompts import SYSTEM_PROMPT_RU
+from .context import ContextWindow
+from .prompts import (SYSTEM_PROMPT_RU, STRUCTURED_SUFFIX_RU, TURN_SCHEMA, INTENT_SCHEMA,
+                      INTENT_PROMPT_RU, NARRATION_PROMPT_RU)
 from .tools import action_roll, resistance_roll, fortune_roll, effect_to_segments
 from .state import StateStore
 
 JSON_BLOCK_RE = re.compile(r"""```json\s*(\{.*?\})\s*```""", re.DOTALL | re.IGNORECASE)
 
+class _Rollback(Exception):
+    """Откатывает транзакцию пробного хода (пакетный прогон без изменения кампании)."""
+
+class _IntentScanner:
+    """Инкрементальный поиск ```json {...}``` в потоке токенов.
+
+    feed() возвращает (нарратив, который уже можно показать, текст закрытого json-блока или None).
+    Хвост, похожий на начало ограды ```json, придерживается до следующего куска.
+    """
+    FENCE = "```json"
+    OPEN_RE = re.compile(r"```json\s*", re.IGNORECASE)
+
+    def __init__(self):
+        self.buf = ""
+        self.fence = ""
+        self.in_block = False
+
+    def feed(self, chunk: str) -> tuple[str, str | None]:
+        self.buf += chunk
+        out, block = "", None
+        while True:
+            if self.in_block:
+                end = self.buf.find("```")
+                if end < 0:
+                    return out, block
+                found, self.buf, self.in_block = self.buf[:end], self.buf[end + 3:], False
+                if block is None:
+                    block = found
+                continue
+            m = self.OPEN_RE.search(self.buf)
+            if m and m.end() < len(self.buf):  # пробелы после ограды могут ещё прийти
+                out += self.buf[:m.start()]
+                self.fence, self.buf, self.in_block = m.group(0), self.buf[m.end():], True
+                continue
+            keep = len(self.buf)
+            for i in range(max(0, len(self.buf) - len(self.FENCE) - 2), len(self.buf)):
+                tail = self.buf[i:].lower()
+                if self.FENCE.startswith(tail) or tail.startswith(self.FENCE):
+                    keep = i
+                    break
+            out, self.buf = out + self.buf[:keep], self.buf[keep:]
+            return out, block
+
+    def finish(self) -> str:
+        rest = (self.fence + self.buf) if self.in_block else self.buf  # незакрытый блок остаётся текстом, как в step()
+        self.buf, self.in_block = "", False
+        return rest
+
+class _StructuredScanner:
+    """То же для ответа-объекта {"intent", "proposed", "narration"} (BITD_STRUCTURED=1).
+
+    Блок намерения — всё до ключа narration (плюс закрывающая скобка), текст — содержимое
+    строки narration с раскрытыми escape-последовательностями. Незаконченный escape в конце
+    куска придерживается до следующего.
+    """
+    NARRATION_RE = re.compile(r',\s*"narration"\s*:\s*"')
+
+    def __init__(self):
+        self.buf = ""
+        self.started = False
+        self.closed = False
+
+    def feed(self, chunk: str) -> tuple[str, str | None]:
+        if self.closed:
+            return "", None
+        self.buf += chunk
+        block = None
+        if not self.started:
+            m = self.NARRATION_RE.search(self.buf)
+            if not m:
+                return "", None
+            block, self.buf, self.started = self.buf[:m.start()] + "}", self.buf[m.end():], True
+        out: List[str] = []
+        b, i = self.buf, 0
+        while i < len(b):
+            c = b[i]
+            if c == '"':
+                self.closed = True
+                break
+            if c == "\\":
+                n = 2
+                if b[i + 1:i + 2] == "u":
+                    n = 12 if b[i + 2:i + 4].lower() in ("d8", "d9", "da", "db") else 6  # суррогатная пара — целиком
+                if i + n > len(b):
+                    break
+                out.append(json.loads('"' + b[i:i + n] + '"'))
+                i += n
+                continue
+            out.append(c)
+            i += 1
+        self.buf = "" if self.closed else b[i:]
+        return "".join(out), block
+
+    def finish(self) -> str:
+        self.buf = ""
+        return ""
+
+def _ms(**spans: tuple[float, float]) -> Dict[str, float]:
+    return {name: round((end - start) * 1000, 1) for name, (start, end) in spans.items()}
+
+class _StageTimings:
+    """p50/p95 длительности этапов хода (generate | intent, roll, narration) по последним 512 ходам."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+
+    def record(self, timings: Dict[str, float]) -> None:
+        with self._lock:
+            for stage, ms in timings.items():
+                self._samples.setdefault(stage, deque(maxlen=512)).append(ms)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for stage, xs in self._samples.items():
+                xs = sorted(xs)
+                out[stage] = {"count": len(xs), "p50": xs[len(xs) // 2], "p95": xs[min(len(xs) - 1, int(0.95 * len(xs)))]}
+            return out
+
 def _truthy(x):
     if isinstance(x, bool): return x
     try:
@@ -18,10 +141,53 @@ def _truthy(x):
     except Exception: pass
     return False
 
+def _intent_overrides() -> Dict[str, Any]:
+    """Настройки llama_cpp для модели намерения — свои, не основной модели: черновик LLAMA_DRAFT_MODEL_PATH
+    делит словарь с основной моделью, а дисковый кэш префиксов — её каталог.
+    LLAMA_INTENT_SPECULATIVE (off), LLAMA_INTENT_DRAFT_MODEL_PATH, LLAMA_INTENT_CACHE (ram),
+    LLAMA_INTENT_CACHE_DIR (data/llama_cache_intent), LLAMA_INTENT_MLOCK (0)."""
+    speculative = os.getenv("LLAMA_INTENT_SPECULATIVE", "off")
+    draft = os.getenv("LLAMA_INTENT_DRAFT_MODEL_PATH", "")
+    if speculative.strip().lower() == "draft" and not draft:
+        raise RuntimeError("LLAMA_INTENT_SPECULATIVE=draft: укажите LLAMA_INTENT_DRAFT_MODEL_PATH")
+    return {"speculative": speculative, "draft_path": draft or None,
+            "cache": os.getenv("LLAMA_INTENT_CACHE", "ram"),
+            "cache_dir": os.getenv("LLAMA_INTENT_CACHE_DIR", "data/llama_cache_intent"),
+            "mlock": _truthy(os.getenv("LLAMA_INTENT_MLOCK", "0"))}
+
 class GMAgent:
     def __init__(self, state: StateStore):
         self.llm = LLM()
+        # BITD_STRUCTURED=1: ответ — JSON по TURN_SCHEMA (грамматика llama_cpp / json_schema OpenAI),
+        # намерение всегда разбирается, а не ищется регуляркой в свободном тексте
+        self.structured = _truthy(os.getenv("BITD_STRUCTURED", "0"))
+        self.system_prompt = SYSTEM_PROMPT_RU + STRUCTURED_SUFFIX_RU if self.structured else SYSTEM_PROMPT_RU
+        self.schema = TURN_SCHEMA if self.structured else None
+        # BITD_PIPELINE=two_stage: короткий вызов по INTENT_SCHEMA даёт намерение, бросок выполняется сразу,
+        # нарратив пишется отдельным вызовом, уже зная результат. Намерение может считать отдельная быстрая
+        # модель: LLAMA_INTENT_MODEL_PATH / OPENAI_INTENT_MODEL (иначе — основная)
+        self.two_stage = os.getenv("BITD_PIPELINE", "single").strip().lower() == "two_stage"
+        self.intent_tokens = int(os.getenv("BITD_INTENT_TOKENS", "200"))
+        self.intent_llm = self.llm
+        if self.two_stage:
+            intent_model = os.getenv("LLAMA_INTENT_MODEL_PATH" if self.llm.local else "OPENAI_INTENT_MODEL")
+            if intent_model:
+                overrides = _intent_overrides() if self.llm.local else {}
+                self.intent_llm = LLM(model=intent_model, workers=1, name="llama-intent", **overrides)
+        self.stages = _StageTimings()
+        self.batch_stages = _StageTimings()  # ходы /chat/batch — отдельно, чтобы не искажать живые
+        self._log_lock = threading.Lock()  # параллельные ходы дописывают chat.jsonl по одному
         self.state = state
+        self.context = ContextWindow(self.llm)
+
+    def warmup(self) -> None:
+        """Прогрев моделей их промптами (LLM.warmup): системный промпт общий для всех кампаний —
+        считаем его заранее, первый ход не платит за загрузку весов и кэш."""
+        if self.two_stage:
+            self.intent_llm.warmup(INTENT_PROMPT_RU)
+            self.llm.warmup(NARRATION_PROMPT_RU)
+        else:
+            self.llm.warmup(self.system_prompt)
 
     def _extract_intent(self, text: str):
         m = JSON_BLOCK_RE.search(text)
@@ -34,6 +200,20 @@ class GMAgent:
         narration = JSON_BLOCK_RE.sub("", text).strip()
         return intent, narration
 
+    def _parse(self, raw: str):
+        """(intent, narration, raw в обычном формате ```json ...``` + нарратив — для логов и датасета)."""
+        if self.structured:
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                data = None  # обрезан по max_tokens — разбираем как свободный текст
+            if isinstance(data, dict):
+                narration = str(data.pop("narration", "")).strip()
+                intent = data if "intent" in data else None
+                return intent, narration, self._canonical(intent, narration)
+        intent, narration = self._extract_intent(raw)
+        return intent, narration, raw
+
     def _dice_from_actor_and_mods(self, actor: str | None, action: str | None, proposed: Dict[str, Any]) -> int:
         # harm penalty
         guess = int(proposed.get("dice_guess", 1))
@@ -83,123 +263,286 @@ class GMAgent:
         if quality == "critical":
             self.state.add_crew_xp(1)
 
-    def step(self, history: List[Dict[str, str]], user_input: str, log_dir: str | None = "data/logs") -> Dict[str, Any]:
-        turns = [ChatTurn(**h) for h in history] + [ChatTurn(role="user", content=user_input)]
-        raw = self.llm.chat(SYSTEM_PROMPT_RU, turns)
-        intent, narration = self._extract_intent(raw)
-
+    def _apply_intent(self, intent: Dict[str, Any], user_input: str) -> Dict[str, Any] | None:
         tool_result = None
-        if intent and "intent" in intent:
-            typ = intent["intent"]
-            proposed = intent.get("proposed", {})
-            if typ == "ask_for_action_roll":
-                if not proposed.get("position") or not proposed.get("effect"):
-                    inf = self._infer_position_effect(user_input)
-                    if inf:
-                        proposed.setdefault("position", inf.get("position"))
-                        proposed.setdefault("effect", inf.get("effect"))
-                actor = proposed.get("actor")
-                action = proposed.get("action")
-                dice = self._dice_from_actor_and_mods(actor, action, proposed)
-                res = action_roll(int(dice))
-                eff = proposed.get("effect", "Обычный")
-                pos = proposed.get("position", None)
-                target = proposed.get("target_clock", None)
-                cons_suggest = None
-                if pos and res["quality"] in ("partial","bad"):
-                    cons_suggest = self.state.consequence_suggest(pos, res["quality"])
-                # Fill target clock on success
-                if res["quality"] in ("full", "critical", "partial") and target and isinstance(target, dict):
-                    name = target.get("name")
-                    if name:
-                        segments = effect_to_segments(eff)
-                        try:
-                            self.state.fill_clock(name, segments)
-                        except Exception:
-                            segs = int(target.get("segments", 4))
-                            self.state.upsert_clock(name, segs)
-                            self.state.fill_clock(name, segments)
-                # Side-effects: assist costs 1 stress to helper; group action: leader takes failures stress
+        typ = intent["intent"]
+        proposed = intent.get("proposed", {})
+        if typ == "ask_for_action_roll":
+            if not proposed.get("position") or not proposed.get("effect"):
+                inf = self._infer_position_effect(user_input)
+                if inf:
+                    proposed.setdefault("position", inf.get("position"))
+                    proposed.setdefault("effect", inf.get("effect"))
+            actor = proposed.get("actor")
+            action = proposed.get("action")
+            dice = self._dice_from_actor_and_mods(actor, action, proposed)
+            res = action_roll(int(dice))
+            eff = proposed.get("effect", "Обычный")
+            pos = proposed.get("position", None)
+            target = proposed.get("target_clock", None)
+            cons_suggest = None
+            if pos and res["quality"] in ("partial","bad"):
+                cons_suggest = self.state.consequence_suggest(pos, res["quality"])
+            # Fill target clock on success
+            if res["quality"] in ("full", "critical", "partial") and target and isinstance(target, dict):
+                name = target.get("name")
+                if name:
+                    segments = effect_to_segments(eff)
+                    try:
+                        self.state.fill_clock(name, segments)
+                    except Exception:
+                        segs = int(target.get("segments", 4))
+                        self.state.upsert_clock(name, segs)
+                        self.state.fill_clock(name, segments)
+            # Side-effects: assist costs 1 stress to helper; group action: leader takes failures stress
+            try:
+                if _truthy(proposed.get("assist")) and proposed.get("assist_actor"):
+                    cur = self.state.get(); old = int(cur.get("players", {}).get(proposed.get("assist_actor"), {}).get("stress", 0)); self.state.set_stress(proposed.get("assist_actor"), old + 1)
+                if _truthy(proposed.get("group_action")) and proposed.get("leader"):
+                    fails = int(proposed.get("group_failures", 0) or 0)
+                    if fails>0:
+                        cur = self.state.get(); old = int(cur.get("players", {}).get(proposed.get("leader"), {}).get("stress", 0)); self.state.set_stress(proposed.get("leader"), old + fails)
+            except Exception:
+                pass
+            # House rules
+            self._apply_house_rep_heat(res["quality"])
+            self._apply_house_xp(pos, actor, res["quality"])
+            # Tool result & banner
+            tool_result = {
+                "type": "action_roll", "dice": int(dice), **res,
+                "actor": actor, "action": action,
+                "position": pos, "effect": eff,
+                "consequences": cons_suggest or [],
+                "modifiers": {"setup": bool(_truthy(proposed.get("setup"))), "assist_actor": proposed.get("assist_actor"),
+                    "assist": bool(_truthy(proposed.get("assist"))),
+                    "push": bool(_truthy(proposed.get("push"))),
+                    "bargain": bool(_truthy(proposed.get("bargain"))),
+                    "bonus": int(proposed.get("bonus", 0) or 0),
+                }
+            }
+            self.state.set_last_roll({
+                "kind": "action",
+                "actor": actor, "action": action,
+                "position": pos, "effect": eff,
+                "dice": int(dice), "rolls": res["rolls"], "best": res["best"],
+                "quality": res["quality"], "crit": res["crit"],
+                "modifiers": tool_result["modifiers"],
+                "target_clock": proposed.get("target_clock") if isinstance(proposed.get("target_clock"), dict) else None,
+                "consequences": cons_suggest or []
+            })
+
+        elif typ == "resist_prompt":
+            dice = int(proposed.get("dice_guess", 1))
+            actor = proposed.get("actor")
+            res = resistance_roll(dice)
+            if actor:
                 try:
-                    if _truthy(proposed.get("assist")) and proposed.get("assist_actor"):
-                        cur = self.state.get(); old = int(cur.get("players", {}).get(proposed.get("assist_actor"), {}).get("stress", 0)); self.state.set_stress(proposed.get("assist_actor"), old + 1)
-                    if _truthy(proposed.get("group_action")) and proposed.get("leader"):
-                        fails = int(proposed.get("group_failures", 0) or 0)
-                        if fails>0:
-                            cur = self.state.get(); old = int(cur.get("players", {}).get(proposed.get("leader"), {}).get("stress", 0)); self.state.set_stress(proposed.get("leader"), old + fails)
+                    cur = self.state.get()
+                    old = int(cur.get("players", {}).get(actor, {}).get("stress", 0))
+                    self.state.set_stress(actor, old + int(res["stress_cost"]))
                 except Exception:
                     pass
-                # House rules
-                self._apply_house_rep_heat(res["quality"])
-                self._apply_house_xp(pos, actor, res["quality"])
-                # Tool result & banner
-                tool_result = {
-                    "type": "action_roll", "dice": int(dice), **res,
-                    "actor": actor, "action": action,
-                    "position": pos, "effect": eff,
-                    "consequences": cons_suggest or [],
-                    "modifiers": {"setup": bool(_truthy(proposed.get("setup"))), "assist_actor": proposed.get("assist_actor"),
-                        "assist": bool(_truthy(proposed.get("assist"))),
-                        "push": bool(_truthy(proposed.get("push"))),
-                        "bargain": bool(_truthy(proposed.get("bargain"))),
-                        "bonus": int(proposed.get("bonus", 0) or 0),
-                    }
-                }
-                self.state.set_last_roll({
-                    "kind": "action",
-                    "actor": actor, "action": action,
-                    "position": pos, "effect": eff,
-                    "dice": int(dice), "rolls": res["rolls"], "best": res["best"],
-                    "quality": res["quality"], "crit": res["crit"],
-                    "modifiers": tool_result["modifiers"],
-                    "target_clock": proposed.get("target_clock") if isinstance(proposed.get("target_clock"), dict) else None,
-                    "consequences": cons_suggest or []
-                })
-
-            elif typ == "resist_prompt":
-                dice = int(proposed.get("dice_guess", 1))
-                actor = proposed.get("actor")
-                res = resistance_roll(dice)
-                if actor:
-                    try:
-                        cur = self.state.get()
-                        old = int(cur.get("players", {}).get(actor, {}).get("stress", 0))
-                        self.state.set_stress(actor, old + int(res["stress_cost"]))
-                    except Exception:
-                        pass
-                tool_result = {"type": "resistance", "dice": dice, **res, "actor": actor}
-                self.state.set_last_roll({"kind": "resist", "actor": actor, "dice": dice, "rolls": res["rolls"], "best": res["best"], "stress_cost": res["stress_cost"]})
-
-            elif typ == "fortune_roll":
-                dice = int(proposed.get("dice_guess", 1))
-                res = fortune_roll(dice)
-                tool_result = {"type": "fortune", "dice": dice, **res}
-                self.state.set_last_roll({"kind": "fortune", "dice": dice, "rolls": res["rolls"], "best": res["best"]})
-
-            elif typ == "engagement":
-                dice = int(proposed.get("dice_guess", 1))
-                res = fortune_roll(dice)
-                pos = "Отчаянная" if res["best"] <= 3 else ("Рискованная" if res["best"] <= 5 else "Контролируемая")
-                tool_result = {"type": "engagement", "dice": dice, **res, "start_position": pos}
-                self.state.set_last_roll({"kind": "engagement", "dice": dice, "rolls": res["rolls"], "best": res["best"], "start_position": pos})
-
-            elif typ == "downtime":
-                tool_result = {"type": "downtime_ack"}
-                self.state.set_last_roll({"kind": "downtime"})
-
-        # logging
+            tool_result = {"type": "resistance", "dice": dice, **res, "actor": actor}
+            self.state.set_last_roll({"kind": "resist", "actor": actor, "dice": dice, "rolls": res["rolls"], "best": res["best"], "stress_cost": res["stress_cost"]})
+
+        elif typ == "fortune_roll":
+            dice = int(proposed.get("dice_guess", 1))
+            res = fortune_roll(dice)
+            tool_result = {"type": "fortune", "dice": dice, **res}
+            self.state.set_last_roll({"kind": "fortune", "dice": dice, "rolls": res["rolls"], "best": res["best"]})
+
+        elif typ == "engagement":
+            dice = int(proposed.get("dice_guess", 1))
+            res = fortune_roll(dice)
+            pos = "Отчаянная" if res["best"] <= 3 else ("Рискованная" if res["best"] <= 5 else "Контролируемая")
+            tool_result = {"type": "engagement", "dice": dice, **res, "start_position": pos}
+            self.state.set_last_roll({"kind": "engagement", "dice": dice, "rolls": res["rolls"], "best": res["best"], "start_position": pos})
+
+        elif typ == "downtime":
+            tool_result = {"type": "downtime_ack"}
+            self.state.set_last_roll({"kind": "downtime"})
+        return tool_result
+
+    def _run_intent(self, intent: Dict[str, Any] | None, user_input: str, commit: bool = True) -> Dict[str, Any] | None:
+        if not intent or "intent" not in intent:
+            return None
+        # бросок, часы, стресс, rep/heat, XP и last_roll — одной записью состояния
+        if commit:
+            with self.state.transaction():
+                return self._apply_intent(intent, user_input)
+        # commit=False: бросок по текущему состоянию, но транзакция откатывается
+        result = None
+        try:
+            with self.state.transaction():
+                result = self._apply_intent(intent, user_input)
+                raise _Rollback
+        except _Rollback:
+            pass
+        return result
+
+    def _narration_turns(self, turns: List[ChatTurn], intent: Dict[str, Any] | None, tool_result: Dict[str, Any] | None) -> List[ChatTurn]:
+        # в последнюю реплику игрока, а не отдельным system после неё: шаблоны чата и строгие серверы
+        # такое отвергают, а системный промпт остаётся неизменным и его префикс — в кэше
+        note = ("[Система] Намерение: " + json.dumps(intent, ensure_ascii=False) +
+                "\n[Система] Результат: " + json.dumps(tool_result, ensure_ascii=False))
+        last = turns[-1]
+        return turns[:-1] + [ChatTurn(role=last.role, content=last.content + "\n\n" + note)]
+
+    @staticmethod
+    def _load_intent(raw: str) -> Dict[str, Any] | None:
+        try:
+            intent = json.loads(raw)
+        except ValueError:
+            return None  # обрезано по BITD_INTENT_TOKENS
+        return intent if isinstance(intent, dict) and "intent" in intent else None
+
+    @staticmethod
+    def _canonical(intent: Dict[str, Any] | None, narration: str) -> str:
+        if intent is None:
+            return narration
+        return "```json\n" + json.dumps(intent, ensure_ascii=False, indent=2) + "\n```\n" + narration
+
+    def _finish(self, history, user_input: str, log_dir: str | None, raw: str, narration: str, intent, tool_result,
+                timings: Dict[str, float], stages: _StageTimings | None = None) -> Dict[str, Any]:
+        (stages or self.stages).record(timings)
+        self._log(log_dir, history, user_input, raw, narration, intent, tool_result)
+        return {"raw": raw, "narration": narration, "intent": intent, "tool_result": tool_result, "timings": timings}
+
+    # key — стол: ключ окна контекста и честной очереди (по умолчанию текущая кампания; у серверных
+    # сессий — кампания/сессия, чтобы у столов одной кампании были свои конспекты); offset — сколько
+    # первых реплик стола уже обрезано из history (Session.offset)
+    def step(self, history: List[Dict[str, str]], user_input: str, log_dir: str | None = "data/logs", priority: int = 0,
+             key: str | None = None, offset: int = 0) -> Dict[str, Any]:
+        key = key or self.state.current_campaign()
+        turns = self.context.build(self.system_prompt, history, user_input, key, offset)
+        t0 = time.perf_counter()
+        if self.two_stage:
+            intent = self._load_intent(self.intent_llm.chat(INTENT_PROMPT_RU, turns, self.intent_tokens, key=key,
+                                                            priority=priority, schema=INTENT_SCHEMA))
+            t1 = time.perf_counter()
+            tool_result = self._run_intent(intent, user_input)
+            t2 = time.perf_counter()
+            narration = self.llm.chat(NARRATION_PROMPT_RU, self._narration_turns(turns, intent, tool_result), key=key,
+                                      priority=priority, admitted=True).strip()
+            timings = _ms(intent=(t0, t1), roll=(t1, t2), narration=(t2, time.perf_counter()))
+            raw = self._canonical(intent, narration)
+        else:
+            raw = self.llm.chat(self.system_prompt, turns, key=key, priority=priority, schema=self.schema)
+            t1 = time.perf_counter()
+            intent, narration, raw = self._parse(raw)
+            tool_result = self._run_intent(intent, user_input)
+            timings = _ms(generate=(t0, t1), roll=(t1, time.perf_counter()))
+        return self._finish(history, user_input, log_dir, raw, narration, intent, tool_result, timings)
+
+    async def astep(self, history: List[Dict[str, str]], user_input: str, log_dir: str | None = "data/logs", priority: int = 0,
+                    key: str | None = None, commit: bool = True, stages: _StageTimings | None = None,
+                    offset: int = 0) -> Dict[str, Any]:
+        """Асинхронный step(): ожидание модели не держит поток; работа с состоянием и лог —
+        в default-executor (файловый ввод-вывод короткий, но блокирующий). commit=False — ход
+        без записи в кампанию (пакетные прогоны): бросок делается, изменения откатываются.
+        stages — куда записать времена этапов (по умолчанию self.stages; пакет — self.batch_stages)."""
+        key = key or await asyncio.to_thread(self.state.current_campaign)
+        turns = await asyncio.to_thread(self.context.build, self.system_prompt, history, user_input, key, offset)
+        t0 = time.perf_counter()
+        if self.two_stage:
+            intent = self._load_intent(await self.intent_llm.achat(INTENT_PROMPT_RU, turns, self.intent_tokens, key=key,
+                                                                   priority=priority, schema=INTENT_SCHEMA))
+            t1 = time.perf_counter()
+            tool_result = await asyncio.to_thread(self._run_intent, intent, user_input, commit)
+            t2 = time.perf_counter()
+            narration = (await self.llm.achat(NARRATION_PROMPT_RU, self._narration_turns(turns, intent, tool_result), key=key,
+                                              priority=priority, admitted=True)).strip()
+            timings = _ms(intent=(t0, t1), roll=(t1, t2), narration=(t2, time.perf_counter()))
+            raw = self._canonical(intent, narration)
+        else:
+            raw = await self.llm.achat(self.system_prompt, turns, key=key, priority=priority, schema=self.schema)
+            t1 = time.perf_counter()
+            intent, narration, raw = self._parse(raw)
+            tool_result = await asyncio.to_thread(self._run_intent, intent, user_input, commit)
+            timings = _ms(generate=(t0, t1), roll=(t1, time.perf_counter()))
+        return await asyncio.to_thread(self._finish, history, user_input, log_dir, raw, narration, intent, tool_result, timings, stages)
+
+    def step_stream(self, history: List[Dict[str, str]], user_input: str, log_dir: str | None = "data/logs", priority: int = 0,
+                    key: str | None = None, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """Потоковый step(): события {"type": "token" | "intent" | "tool_result" | "done", ...}.
+
+        Бросок выполняется сразу, как только закрылся json-блок намерения, — нарратив
+        после него ещё генерируется. "done" несёт то же, что возвращает step().
+        Запрос к модели ставится в очередь при вызове (QueueFull — здесь, до первого события).
+        """
+        key = key or self.state.current_campaign()
+        turns = self.context.build(self.system_prompt, history, user_input, key, offset)
+        t0 = time.perf_counter()
+        if self.two_stage:
+            pieces = self.intent_llm.chat_stream(INTENT_PROMPT_RU, turns, self.intent_tokens, key=key,
+                                                 priority=priority, schema=INTENT_SCHEMA)
+            return self._two_stage_events(pieces, turns, key, priority, history, user_input, log_dir, t0)
+        pieces = self.llm.chat_stream(self.system_prompt, turns, key=key, priority=priority, schema=self.schema)
+        return self._stream_events(pieces, history, user_input, log_dir, t0)
+
+    def _two_stage_events(self, pieces: Iterator[str], turns: List[ChatTurn], key: str, priority: int,
+                          history, user_input: str, log_dir: str | None, t0: float) -> Iterator[Dict[str, Any]]:
+        intent = self._load_intent("".join(pieces))
+        t1 = time.perf_counter()
+        if intent is not None:
+            yield {"type": "intent", "intent": intent}
+        tool_result = self._run_intent(intent, user_input)
+        if tool_result is not None:
+            yield {"type": "tool_result", "tool_result": tool_result}
+        t2 = time.perf_counter()
+        parts: List[str] = []
+        for piece in self.llm.chat_stream(NARRATION_PROMPT_RU, self._narration_turns(turns, intent, tool_result), key=key,
+                                          priority=priority, admitted=True):
+            parts.append(piece)
+            yield {"type": "token", "text": piece}
+        narration = "".join(parts).strip()
+        timings = _ms(intent=(t0, t1), roll=(t1, t2), narration=(t2, time.perf_counter()))
+        out = self._finish(history, user_input, log_dir, self._canonical(intent, narration), narration, intent, tool_result, timings)
+        yield {"type": "done", **out}
+
+    def _stream_events(self, pieces: Iterator[str], history, user_input: str, log_dir: str | None, t0: float) -> Iterator[Dict[str, Any]]:
+        scanner = _StructuredScanner() if self.structured else _IntentScanner()
+        parts: List[str] = []
+        intent, tool_result, fired = None, None, False
+        roll_ms = 0.0
+        for piece in pieces:
+            parts.append(piece)
+            text, block = scanner.feed(piece)
+            if text:
+                yield {"type": "token", "text": text}
+            if block is not None and not fired:
+                fired = True
+                try:
+                    intent = json.loads(block)
+                except Exception:
+                    intent = None
+                if intent is not None:
+                    yield {"type": "intent", "intent": intent}
+                    began = time.perf_counter()
+                    tool_result = self._run_intent(intent, user_input)
+                    roll_ms = (time.perf_counter() - began) * 1000
+                    if tool_result is not None:
+                        yield {"type": "tool_result", "tool_result": tool_result}
+        text = scanner.finish()
+        if text:
+            yield {"type": "token", "text": text}
+        _, narration, raw = self._parse("".join(parts))
+        timings = {"generate": round((time.perf_counter() - t0) * 1000 - roll_ms, 1), "roll": round(roll_ms, 1)}
+        out = self._finish(history, user_input, log_dir, raw, narration, intent, tool_result, timings)
+        yield {"type": "done", **out}
+
+    def _log(self, log_dir, history, user_input, raw, narration, intent, tool_result) -> None:
         if log_dir:
             os.makedirs(log_dir, exist_ok=True)
             path = os.path.join(log_dir, "chat.jsonl")
-            with open(path, "a", encoding="utf-8") as f:
-                rec = {
-                    "history": [h for h in history],
-                    "user": user_input,
-                    "assistant_raw": raw,
-                    "assistant_narration": narration,
-                    "assistant_intent": intent,
-                    "tool_result": tool_result,
-                }
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-
-        return {"raw": raw, "narration": narration, "intent": intent, "tool_result": tool_result}
+            rec = {
+                "history": [h for h in history],
+                "user": user_input,
+                "assistant_raw": raw,
+                "assistant_narration": narration,
+                "assistant_intent": intent,
+                "tool_result": tool_result,
+            }
+            line = json.dumps(rec, ensure_ascii=False) + "\n"
+            with self._log_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(line)
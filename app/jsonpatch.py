@@ -0,0 +1,100 @@
+from __future__ import annotations
+from typing import Any, Dict, List
+
+# Минимальный JSON Patch (RFC 6902): только add / remove / replace.
+# Достаточно для состояния кампании — там лишь dict, list и скаляры.
+
+
+def _esc(key: Any) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unesc(part: str) -> str:
+    return part.replace("~1", "/").replace("~0", "~")
+
+
+def pointer(*parts: Any) -> str:
+    return "".join("/" + _esc(p) for p in parts)
+
+
+def split_pointer(path: str) -> List[str]:
+    if not path:
+        return []
+    if not path.startswith("/"):
+        raise ValueError(f"Неверный JSON pointer: {path!r}")
+    return [_unesc(p) for p in path[1:].split("/")]
+
+
+def _same(a: Any, b: Any) -> bool:
+    """Равенство с учётом типов: для JSON `1`, `1.0` и `true` — разные значения, хотя в Python они равны."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(v, b[k]) for k, v in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def diff(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """Список операций, превращающих old в new."""
+    if old is new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: List[Dict[str, Any]] = []
+        for k in old:
+            if k not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_esc(k)}"})
+        for k, v in new.items():
+            p = f"{path}/{_esc(k)}"
+            if k not in old:
+                ops.append({"op": "add", "path": p, "value": v})
+            elif not _same(old[k], v):
+                ops.extend(diff(old[k], v, p))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        n = len(old)
+        if len(new) >= n and _same(new[:n], old):
+            return [{"op": "add", "path": f"{path}/{i}", "value": new[i]} for i in range(n, len(new))]
+        if len(new) == n:
+            ops = []
+            for i in range(n):
+                if not _same(old[i], new[i]):
+                    ops.extend(diff(old[i], new[i], f"{path}/{i}"))
+            return ops
+        return [{"op": "replace", "path": path, "value": new}]
+    if _same(old, new):
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def apply(doc: Any, ops: List[Dict[str, Any]]) -> Any:
+    """Применяет операции к doc на месте; возвращает doc (или новый корень при path="")."""
+    for op in ops:
+        parts = split_pointer(op["path"])
+        kind = op["op"]
+        if not parts:
+            if kind == "remove":
+                raise ValueError("Нельзя удалить корень документа")
+            doc = op["value"]
+            continue
+        parent = doc
+        for p in parts[:-1]:
+            parent = parent[int(p)] if isinstance(parent, list) else parent[p]
+        last = parts[-1]
+        if isinstance(parent, list):
+            if kind == "add":
+                if last == "-":
+                    parent.append(op["value"])
+                else:
+                    parent.insert(int(last), op["value"])
+            elif kind == "remove":
+                parent.pop(int(last))
+            else:
+                parent[int(last)] = op["value"]
+        else:
+            if kind == "remove":
+                parent.pop(last, None)
+            else:
+                parent[last] = op["value"]
+    return doc
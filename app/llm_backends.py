@@ -1,68 +1,455 @@
 
 from __future__ import annotations
-from typing import List
-import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List
+import asyncio, os, threading, time
 
 from pydantic import BaseModel
-from .utils import getenv_str, getenv_int, load_env
+from .utils import getenv_str, getenv_int, getenv_float, getenv_bool, load_env
+from .scheduler import InferenceScheduler
+from .response_cache import ResponseCache, cache_key
+from .resilience import CircuitBreaker, RetryPolicy
 
-LLAMA_OK = True
-OPENAI_OK = True
-try:
-    from llama_cpp import Llama
-except Exception:
-    LLAMA_OK = False
-
-try:
-    from openai import OpenAI
-except Exception:
-    OPENAI_OK = False
+# llama_cpp, openai/httpx и tiktoken импортируются в init выбранного бэкенда: импорт модуля дешёвый,
+# а сервер поднимается, не дожидаясь библиотек, которые ему, может быть, вообще не нужны
+if TYPE_CHECKING:
+    from .model_pool import ModelPool
 
 class ChatTurn(BaseModel):
     role: str
     content: str
 
-class LLM:
+# синтетическая реплика для прогрева: короткая, в духе игры, чтобы шаблон чата был тем же
+WARMUP_USER_RU = "Кот осматривается на крыше склада. Что он видит?"
+
+class _Health:
+    """Прогрев и задержка генераций — для /health."""
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self.warmup_s: float | None = None
+        self.last_ms: float | None = None
+        self.last_at: float | None = None
+        self.last_error: str | None = None
+        self.counters = {"inferences": 0, "errors": 0}
+
+    def warmed(self, seconds: float) -> None:
+        with self._lock:
+            self.warmup_s = seconds
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.last_ms, self.last_at = seconds * 1000, time.time()
+            self.counters["inferences"] += 1
+
+    def error(self, e: BaseException) -> None:
+        with self._lock:
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.counters["errors"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"warmup_s": None if self.warmup_s is None else round(self.warmup_s, 3),
+                    "last_inference_ms": None if self.last_ms is None else round(self.last_ms, 1),
+                    "last_inference_age_s": None if self.last_at is None else round(time.time() - self.last_at, 1),
+                    "last_error": self.last_error, **self.counters}
+
+class LLM:
+    """Клиент модели. Бэкенд выбирает LLM_BACKEND по реестру BACKENDS (см. register_backend).
+    model/workers переопределяют LLAMA_MODEL_PATH или OPENAI_MODEL и LLAMA_WORKERS — так GMAgent
+    поднимает отдельную быструю модель для этапа намерения. overrides — настройки llama_cpp вместо .env
+    (speculative, draft_path, cache, cache_dir, mlock; None — из .env): черновик и кэш основной модели
+    другой модели не подходят."""
+
+    def __init__(self, model: str | None = None, workers: int | None = None, name: str = "llama", **overrides: Any):
         load_env()
+        self.overrides = overrides
         self.backend = getenv_str("LLM_BACKEND", "llama_cpp")
-        if self.backend == "llama_cpp" and not LLAMA_OK:
-            raise RuntimeError("llama-cpp-python не установлен")
-        if self.backend == "openai" and not OPENAI_OK:
-            raise RuntimeError("openai не установлен")
+        init = BACKENDS.get(self.backend)
+        if init is None:
+            raise RuntimeError(f"Неизвестный LLM_BACKEND={self.backend!r}; доступны: {', '.join(sorted(BACKENDS))}")
 
+        self.local = False     # True — модель в этом процессе (llama_cpp), иначе HTTP
         self._model = None
-        if self.backend == "llama_cpp":
-            path = getenv_str("LLAMA_MODEL_PATH")
-            if not path or not os.path.exists(path):
-                raise RuntimeError("Укажите LLAMA_MODEL_PATH в .env")
-            ctx = getenv_int("LLAMA_CTX_SIZE", 4096)
-            self._model = Llama(model_path=path, n_ctx=ctx, logits_all=False, verbose=False)
+        self._pool: ModelPool | None = None
+        self._cache = None
+        self._draft = None
+        self._vocab = None     # Llama, у которого берём токенизатор
+        self._encoding = None  # tiktoken для OpenAI-совместимых
+        self.scheduler: InferenceScheduler | None = None
+        self.breaker: CircuitBreaker | None = None
+        self.retry: RetryPolicy | None = None
+        self.base_url: str | None = None
+        self.sampling = {"temperature": float(getenv_str("LLM_TEMPERATURE", "0.7")),
+                         "top_p": float(getenv_str("LLM_TOP_P", "0.95"))}
+        self.responses = ResponseCache()
+        self.health = _Health()
+        self.mlock = False
+        init(self, model, workers, name)
+
+    @staticmethod
+    def _messages(system_prompt: str, turns: List[ChatTurn]) -> List[Dict[str, str]]:
+        return [{"role": "system", "content": system_prompt}] + [t.model_dump() for t in turns]
+
+    def count_tokens(self, text: str) -> int:
+        """Число токенов text в токенизаторе бэкенда (без tiktoken — грубо, ~3 символа на токен)."""
+        if self._vocab is not None:
+            # токенизация читает только словарь — безопасно вне потока планировщика
+            return len(self._vocab.tokenize(text.encode("utf-8"), add_bos=False))
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return len(text) // 3 + 1
+
+    def prime(self, system_prompt: str) -> None:
+        """Фоном заносит системный промпт в кэш префиксов llama_cpp (для HTTP-бэкендов — ничего)."""
+        if not self.local:
+            return
+        messages = self._messages(system_prompt, [])
+        if self._pool is not None:
+            self.scheduler.submit(self._pool.prime, messages, key="prime")
+        elif self._cache is not None:
+            self.scheduler.submit(self._llama_chat, messages, 1, key="prime")
+
+    def warmup(self, system_prompt: str) -> None:
+        """Прогрев после загрузки: короткая синтетическая генерация (LLAMA_WARMUP_TOKENS, 8; 0 — выключить)
+        с system_prompt. Платит разовые издержки первого хода — подкачку страниц весов из mmap, первую
+        обработку промпта, рост аллокаторов — и кладёт системный промпт в кэш префиксов (в пуле — каждого
+        процесса). Синхронный: сервер считает модель готовой после него. HTTP-бэкенды не прогреваются."""
+        if not self.local:
+            return
+        tokens = getenv_int("LLAMA_WARMUP_TOKENS", 8)
+        if tokens <= 0:
+            self.prime(system_prompt)
+            return
+        messages = self._messages(system_prompt, [ChatTurn(role="user", content=WARMUP_USER_RU)])
+        t0 = time.perf_counter()
+        if self._pool is not None:
+            self.scheduler.run(self._pool.prime, messages, tokens, key="warmup", admitted=True)
         else:
-            base = getenv_str("OPENAI_BASE_URL", "https://api.openai.com/v1")
-            key = getenv_str("OPENAI_API_KEY")
-            if not key:
-                raise RuntimeError("Требуется OPENAI_API_KEY для openai backend")
-            self.client = OpenAI(api_key=key, base_url=base)
-            self.model = getenv_str("OPENAI_MODEL", "gpt-4o-mini")
-
-    def chat(self, system_prompt: str, turns: List[ChatTurn], max_tokens: int = 800) -> str:
-        if self.backend == "llama_cpp":
-            messages = [{"role": "system", "content": system_prompt}] + [t.model_dump() for t in turns]
-            out = self._model.create_chat_completion(
+            self.scheduler.run(self._llama_chat, messages, tokens, key="warmup", admitted=True)
+        self.health.warmed(time.perf_counter() - t0)
+
+    def health_info(self) -> Dict[str, object]:
+        """Прогрев, mlock и задержка последней генерации (с учётом очереди)."""
+        return {"backend": self.backend, "model": self.model_id, "mlock": self.mlock, **self.health.info()}
+
+    def cache_stats(self) -> Dict[str, object]:
+        """Попадания в кэш префиксов: lookups/hits/misses/hit_rate, переиспользованные токены, размер."""
+        if self._pool is not None:
+            return self._pool.stats()["prefix_cache"]
+        return self._cache.snapshot() if self._cache is not None else {}
+
+    def _format(self, schema: Dict[str, Any] | None) -> Dict[str, Any]:
+        """response_format под JSON-схему: llama_cpp строит из неё GBNF-грамматику, OpenAI-совместимые — structured outputs."""
+        if schema is None:
+            return {}
+        if self.local:
+            return {"response_format": {"type": "json_object", "schema": schema}}
+        return {"response_format": {"type": "json_schema", "json_schema": {"name": schema.get("title", "response"), "schema": schema}}}
+
+    def _response_key(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any], cache: bool | None) -> str | None:
+        """Ключ кэша ответов или None, если вызов не кэшируется. cache=True — кэшировать и при
+        temperature > 0, False — мимо кэша, None — по LLM_RESPONSE_CACHE. LLM_RESPONSE_CACHE=off
+        выключает кэш целиком и сильнее cache=True: это выключатель для оператора."""
+        if cache is False or self.responses.mode == "off":
+            return None
+        if cache is None and not self.responses.applies(self.sampling["temperature"]):
+            return None
+        return cache_key(self.backend, self.model_id, {**self.sampling, **fmt}, max_tokens, messages)
+
+    def speculative_stats(self) -> Dict[str, object]:
+        """Спекулятивное декодирование: предложено и принято токенов черновика, acceptance_rate."""
+        if self._pool is not None:
+            return self._pool.stats()["speculative"]
+        return self._draft.snapshot() if self._draft is not None else {}
+
+    def backend_info(self) -> Dict[str, object]:
+        """Бэкенд и, для HTTP, адрес, предохранитель и счётчики повторов."""
+        out: Dict[str, object] = {"backend": self.backend, "model": self.model_id, "local": self.local}
+        if self.breaker is not None:
+            out.update(base_url=self.base_url, timeout_s=self.timeout, breaker=self.breaker.info(), retry=self.retry.info())
+        return out
+
+    # key — кампания (для честной очереди), priority — меньше значит раньше, admitted — второй этап уже
+    # принятого хода (без 429); нужны только llama_cpp. schema — JSON-схема ответа: генерация ограничена ей.
+    # timeout — дедлайн вызова с учётом повторов (HTTP-бэкенды; по умолчанию LLM_TIMEOUT)
+    def chat(self, system_prompt: str, turns: List[ChatTurn], max_tokens: int = 800, *, key: str | None = None, priority: int = 0,
+             cache: bool | None = None, schema: Dict[str, Any] | None = None, admitted: bool = False,
+             timeout: float | None = None) -> str:
+        messages = self._messages(system_prompt, turns)
+        fmt = self._format(schema)
+        rkey = self._response_key(messages, max_tokens, fmt, cache)
+        if rkey is not None:
+            hit = self.responses.get(rkey)
+            if hit is not None:
+                return hit
+        t0 = time.perf_counter()
+        try:
+            text = self._chat(messages, max_tokens, fmt, key, priority, admitted, timeout)
+        except Exception as e:
+            self.health.error(e)
+            raise
+        self.health.record(time.perf_counter() - t0)
+        if rkey is not None:
+            self.responses.put(rkey, text)
+        return text
+
+    def _chat(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any], key: str | None, priority: int,
+              admitted: bool, timeout: float | None) -> str:
+        if self.local:
+            return self.scheduler.run(self._llama_chat, messages, max_tokens, fmt, key=key, priority=priority, admitted=admitted)
+
+        def attempt(left: float) -> str:
+            resp = self.client.chat.completions.create(
+                model=self.model,
                 messages=messages,
+                **self.sampling,
+                **fmt,
                 max_tokens=max_tokens,
-                temperature=0.7,
-                top_p=0.95,
+                timeout=left,
             )
-            return out["choices"][0]["message"]["content"]
-        else:
-            messages = [{"role": "system", "content": system_prompt}] + [t.model_dump() for t in turns]
-            resp = self.client.chat.completions.create(
+            return resp.choices[0].message.content
+        return self.retry.call(attempt, self.breaker, timeout or self.timeout)
+
+    async def achat(self, system_prompt: str, turns: List[ChatTurn], max_tokens: int = 800, *, key: str | None = None, priority: int = 0,
+                    cache: bool | None = None, schema: Dict[str, Any] | None = None, admitted: bool = False,
+                    timeout: float | None = None) -> str:
+        """Асинхронный chat(): AsyncOpenAI или llama_cpp через очередь планировщика."""
+        messages = self._messages(system_prompt, turns)
+        fmt = self._format(schema)
+        rkey = self._response_key(messages, max_tokens, fmt, cache)
+        if rkey is not None:
+            hit = await asyncio.to_thread(self.responses.get, rkey)
+            if hit is not None:
+                return hit
+        t0 = time.perf_counter()
+        try:
+            text = await self._achat(messages, max_tokens, fmt, key, priority, admitted, timeout)
+        except Exception as e:
+            self.health.error(e)
+            raise
+        self.health.record(time.perf_counter() - t0)
+        if rkey is not None:
+            await asyncio.to_thread(self.responses.put, rkey, text)
+        return text
+
+    async def _achat(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any], key: str | None, priority: int,
+                     admitted: bool, timeout: float | None) -> str:
+        if self.local:
+            fut = self.scheduler.submit(self._llama_chat, messages, max_tokens, fmt, key=key, priority=priority, admitted=admitted)
+            return await asyncio.wrap_future(fut)
+
+        async def attempt(left: float) -> str:
+            resp = await self.aclient.chat.completions.create(
                 model=self.model,
                 messages=messages,
-                temperature=0.7,
-                top_p=0.95,
+                **self.sampling,
+                **fmt,
                 max_tokens=max_tokens,
+                timeout=left,
             )
             return resp.choices[0].message.content
+        return await self.retry.acall(attempt, self.breaker, timeout or self.timeout)
+
+    def chat_stream(self, system_prompt: str, turns: List[ChatTurn], max_tokens: int = 800, *, key: str | None = None, priority: int = 0,
+                    cache: bool | None = None, schema: Dict[str, Any] | None = None, admitted: bool = False,
+                    timeout: float | None = None) -> Iterator[str]:
+        """То же, что chat(), но отдаёт текст кусками по мере генерации.
+        Запрос встаёт в очередь (или HTTP-поток открывается) сразу: QueueFull, CircuitOpen и
+        исчерпанные повторы — при вызове, а не на первом куске."""
+        messages = self._messages(system_prompt, turns)
+        fmt = self._format(schema)
+        rkey = self._response_key(messages, max_tokens, fmt, cache)
+        if rkey is not None:
+            hit = self.responses.get(rkey)
+            if hit is not None:
+                return iter([hit])
+        t0 = time.perf_counter()
+        try:
+            if self.local:
+                pieces = self.scheduler.stream(self._llama_stream, messages, max_tokens, fmt, key=key, priority=priority, admitted=admitted)
+            else:
+                pieces = self._openai_stream(messages, max_tokens, fmt, timeout)
+        except Exception as e:
+            self.health.error(e)
+            raise
+        pieces = self._timed_stream(pieces, t0)
+        return pieces if rkey is None else self._store_stream(pieces, rkey)
+
+    def _timed_stream(self, pieces: Iterator[str], t0: float) -> Iterator[str]:
+        try:
+            yield from pieces
+        except Exception as e:
+            self.health.error(e)
+            raise
+        self.health.record(time.perf_counter() - t0)
+
+    def _store_stream(self, pieces: Iterator[str], rkey: str) -> Iterator[str]:
+        # в кэш — только дочитанный до конца ответ
+        parts: List[str] = []
+        for piece in pieces:
+            parts.append(piece)
+            yield piece
+        self.responses.put(rkey, "".join(parts))
+
+    # ---- llama_cpp (только из потока планировщика) ----
+    def _llama_chat(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any] | None = None) -> str:
+        if self._pool is not None:
+            return self._pool.chat(messages, max_tokens, fmt)
+        out = self._model.create_chat_completion(
+            messages=messages,
+            max_tokens=max_tokens,
+            **self.sampling,
+            **(fmt or {}),
+        )
+        return out["choices"][0]["message"]["content"]
+
+    def _llama_stream(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any] | None = None) -> Iterator[str]:
+        if self._pool is not None:
+            yield from self._pool.stream(messages, max_tokens, fmt)
+            return
+        for chunk in self._model.create_chat_completion(
+            messages=messages,
+            max_tokens=max_tokens,
+            **self.sampling,
+            **(fmt or {}),
+            stream=True,
+        ):
+            piece = chunk["choices"][0]["delta"].get("content")
+            if piece:
+                yield piece
+
+    # ---- OpenAI-совместимые ----
+    def _openai_stream(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any],
+                       timeout: float | None) -> Iterator[str]:
+        # повторяется только открытие потока: после первого куска текст уже ушёл клиенту
+        stream = self.retry.call(lambda left: self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            **self.sampling,
+            **fmt,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=left,
+        ), self.breaker, timeout or self.timeout)
+        return self._read_stream(stream)
+
+    def _read_stream(self, stream) -> Iterator[str]:
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except self.retry.retryable:
+            self.breaker.failure()  # обрыв посреди ответа
+            raise
+        finally:
+            stream.close()  # клиент ушёл — не дочитываем генерацию
+
+
+# ---------- реестр бэкендов ----------
+# Бэкенд — функция init(llm, model, workers, name), которая настраивает LLM: локальная модель
+# (llm.local = True, llm.scheduler) или OpenAI-совместимый HTTP-клиент (llm.client/aclient, breaker, retry).
+BACKENDS: Dict[str, Callable[[LLM, str | None, int | None, str], None]] = {}
+
+def register_backend(name: str):
+    def deco(fn):
+        BACKENDS[name] = fn
+        return fn
+    return deco
+
+@register_backend("llama_cpp")
+def _init_llama(llm: LLM, model: str | None, workers: int | None, name: str) -> None:
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        raise RuntimeError("llama-cpp-python не установлен")
+    from .model_pool import ModelPool
+    from .prompt_cache import make_cache
+    from .speculative import make_draft_model
+    path = model or getenv_str("LLAMA_MODEL_PATH")
+    if not path or not os.path.exists(path):
+        raise RuntimeError("Укажите LLAMA_MODEL_PATH в .env")
+    llm.local = True
+    llm.model_id = os.path.abspath(path)
+    opt = llm.overrides
+    # LLAMA_MLOCK=1: веса закреплены в RAM, ОС не выгрузит их между ходами (нужен лимит ulimit -l)
+    llm.mlock = getenv_bool("LLAMA_MLOCK") if opt.get("mlock") is None else bool(opt["mlock"])
+    ctx = getenv_int("LLAMA_CTX_SIZE", 4096)
+    workers = workers or getenv_int("LLAMA_WORKERS", 1)
+    if workers > 1:
+        # N процессов с моделью, ядра делятся поровну (LLAMA_THREADS — вручную)
+        llm._pool = ModelPool(path, workers, n_ctx=ctx, n_threads=getenv_int("LLAMA_THREADS", 0) or None,
+                              sampling=llm.sampling)
+        llm._vocab = Llama(model_path=path, vocab_only=True, verbose=False)
+    else:
+        # спекулятивное декодирование (LLAMA_SPECULATIVE): черновик предлагает токены, модель их проверяет
+        llm._draft = make_draft_model(opt.get("speculative"), path=opt.get("draft_path"), n_ctx=ctx)
+        llm._model = Llama(model_path=path, n_ctx=ctx, logits_all=False, use_mlock=llm.mlock, draft_model=llm._draft,
+                           verbose=False)
+        # кэш префиксов: следующий ход кампании считает только новую реплику
+        llm._cache = make_cache(opt.get("cache"), path=opt.get("cache_dir"))
+        if llm._cache is not None:
+            llm._model.set_cache(llm._cache)
+        llm._vocab = llm._model
+    llm.n_ctx = ctx
+    # Llama не потокобезопасен: генерации идут через очередь, рабочих потоков в ней
+    # столько же, сколько экземпляров модели (они же уводят генерацию с потоков Starlette)
+    llm.scheduler = InferenceScheduler(name=name, workers=workers)
+
+def _init_http(llm: LLM, model: str | None, default_base: str | None, default_model: str, key_required: bool) -> None:
+    """OpenAI-совместимый бэкенд: свой пул keep-alive соединений, таймауты, повторы с джиттером
+    (LLM_RETRIES) и предохранитель (LLM_BREAKER_FAILURES подряд → пауза LLM_BREAKER_RESET с).
+    Повторы SDK выключены (max_retries=0) — ими управляет RetryPolicy. default_base=None — адрес обязателен."""
+    try:
+        import httpx, openai
+        from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+    except ImportError:
+        raise RuntimeError("openai не установлен")
+    base = getenv_str("OPENAI_BASE_URL", default_base)
+    if not base:
+        raise RuntimeError(f"Укажите OPENAI_BASE_URL для {llm.backend} backend")
+    key = getenv_str("OPENAI_API_KEY")
+    if not key:
+        if key_required:
+            raise RuntimeError("Требуется OPENAI_API_KEY для openai backend")
+        key = "local"  # локальные серверы ключ не проверяют, а SDK без него не работает
+    llm.timeout = getenv_float("LLM_TIMEOUT", 120.0)
+    timeout = httpx.Timeout(llm.timeout, connect=getenv_float("LLM_CONNECT_TIMEOUT", 5.0))
+    limits = httpx.Limits(max_connections=getenv_int("LLM_HTTP_MAX_CONNECTIONS", 32),
+                          max_keepalive_connections=getenv_int("LLM_HTTP_KEEPALIVE", 16),
+                          keepalive_expiry=getenv_float("LLM_HTTP_KEEPALIVE_EXPIRY", 60.0))
+    llm.client = OpenAI(api_key=key, base_url=base, max_retries=0, timeout=timeout,
+                        http_client=DefaultHttpxClient(limits=limits, timeout=timeout))
+    llm.aclient = AsyncOpenAI(api_key=key, base_url=base, max_retries=0, timeout=timeout,
+                              http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout))
+    llm.base_url = base
+    llm.model = model or getenv_str("OPENAI_MODEL", default_model)
+    llm.model_id = base + "#" + llm.model
+    llm.n_ctx = getenv_int("OPENAI_CTX_SIZE", 16384)
+    llm.breaker = CircuitBreaker(llm.backend, failures=getenv_int("LLM_BREAKER_FAILURES", 5),
+                                 reset_after=getenv_float("LLM_BREAKER_RESET", 30.0))
+    llm.retry = RetryPolicy(retries=getenv_int("LLM_RETRIES", 2), base=getenv_float("LLM_RETRY_BASE", 0.5),
+                            # сбои связи, 429 и 5xx — повторяем; 4xx — ошибка запроса, повтор не поможет
+                            retryable=(openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+    try:
+        import tiktoken
+    except ImportError:
+        return
+    try:
+        llm._encoding = tiktoken.encoding_for_model(llm.model)
+    except KeyError:
+        llm._encoding = tiktoken.get_encoding("cl100k_base")
+
+@register_backend("openai")
+def _init_openai(llm: LLM, model: str | None, workers: int | None, name: str) -> None:
+    _init_http(llm, model, "https://api.openai.com/v1", "gpt-4o-mini", key_required=True)
+
+@register_backend("openai_compat")
+def _init_openai_compat(llm: LLM, model: str | None, workers: int | None, name: str) -> None:
+    """Любой OpenAI-совместимый сервер; по умолчанию llama.cpp server на localhost."""
+    _init_http(llm, model, "http://127.0.0.1:8080/v1", "local", key_required=False)
+
+@register_backend("vllm")
+def _init_vllm(llm: LLM, model: str | None, workers: int | None, name: str) -> None:
+    """vLLM без адреса по умолчанию: его стандартный порт 8000 — тот же, что у этого сервера, и запросы
+    ушли бы самому себе (404 вместо понятной ошибки настройки)."""
+    _init_http(llm, model, None, "local", key_required=False)
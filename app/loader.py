@@ -0,0 +1,85 @@
+from __future__ import annotations
+import threading, time, traceback
+from typing import Any, Callable, Dict, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class NotReady(RuntimeError):
+    """Модель ещё загружается или не загрузилась — сервер отвечает 503 с Retry-After."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BackgroundLoader(Generic[T]):
+    """Строит тяжёлый объект (GMAgent с моделью) в фоновом потоке, чтобы сервер отвечал сразу.
+
+    `start()` запускает сборку (повторный вызов ничего не делает), `get()` — готовый объект,
+    а пока его нет — NotReady; без `start()` первый `get()` сам запускает сборку. Упавшая сборка
+    не повторяется: `get()` отдаёт NotReady с текстом ошибки, `info()` — состояние для /ready.
+    """
+
+    def __init__(self, name: str, build: Callable[[], T], retry_after: int = 2):
+        self.name = name
+        self._build = build
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._obj: T | None = None
+        self._state = "idle"  # idle | loading | warming | ready | failed
+        self._error: str | None = None
+        self._started: float | None = None
+        self._load_s: float | None = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._state != "idle":
+                return
+            self._state = "loading"
+            self._started = time.monotonic()
+        threading.Thread(target=self._run, name=f"{self.name}-load", daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            obj = self._build()
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                self._state, self._error = "failed", f"{type(e).__name__}: {e}"
+                self._load_s = time.monotonic() - self._started
+            return
+        with self._lock:
+            self._obj, self._state = obj, "ready"
+            self._load_s = time.monotonic() - self._started
+
+    def phase(self, name: str) -> None:
+        """Уточняет стадию сборки (например, warming после загрузки) — для /ready и /health."""
+        with self._lock:
+            if self._state not in ("ready", "failed"):
+                self._state = name
+
+    def get(self) -> T:
+        obj = self._obj
+        if obj is not None:
+            return obj
+        self.start()
+        with self._lock:
+            if self._obj is not None:
+                return self._obj
+            if self._state == "failed":
+                raise NotReady(f"{self.name}: загрузка не удалась — {self._error}", 60)
+        raise NotReady(f"{self.name}: загружается", self.retry_after)
+
+    @property
+    def ready(self) -> bool:
+        return self._obj is not None
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {"state": self._state, "error": self._error}
+            if self._load_s is not None:
+                out["load_s"] = round(self._load_s, 3)
+            elif self._started is not None:
+                out["elapsed_s"] = round(time.monotonic() - self._started, 3)
+            return out
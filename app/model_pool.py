@@ -0,0 +1,258 @@
+from __future__ import annotations
+import argparse, json, os, queue, secrets, socket, subprocess, sys, threading, time
+from multiprocessing.connection import Client, Connection, answer_challenge, deliver_challenge
+from typing import Any, Dict, Iterator, List
+
+from .prompt_cache import make_cache, merge_stats
+from .speculative import make_draft_model
+from .utils import getenv_bool, getenv_float
+
+# Воркеры — отдельные `python -m app.model_pool`, а не multiprocessing.Process: spawn заново
+# импортирует главный модуль (app.server, run_app.py), а тот при импорте поднимает модель.
+# В сборке PyInstaller sys.executable — само приложение: оно перезапускается с WORKER_FLAG,
+# и run_app.py передаёт управление в main() этого модуля.
+WORKER_FLAG = "--model-pool-worker"
+
+
+def _worker_command() -> List[str]:
+    if getattr(sys, "frozen", False):
+        return [sys.executable, WORKER_FLAG]
+    return [sys.executable, "-m", "app.model_pool"]
+
+
+def _worker_main(conn, model_path: str, n_ctx: int, n_threads: int, sampling: Dict[str, Any], cache: str) -> None:
+    """Процесс-исполнитель: своя копия Llama; веса — общий mmap GGUF-файла (страницы делит ОС)."""
+    from llama_cpp import Llama
+    try:
+        draft = make_draft_model(n_ctx=n_ctx)  # LLAMA_SPECULATIVE и т.п. — из окружения, унаследованного от сервера
+        model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, use_mmap=True, logits_all=False,
+                      use_mlock=getenv_bool("LLAMA_MLOCK"), draft_model=draft, verbose=False)
+        prefix_cache = make_cache(cache)
+        if prefix_cache is not None:
+            model.set_cache(prefix_cache)
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", None))
+
+    def stats():
+        return {"prefix_cache": prefix_cache.snapshot() if prefix_cache is not None else {},
+                "speculative": draft.snapshot() if draft is not None else {}}
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        if msg == "cancel":
+            continue  # отмена пришла, когда генерация уже кончилась
+        kind, messages, max_tokens, fmt = msg
+        try:
+            if kind == "chat":
+                out = model.create_chat_completion(messages=messages, max_tokens=max_tokens, **sampling, **fmt)
+                tokens = int((out.get("usage") or {}).get("completion_tokens") or 0)
+                conn.send(("result", (out["choices"][0]["message"]["content"], tokens, stats())))
+            else:
+                tokens = 0
+                for chunk in model.create_chat_completion(messages=messages, max_tokens=max_tokens, stream=True, **sampling, **fmt):
+                    if conn.poll() and conn.recv() == "cancel":
+                        break
+                    piece = chunk["choices"][0]["delta"].get("content")
+                    if piece:
+                        tokens += 1
+                        conn.send(("piece", piece))
+                conn.send(("end", (tokens, stats())))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, index: int, model_path: str, n_ctx: int, n_threads: int, sampling: Dict[str, Any], cache: str):
+        self.index = index
+        self.n_threads = n_threads
+        self.stats: Dict[str, Any] = {}  # счётчики кэша и черновика на момент последнего ответа
+        authkey = secrets.token_bytes(16)
+        with socket.create_server(("127.0.0.1", 0)) as listener:
+            host, port = listener.getsockname()[:2]
+            env = {**os.environ, "BITD_POOL_AUTHKEY": authkey.hex()}
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+            self.proc = subprocess.Popen(_worker_command() + [
+                "--connect", f"{host}:{port}",
+                "--model", model_path, "--ctx", str(n_ctx), "--threads", str(n_threads), "--sampling", json.dumps(sampling),
+                "--cache", cache,
+            ], env=env)
+            self.conn = self._accept(listener, authkey, getenv_float("LLAMA_WORKER_CONNECT_TIMEOUT", 60.0))
+
+    def _accept(self, listener: socket.socket, authkey: bytes, timeout: float) -> Connection:
+        """Ждёт подключения процесса, пока тот жив и не вышел срок (Listener.accept ждал бы вечно)."""
+        deadline = time.monotonic() + timeout
+        listener.settimeout(0.2)
+        while True:
+            try:
+                sock, _ = listener.accept()
+                break
+            except socket.timeout:
+                code = self.proc.poll()
+                if code is not None:
+                    raise RuntimeError(f"Процесс модели #{self.index} завершился при запуске (код {code})")
+                if time.monotonic() > deadline:
+                    self.proc.kill()
+                    raise RuntimeError(f"Процесс модели #{self.index} не подключился за {timeout:g} с")
+        sock.settimeout(None)
+        conn = Connection(sock.detach())
+        try:
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+        except BaseException:
+            conn.close()
+            self.proc.kill()
+            raise
+        return conn
+
+    def _recv(self):
+        try:
+            kind, payload = self.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Процесс модели #{self.index} завершился (код {self.proc.poll()})")
+        if kind == "error":
+            raise RuntimeError(f"Процесс модели #{self.index}: {payload}")
+        return kind, payload
+
+    def wait_ready(self) -> None:
+        self._recv()
+
+    def chat(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any]) -> tuple[str, int]:
+        self.conn.send(("chat", messages, max_tokens, fmt))
+        content, tokens, self.stats = self._recv()[1]
+        return content, tokens
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any], counter: Dict[str, int]) -> Iterator[str]:
+        self.conn.send(("stream", messages, max_tokens, fmt))
+        finished = False
+        try:
+            while True:
+                kind, payload = self._recv()
+                if kind == "end":
+                    finished = True
+                    counter["tokens"] += payload[0]
+                    self.stats = payload[1]
+                    return
+                yield payload
+        finally:
+            if not finished:
+                # потребитель ушёл посреди генерации: останавливаем её и дочитываем хвост канала
+                self.conn.send("cancel")
+                while True:
+                    kind, payload = self._recv()
+                    if kind == "end":
+                        counter["tokens"] += payload[0]
+                        self.stats = payload[1]
+                        break
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.terminate()
+
+
+class ModelPool:
+    """N процессов с моделью llama_cpp; запрос уходит свободному.
+
+    `LLAMA_WORKERS` — число процессов, `LLAMA_THREADS` — потоков на процесс
+    (по умолчанию ядра поровну: cpu_count // N). GGUF открывается через mmap,
+    так что веса в памяти одни на всех. Сам пул не ставит запросы в очередь:
+    перед ним стоит InferenceScheduler с тем же числом рабочих потоков, поэтому
+    при старте задачи свободный процесс всегда есть.
+    """
+
+    def __init__(self, model_path: str, workers: int, n_ctx: int = 4096, n_threads: int | None = None,
+                 sampling: Dict[str, Any] | None = None, cache: str | None = None):
+        workers = max(1, int(workers))
+        if not n_threads:
+            n_threads = max(1, (os.cpu_count() or 1) // workers)
+        cache = cache or os.getenv("LLAMA_CACHE", "ram")
+        self._workers = [_Worker(i, model_path, n_ctx, n_threads, sampling or {}, cache) for i in range(workers)]
+        for w in self._workers:
+            w.wait_ready()
+        self._idle: queue.Queue = queue.Queue()
+        for w in self._workers:
+            self._idle.put(w)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "tokens": 0}
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    def chat(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any] | None = None) -> str:
+        w = self._idle.get()
+        try:
+            content, tokens = w.chat(messages, max_tokens, fmt or {})
+        finally:
+            self._idle.put(w)
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["tokens"] += tokens
+        return content
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int, fmt: Dict[str, Any] | None = None) -> Iterator[str]:
+        w = self._idle.get()
+        counter = {"tokens": 0}
+        try:
+            yield from w.stream(messages, max_tokens, fmt or {}, counter)
+        finally:
+            self._idle.put(w)
+            with self._lock:
+                self.counters["requests"] += 1
+                self.counters["tokens"] += counter["tokens"]
+
+    def prime(self, messages: List[Dict[str, str]], max_tokens: int = 1) -> None:
+        """Прогоняет messages (обычно один системный промпт) через каждый процесс, чтобы префикс
+        лёг в их кэши (max_tokens > 1 — заодно прогрев). Забирает процессы по одному по мере освобождения."""
+        taken = []
+        try:
+            for _ in self._workers:
+                w = self._idle.get()
+                taken.append(w)
+                w.chat(messages, max_tokens, {})
+        finally:
+            for w in taken:
+                self._idle.put(w)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"workers": self.size, "threads_per_worker": self._workers[0].n_threads,
+                    "idle": self._idle.qsize(), **self.counters,
+                    "prefix_cache": merge_stats(w.stats.get("prefix_cache") for w in self._workers),
+                    "speculative": merge_stats((w.stats.get("speculative") for w in self._workers),
+                                               ("acceptance_rate", "accepted", "drafted"))}
+
+    def close(self) -> None:
+        for w in self._workers:
+            w.close()
+
+
+def main(argv: List[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="Процесс-воркер ModelPool (запускается пулом, не вручную)")
+    ap.add_argument("--connect", required=True)
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--ctx", type=int, default=4096)
+    ap.add_argument("--threads", type=int, default=1)
+    ap.add_argument("--sampling", default="{}")
+    ap.add_argument("--cache", default="ram")
+    args = ap.parse_args(argv)
+    host, port = args.connect.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ["BITD_POOL_AUTHKEY"]))
+    _worker_main(conn, args.model, args.ctx, args.threads, json.loads(args.sampling), args.cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import os, threading
+from typing import Any, Dict
+
+# Кэш префиксов промпта для llama_cpp. Llama сам ищет в кэше состояние с самым длинным общим
+# префиксом токенов и подгружает его, так что пересчитывается только хвост — новая реплика.
+# Ключ — токены, поэтому у каждой кампании своя запись (её история), а системный промпт —
+# общий префикс всех записей.
+
+_KINDS = ("ram", "disk", "off")
+
+
+class _Counting:
+    """Примесь к LlamaRAMCache/LlamaDiskCache: считает попадания и переиспользованные токены."""
+
+    def _init_stats(self) -> None:
+        self._stats_lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "reused_tokens": 0, "stores": 0}
+
+    def __getitem__(self, key):
+        try:
+            item = super().__getitem__(key)
+        except KeyError:
+            with self._stats_lock:
+                self.stats["lookups"] += 1
+                self.stats["misses"] += 1
+            raise
+        reused = _common_prefix(item.input_ids.tolist(), list(key))
+        with self._stats_lock:
+            self.stats["lookups"] += 1
+            self.stats["hits"] += 1
+            self.stats["reused_tokens"] += reused
+        return item
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        with self._stats_lock:
+            self.stats["stores"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            out = dict(self.stats)
+        out["hit_rate"] = round(out["hits"] / out["lookups"], 3) if out["lookups"] else None
+        out["size_bytes"] = int(self.cache_size)
+        out["capacity_bytes"] = int(self.capacity_bytes)
+        return out
+
+
+def _common_prefix(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def make_cache(kind: str | None = None, capacity_bytes: int | None = None, path: str | None = None):
+    """Кэш по настройкам `LLAMA_CACHE` (ram | disk | off, по умолчанию ram),
+    `LLAMA_CACHE_BYTES` (2 ГиБ; при переполнении вытесняется давно не использованная запись)
+    и `LLAMA_CACHE_DIR` (для disk). None — кэш выключен."""
+    kind = (kind or os.getenv("LLAMA_CACHE", "ram")).strip().lower()
+    if kind not in _KINDS:
+        raise ValueError(f"LLAMA_CACHE: ожидалось одно из {', '.join(_KINDS)}, получено {kind!r}")
+    if kind == "off":
+        return None
+    if capacity_bytes is None:
+        capacity_bytes = int(os.getenv("LLAMA_CACHE_BYTES", str(2 << 30)))
+    from llama_cpp import LlamaDiskCache, LlamaRAMCache
+    if kind == "disk":
+        class DiskCache(_Counting, LlamaDiskCache):
+            pass
+        cache = DiskCache(cache_dir=path or os.getenv("LLAMA_CACHE_DIR", "data/llama_cache"), capacity_bytes=capacity_bytes)
+    else:
+        class RAMCache(_Counting, LlamaRAMCache):
+            pass
+        cache = RAMCache(capacity_bytes=capacity_bytes)
+    cache._init_stats()
+    return cache
+
+
+def merge_stats(parts, rate: tuple[str, str, str] = ("hit_rate", "hits", "lookups")) -> Dict[str, Any]:
+    """Сумма счётчиков нескольких процессов пула; rate — (имя доли, числитель, знаменатель)."""
+    parts = [p for p in parts if p]
+    if not parts:
+        return {}
+    out: Dict[str, Any] = {}
+    for p in parts:
+        for k, v in p.items():
+            if isinstance(v, int):
+                out[k] = out.get(k, 0) + v
+    name, num, den = rate
+    out[name] = round(out[num] / out[den], 3) if out.get(den) else None
+    return out
@@ -28,3 +28,71 @@ JSON-НАМЕРЕНИЕ (с первого блока ответа):
 Затем — 10–14 строк нарратива.
 Если какие-то поля неизвестны — заполни то, что можешь (особенно actor/action); остальное модель может опустить.
 """
+
+SUMMARY_PROMPT_RU = """
+Ты ведёшь краткий конспект партии «Клинков во Тьме» для ведущего.
+Тебе дают прежний конспект и новые реплики. Верни обновлённый конспект: кто есть кто, где партия,
+что произошло, активные часы, долги, обещания и угрозы. Без нарратива и без json, до 12 строк.
+"""
+
+# ---- структурированный режим (BITD_STRUCTURED=1): ответ ограничен JSON-схемой ----
+_POSITIONS = ["Отчаянная", "Рискованная", "Контролируемая"]
+_EFFECTS = ["Низкий", "Обычный", "Высокий"]
+
+INTENT_SCHEMA = {
+    "title": "gm_intent",
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["ask_for_action_roll", "narration_only", "fortune_roll",
+                                              "downtime", "engagement", "resist_prompt"]},
+        "proposed": {
+            "type": "object",
+            "properties": {
+                "actor": {"type": "string"},
+                "action": {"type": "string"},
+                "position": {"type": "string", "enum": _POSITIONS},
+                "effect": {"type": "string", "enum": _EFFECTS},
+                "dice_guess": {"type": "integer"},
+                "assist": {"type": "boolean"},
+                "push": {"type": "boolean"},
+                "bargain": {"type": "boolean"},
+                "bonus": {"type": "integer"},
+                "setup": {"type": "boolean"},
+                "assist_actor": {"type": "string"},
+                "group_action": {"type": "boolean"},
+                "leader": {"type": "string"},
+                "group_failures": {"type": "integer"},
+                "notes": {"type": "string"},
+                "devils_bargains": {"type": "array", "items": {"type": "string"}},
+                "target_clock": {"type": "object",
+                                 "properties": {"name": {"type": "string"}, "segments": {"type": "integer"}},
+                                 "required": ["name", "segments"]},
+            },
+        },
+    },
+    "required": ["intent", "proposed"],
+}
+
+# намерение и нарратив одним объектом; narration — последним, чтобы его можно было стримить
+TURN_SCHEMA = {
+    **INTENT_SCHEMA,
+    "title": "gm_turn",
+    "properties": {**INTENT_SCHEMA["properties"], "narration": {"type": "string"}},
+    "required": ["intent", "proposed", "narration"],
+}
+
+STRUCTURED_SUFFIX_RU = """
+ФОРМАТ ОТВЕТА: один JSON-объект {"intent": ..., "proposed": {...}, "narration": "..."} без ``` и текста
+вокруг. intent и proposed — как в JSON-намерении выше, в narration — 10–14 строк нарратива.
+"""
+
+# ---- двухэтапный ход (BITD_PIPELINE=two_stage) ----
+INTENT_PROMPT_RU = SYSTEM_PROMPT_RU + """
+СЕЙЧАС: верни только JSON-намерение — объект {"intent": ..., "proposed": {...}}, без нарратива.
+"""
+
+NARRATION_PROMPT_RU = """
+Ты — ведущий (ГМ) «Клинков во Тьме». Намерение и результат броска уже определила система — они в конце
+последней реплики игрока, в строках с пометкой [Система]. Не меняй их и не придумывай другой исход: опиши именно его.
+Напиши 10–14 строк нарратива. Без JSON и служебных пометок.
+"""
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import asyncio, random, threading, time
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type
+
+
+class CircuitOpen(RuntimeError):
+    """Бэкенд недавно падал подряд — запросы к нему временно не отправляются (сервер отвечает 503)."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Бэкенд {name} недоступен, повтор через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Предохранитель: после `failures` сбоев подряд размыкается на `reset_after` секунд,
+    затем пропускает один пробный запрос (half-open) — успех замыкает, сбой размыкает снова."""
+
+    def __init__(self, name: str, failures: int = 5, reset_after: float = 30.0):
+        self.name = name
+        self.failures = max(1, int(failures))
+        self.reset_after = float(reset_after)
+        self._lock = threading.Lock()
+        self._streak = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self.counters = {"opened": 0, "rejected": 0}
+
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if now - self._opened_at >= self.reset_after else "open"
+
+    def before(self) -> None:
+        """Бросает CircuitOpen, если запрос сейчас отправлять нельзя."""
+        with self._lock:
+            now = time.monotonic()
+            st = self._state(now)
+            if st == "closed":
+                return
+            if st == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.counters["rejected"] += 1
+            left = self.reset_after - (now - self._opened_at) if st == "open" else 1
+            raise CircuitOpen(self.name, max(1, int(left + 0.999)))
+
+    def success(self) -> None:
+        with self._lock:
+            self._streak = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._streak += 1
+            if self._probing or (self._opened_at is None and self._streak >= self.failures):
+                self._opened_at = time.monotonic()
+                self.counters["opened"] += 1
+            self._probing = False
+
+    def release(self) -> None:
+        with self._lock:
+            self._probing = False
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state(time.monotonic()), "failure_streak": self._streak,
+                    "threshold": self.failures, "reset_after_s": self.reset_after, **self.counters}
+
+
+class RetryPolicy:
+    """Повторы с экспоненциальной задержкой и полным джиттером: пауза — случайная в [0, base·2^n],
+    не больше cap. Повторяются только ошибки из `retryable`, и только пока хватает дедлайна."""
+
+    def __init__(self, retries: int = 2, base: float = 0.5, cap: float = 8.0,
+                 retryable: Tuple[Type[BaseException], ...] = ()):
+        self.retries = max(0, int(retries))
+        self.base = base
+        self.cap = cap
+        self.retryable = retryable
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0}
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def call(self, fn: Callable[[float], Any], breaker: CircuitBreaker, timeout: float) -> Any:
+        """fn(remaining_timeout) с повторами; предохранитель видит каждую попытку."""
+        deadline = time.monotonic() + timeout
+        self._count("calls")
+        attempt = 0
+        while True:
+            breaker.before()
+            try:
+                result = fn(max(0.1, deadline - time.monotonic()))
+            except self.retryable:
+                breaker.failure()
+                pause = self.delay(attempt)
+                if attempt >= self.retries or time.monotonic() + pause >= deadline:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                time.sleep(pause)
+                continue
+            except Exception:
+                breaker.success()  # бэкенд ответил (4xx и т.п.) — он жив, ошибка не его
+                raise
+            except BaseException:
+                breaker.release()  # попытку отменили — не в счёт
+                raise
+            breaker.success()
+            return result
+
+    async def acall(self, fn: Callable[[float], Awaitable[Any]], breaker: CircuitBreaker, timeout: float) -> Any:
+        """Асинхронный call(): пауза между попытками — asyncio.sleep."""
+        deadline = time.monotonic() + timeout
+        self._count("calls")
+        attempt = 0
+        while True:
+            breaker.before()
+            try:
+                result = await fn(max(0.1, deadline - time.monotonic()))
+            except self.retryable:
+                breaker.failure()
+                pause = self.delay(attempt)
+                if attempt >= self.retries or time.monotonic() + pause >= deadline:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                await asyncio.sleep(pause)
+                continue
+            except Exception:
+                breaker.success()  # бэкенд ответил (4xx и т.п.) — он жив, ошибка не его
+                raise
+            except BaseException:
+                breaker.release()  # попытку отменили — не в счёт
+                raise
+            breaker.success()
+            return result
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"max_retries": self.retries, **self.counters}
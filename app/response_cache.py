@@ -0,0 +1,133 @@
+from __future__ import annotations
+import hashlib, json, os, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from .utils import getenv_int, getenv_str
+
+_MODES = ("off", "on", "force")
+
+
+def cache_key(backend: str, model: str, sampling: Dict[str, Any], max_tokens: int, messages: List[Dict[str, str]]) -> str:
+    payload = {"backend": backend, "model": model, "sampling": sampling, "max_tokens": max_tokens, "messages": messages}
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Кэш ответов модели для повторяемых вызовов (temperature 0, повторы, прогон логов).
+
+    Два уровня: LRU в памяти (`LLM_RESPONSE_CACHE_ITEMS`, 256) и каталог на диске
+    (`LLM_RESPONSE_CACHE_DIR`, по файлу на ключ) с TTL `LLM_RESPONSE_CACHE_TTL` секунд (сутки)
+    и пределом `LLM_RESPONSE_CACHE_BYTES` (64 МиБ; сверх него удаляются самые старые файлы).
+    `LLM_RESPONSE_CACHE`: `on` (по умолчанию) — только при temperature 0, `force` — всегда, `off`.
+    """
+
+    def __init__(self, mode: str | None = None, path: str | None = None, max_items: int | None = None,
+                 ttl: int | None = None, max_bytes: int | None = None):
+        mode = (mode or getenv_str("LLM_RESPONSE_CACHE", "on")).strip().lower()
+        if mode not in _MODES:
+            raise ValueError(f"LLM_RESPONSE_CACHE: ожидалось одно из {', '.join(_MODES)}, получено {mode!r}")
+        self.mode = mode
+        self.dir = path or getenv_str("LLM_RESPONSE_CACHE_DIR", "data/response_cache")
+        self.max_items = max_items if max_items is not None else getenv_int("LLM_RESPONSE_CACHE_ITEMS", 256)
+        self.ttl = ttl if ttl is not None else getenv_int("LLM_RESPONSE_CACHE_TTL", 86400)
+        self.max_bytes = max_bytes if max_bytes is not None else getenv_int("LLM_RESPONSE_CACHE_BYTES", 64 << 20)
+        self._mem: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes: int | None = None  # считается лениво при первой записи
+        self.stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "bypassed": 0, "stores": 0, "evicted": 0}
+        if self.mode != "off":
+            os.makedirs(self.dir, exist_ok=True)
+
+    def applies(self, temperature: float) -> bool:
+        """Кэшировать ли вызов: при temperature > 0 ответ случаен — только в режиме force."""
+        ok = self.mode == "force" or (self.mode == "on" and temperature <= 0)
+        if not ok:
+            with self._lock:
+                self.stats["bypassed"] += 1
+        return ok
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.dir, key + ".json")
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None and now - hit[0] <= self.ttl:
+                self._mem.move_to_end(key)
+                self.stats["hits_memory"] += 1
+                return hit[1]
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                rec = json.load(f)
+        except (OSError, ValueError):
+            rec = None
+        with self._lock:
+            if rec is None or now - rec["created"] > self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits_disk"] += 1
+            self._remember(key, rec["created"], rec["text"])
+        return rec["text"]
+
+    def put(self, key: str, text: str) -> None:
+        now = time.time()
+        data = json.dumps({"created": now, "text": text}, ensure_ascii=False).encode("utf-8")
+        tmp = self._file(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._file(key))
+        with self._lock:
+            self._remember(key, now, text)
+            self.stats["stores"] += 1
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_bytes()
+            else:
+                self._disk_bytes += len(data)
+            over = self._disk_bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _remember(self, key: str, created: float, text: str) -> None:
+        self._mem[key] = (created, text)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def _scan_bytes(self) -> int:
+        return sum(e.stat().st_size for e in os.scandir(self.dir) if e.name.endswith(".json"))
+
+    def _evict(self) -> None:
+        """Удаляет просроченные файлы, затем самые старые — до 3/4 предела."""
+        now = time.time()
+        entries = []
+        for e in os.scandir(self.dir):
+            if e.name.endswith(".json"):
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes * 3 // 4 and now - mtime <= self.ttl:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.stats["evicted"] += removed
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits_memory"] + self.stats["hits_disk"] + self.stats["misses"]
+            hits = self.stats["hits_memory"] + self.stats["hits_disk"]
+            return {"mode": self.mode, "memory_items": len(self._mem), "disk_bytes": self._disk_bytes,
+                    "hit_rate": round(hits / lookups, 3) if lookups else None, **self.stats}
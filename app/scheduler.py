@@ -0,0 +1,224 @@
+from __future__ import annotations
+import heapq, itertools, os, queue, threading, time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator
+
+
+class QueueFull(RuntimeError):
+    """Очередь инференса заполнена — сервер отвечает 429."""
+
+
+class _Job:
+    __slots__ = ("fn", "args", "key", "future", "enqueued", "background", "queued")
+
+    def __init__(self, fn: Callable, args: tuple, key: str, background: bool):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+        self.background = background
+        self.queued = True  # в куче и в счётчиках глубины; отменённая задача выбывает сразу
+
+
+class _Stream:
+    """Итератор InferenceScheduler.stream(). В отличие от генератора, close() и __del__ работают
+    и до первого next(): брошенный нечитаным поток не догенерирует ответ впустую."""
+
+    def __init__(self, out: queue.Queue, done: object, box: Dict[str, Any], future: Future):
+        self._out = out
+        self._done = done
+        self._box = box
+        self._future = future
+        self._finished = False
+
+    def __iter__(self) -> "_Stream":
+        return self
+
+    def __next__(self) -> Any:
+        if self._finished:
+            raise StopIteration
+        item = self._out.get()
+        if item is self._done:
+            self._finished = True
+            self._future.result()  # пробросить исключение генерации
+            raise StopIteration
+        return item
+
+    def close(self) -> None:
+        self._finished = True
+        self._box["closed"] = True
+        self._future.cancel()  # ещё в очереди — просто не запустится
+
+    def __del__(self) -> None:
+        self.close()
+
+
+class InferenceScheduler:
+    """Очередь к локальной модели.
+
+    Генерации выполняют `workers` рабочих потоков (по одному на экземпляр модели;
+    для единственного Llama — один поток, и к модели одновременно обращается
+    только одна генерация). Порядок: сначала priority (меньше — раньше), внутри приоритета —
+    честная очередь по кампаниям (виртуальное время: у каждой кампании свой счётчик,
+    так что шумный стол не вытесняет остальные), затем FIFO. Глубина ограничена
+    `BITD_LLM_QUEUE_DEPTH` (16): сверх неё submit бросает QueueFull. Фоновые задачи (priority > 0:
+    пакетные прогоны, конспекты) считаются отдельно и занимают не больше половины глубины, так что
+    живому ходу (priority 0) они отказ не вызывают.
+    """
+
+    def __init__(self, max_depth: int | None = None, name: str = "llm", workers: int = 1):
+        if max_depth is None:
+            max_depth = int(os.getenv("BITD_LLM_QUEUE_DEPTH", "16"))
+        self.max_depth = max(1, int(max_depth))
+        self.background_depth = max(1, self.max_depth // 2)
+        self._depth = 0       # живых задач в очереди (отменённые лежат в куче до выборки, но не считаются)
+        self._background = 0  # из них фоновых
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._vtime = 0               # виртуальное время последней запущенной задачи
+        self._finish: Dict[str, int] = {}  # кампания -> виртуальное время её последней задачи
+        self._cond = threading.Condition()
+        self._running: Dict[int, _Job] = {}
+        self._wait_ms: deque = deque(maxlen=512)
+        self._run_ms: deque = deque(maxlen=512)
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "cancelled": 0}
+        self.workers = max(1, int(workers))
+        self._threads = [threading.Thread(target=self._loop, name=f"{name}-scheduler-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    # ---- submit ----
+    def submit(self, fn: Callable, *args: Any, key: str | None = None, priority: int = 0, admitted: bool = False) -> Future:
+        """Ставит fn(*args) в очередь; результат — concurrent.futures.Future.
+        admitted=True — продолжение уже принятого запроса (второй этап хода): лимит глубины не проверяется."""
+        background = int(priority) > 0
+        job = _Job(fn, args, key or "default", background)
+        with self._cond:
+            if background:
+                full, limit = self._background >= self.background_depth, self.background_depth
+            else:
+                full, limit = self._depth - self._background >= self.max_depth, self.max_depth
+            if full and not admitted:
+                self.counters["rejected"] += 1
+                raise QueueFull(f"Очередь модели заполнена ({limit})")
+            self._depth += 1
+            self._background += background
+            start = max(self._vtime, self._finish.get(job.key, 0)) + 1
+            self._finish[job.key] = start
+            heapq.heappush(self._heap, (int(priority), start, next(self._seq), job))
+            self.counters["submitted"] += 1
+            self._cond.notify()
+        job.future.add_done_callback(lambda f: self._cancelled(job) if f.cancelled() else None)
+        return job.future
+
+    def _dequeue(self, job: _Job) -> None:
+        # под self._cond
+        if job.queued:
+            job.queued = False
+            self._depth -= 1
+            self._background -= job.background
+
+    def _cancelled(self, job: _Job) -> None:
+        """Задачу отменили в очереди (клиент ушёл): место освобождается сразу, а не когда
+        рабочий поток доберётся до неё в куче. Если мёртвых записей в куче больше живых, куча пересобирается."""
+        with self._cond:
+            self._dequeue(job)
+            self.counters["cancelled"] += 1
+            if len(self._heap) > 2 * self._depth + 16:
+                self._heap = [e for e in self._heap if e[-1].queued]
+                heapq.heapify(self._heap)
+
+    def run(self, fn: Callable, *args: Any, key: str | None = None, priority: int = 0, admitted: bool = False) -> Any:
+        return self.submit(fn, *args, key=key, priority=priority, admitted=admitted).result()
+
+    def stream(self, fn: Callable[..., Iterator[Any]], *args: Any, key: str | None = None, priority: int = 0,
+               admitted: bool = False) -> Iterator[Any]:
+        """Ставит генератор fn(*args) в очередь сразу (QueueFull — здесь же) и возвращает итератор
+        по его элементам. Генератор крутится в рабочем потоке; закрытие итератора (или его сборка
+        мусором — ответ бросили, не начав читать) снимает задачу с очереди или останавливает её."""
+        out: queue.Queue = queue.Queue()
+        done = object()
+        box: Dict[str, Any] = {}
+
+        def pump():
+            it = fn(*args)
+            try:
+                for item in it:
+                    if box.get("closed"):
+                        break
+                    out.put(item)
+            finally:
+                close = getattr(it, "close", None)
+                if close is not None:
+                    close()
+                out.put(done)
+
+        future = self.submit(pump, key=key, priority=priority, admitted=admitted)
+        return _Stream(out, done, box, future)
+
+    # ---- worker ----
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                priority, start, _, job = heapq.heappop(self._heap)
+                if not job.queued:
+                    continue  # отменена, пока ждала
+                self._dequeue(job)
+                self._vtime = start
+                # кампания, все задачи которой уже стартовали, и без записи получит _vtime + 1
+                for k in [k for k, f in self._finish.items() if f <= start]:
+                    del self._finish[k]
+                if not job.future.set_running_or_notify_cancel():
+                    continue  # отменили между выборкой и запуском (учтено в _cancelled)
+                self._running[threading.get_ident()] = job
+            began = time.perf_counter()
+            try:
+                result = job.fn(*job.args)
+            except BaseException as e:
+                job.future.set_exception(e)
+                ok = False
+            else:
+                job.future.set_result(result)
+                ok = True
+            ended = time.perf_counter()
+            with self._cond:
+                self._running.pop(threading.get_ident(), None)
+                self.counters["completed" if ok else "failed"] += 1
+                self._wait_ms.append((began - job.enqueued) * 1000)
+                self._run_ms.append((ended - began) * 1000)
+
+    # ---- metrics ----
+    @staticmethod
+    def _pct(samples, p: float) -> float | None:
+        if not samples:
+            return None
+        xs = sorted(samples)
+        return round(xs[min(len(xs) - 1, int(p * len(xs)))], 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            waiting: Dict[str, int] = {}
+            for *_, job in self._heap:
+                if job.queued:
+                    waiting[job.key] = waiting.get(job.key, 0) + 1
+            return {
+                "depth": self._depth, "max_depth": self.max_depth,
+                "background": self._background, "background_depth": self.background_depth,
+                "workers": self.workers,
+                "running": [job.key for job in self._running.values()],
+                "waiting_by_campaign": waiting,
+                **self.counters,
+                "queue_wait_ms": {"p50": self._pct(self._wait_ms, 0.5), "p95": self._pct(self._wait_ms, 0.95)},
+                "run_ms": {"p50": self._pct(self._run_ms, 0.5), "p95": self._pct(self._run_ms, 0.95)},
+            }
+
+    def retry_after(self) -> int:
+        """Грубая оценка (секунды), когда очередь освободится, — для заголовка Retry-After."""
+        with self._cond:
+            run = self._pct(self._run_ms, 0.5) or 5000.0
+            return max(1, int(run * (self._depth / self.workers + 1) / 1000))
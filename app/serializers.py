@@ -0,0 +1,91 @@
+from __future__ import annotations
+import json, os
+from typing import Any, Dict
+
+ORJSON_OK = True
+MSGPACK_OK = True
+try:
+    import orjson
+except Exception:
+    ORJSON_OK = False
+
+try:
+    import msgpack
+except Exception:
+    MSGPACK_OK = False
+
+
+class Serializer:
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class PrettyJson(Serializer):
+    # только для /export и ручного чтения: в 3–5 раз больше и медленнее компактного
+    name = "json-pretty"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+class OrJson(Serializer):
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgPack(Serializer):
+    name = "msgpack"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+SERIALIZERS: Dict[str, type] = {"json": Serializer, "json-pretty": PrettyJson, "orjson": OrJson, "msgpack": MsgPack}
+
+
+def get_serializer(name: str | None = None) -> Serializer:
+    """BITD_STATE_FORMAT: auto (orjson, если установлен, иначе json), json, orjson, msgpack."""
+    name = (name or os.getenv("BITD_STATE_FORMAT") or "auto").strip().lower()
+    if name == "auto":
+        name = "orjson" if ORJSON_OK else "json"
+    if name not in SERIALIZERS:
+        raise ValueError(f"Неизвестный BITD_STATE_FORMAT: {name}")
+    if name == "orjson" and not ORJSON_OK:
+        raise RuntimeError("orjson не установлен")
+    if name == "msgpack" and not MSGPACK_OK:
+        raise RuntimeError("msgpack не установлен")
+    return SERIALIZERS[name]()
+
+
+def json_dumps(obj: Any) -> bytes:
+    """Компактный JSON (orjson, если есть) — для журналов и колонок."""
+    return orjson.dumps(obj) if ORJSON_OK else Serializer().dumps(obj)
+
+
+def json_loads(data: bytes | str) -> Any:
+    return orjson.loads(data) if ORJSON_OK else json.loads(data)
+
+
+def loads(data: bytes) -> Any:
+    """Формат определяется по первому байту: JSON начинается с '{' / '[' (после пробелов), иначе msgpack."""
+    head = data.lstrip()[:1]
+    if head in (b"{", b"["):
+        return json_loads(data)
+    if head.startswith(b"\xef"):  # UTF-8 BOM
+        return json.loads(data.decode("utf-8-sig"))
+    if not MSGPACK_OK:
+        raise RuntimeError("Файл состояния в формате msgpack, но msgpack не установлен")
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
@@ -1,37 +1,515 @@
 
 from __future__ import annotations
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import uvicorn, os, json, csv, io, random, traceback
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import uvicorn, os, json, csv, io, random, traceback, asyncio, threading, time
 
-from .state import StateStore, DEFAULT_ACTIONS
+from .state import open_store, DEFAULT_ACTIONS, StateConflict
+from .serializers import PrettyJson, json_dumps
 from .gm_agent import GMAgent
+from .scheduler import QueueFull
+from .resilience import CircuitOpen
+from .loader import BackgroundLoader, NotReady
+from .sessions import Session, SessionManager, table_key
 from .tools import action_roll, resistance_roll, fortune_roll
 
 app = FastAPI(title="BitD GM AI")
 
-state = StateStore(path=os.getenv("BITD_STATE_PATH", "data/state.json"))
-agent = GMAgent(state)
+state = open_store(os.getenv("BITD_STATE_PATH", "data/state.json"))
+# Модель грузится в фоне (BITD_LLM_LOAD=startup, по умолчанию) или при первом обращении (on_demand):
+# механика (/roll/*, /clock/*, /state) отвечает сразу, /chat до готовности — 503 с Retry-After
+def _build_agent() -> GMAgent:
+    agent = GMAgent(state)
+    agent_loader.phase("warming")
+    agent.warmup()
+    return agent
+
+agent_loader: BackgroundLoader[GMAgent] = BackgroundLoader("llm", _build_agent)
+
+@app.on_event("startup")
+def _load_model() -> None:
+    if os.getenv("BITD_LLM_LOAD", "startup").strip().lower() != "on_demand":
+        agent_loader.start()
+
+def _agent() -> GMAgent:
+    try:
+        return agent_loader.get()
+    except NotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+class StateReply:
+    """Ответ мутирующего эндпоинта.
+
+    По умолчанию — полный `state` и `version`. С `?delta=1` (или заголовком
+    `X-State-Delta: 1`) — только `patch` (JSON Patch текущей кампании) от версии
+    клиента: `?since=` / `X-State-Version`. Без базовой версии патч не из чего строить (угаданная
+    база могла бы пропустить чужую запись) — тогда, как и при обрыве журнала (смена кампании,
+    импорт, старая версия), отдаётся полный `state`.
+    """
+
+    def __init__(self, request: Request):
+        q, h = request.query_params, request.headers
+        flag = q.get("delta") or h.get("x-state-delta") or ""
+        self.delta = flag.strip().lower() in ("1", "true", "yes")
+        since = (q.get("since") or h.get("x-state-version") or "").strip()
+        self.since = int(since) if since.isdigit() else None
+
+    def __call__(self, **extra: Any) -> Dict[str, Any]:
+        if self.delta and self.since is not None:
+            version, ops = state.changes_since(self.since)
+            if ops is not None:
+                return {**extra, "version": version, "patch": ops}
+        version, cur = state.snapshot()
+        return {**extra, "state": cur, "version": version}
+
+sessions = SessionManager()
 
 class ChatReq(BaseModel):
     history: List[Dict[str, str]] = []
     user: str
+    # id серверной сессии (вкладка UI, запуск CLI): история берётся с сервера, history в теле не нужен
+    session: Optional[str] = None
 
 class ChatResp(BaseModel):
     narration: str
     intent: Dict[str, Any] | None
     tool_result: Dict[str, Any] | None
     raw: str
+    timings: Dict[str, float] = {}  # мс по этапам: generate | intent, roll, narration
+
+def _busy(e: QueueFull) -> HTTPException:
+    sched = _agent().llm.scheduler
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(sched.retry_after() if sched else 1)})
+
+def _unavailable(e: CircuitOpen) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _open_session(sid: str) -> Session:
+    """Сессия стола текущей кампании с захваченным lock: ходы одного стола идут по очереди."""
+    try:
+        return sessions.open(sid, state.current_campaign())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _aopen_session(sid: str) -> Session:
+    """_open_session для async-эндпоинтов: ход стола ждётся в цикле событий, без потока пула."""
+    campaign = await run_in_threadpool(state.current_campaign)
+    try:
+        return await sessions.aopen(sid, campaign)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/chat", response_model=ChatResp)
-def chat(body: ChatReq):
-    out = agent.step(body.history, body.user)
+async def chat(body: ChatReq):
+    # async: пока модель генерирует, поток пула Starlette свободен для /roll/*, /clock/* и т.п.
+    agent = _agent()
+    session = await _aopen_session(body.session) if body.session else None
+    done = False
+    try:
+        history, key, offset = (list(session.history), session.key, session.offset) if session else (body.history, None, 0)
+        out = await agent.astep(history, body.user, key=key, offset=offset)
+        if session:
+            await run_in_threadpool(session.append, body.user, out["narration"])
+        done = True
+    except QueueFull as e:
+        raise _busy(e)
+    except CircuitOpen as e:
+        raise _unavailable(e)
+    finally:
+        if session:
+            sessions.close(session, turn=done)
     return ChatResp(**out)
 
+@app.get("/session/{sid}")
+def session_history(sid: str):
+    """История стола (сессия × текущая кампания) — для UI после перезагрузки страницы."""
+    campaign = state.current_campaign()
+    try:
+        return {"session": sid, "campaign": campaign, "history": sessions.history(sid, campaign)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/session/{sid}")
+def session_drop(sid: str):
+    """Начать стол заново: история сессии в текущей кампании забывается (и конспект её окна контекста)."""
+    campaign = state.current_campaign()
+    try:
+        ok = sessions.drop(sid, campaign)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if agent_loader.ready:
+        _agent().context.forget(table_key(sid, campaign))
+    return {"ok": ok}
+
+@app.get("/sessions")
+def sessions_info():
+    """Серверные сессии: сколько в памяти, занятые ходом, загруженные с диска, вытесненные."""
+    return sessions.info()
+
+@app.get("/ready")
+def ready():
+    """Готова ли модель: 200, когда /chat можно звать, иначе 503 (loading | failed, ошибка, время загрузки)."""
+    return JSONResponse(agent_loader.info(), status_code=200 if agent_loader.ready else 503)
+
+@app.get("/health")
+def health():
+    """Здоровье модели: стадия (loading | warming | ready | failed), время загрузки и прогрева, mlock,
+    задержка последней генерации и ошибки. 200 — модель прогрета, иначе 503 (run_app ждёт 200)."""
+    load = agent_loader.info()
+    info: Dict[str, Any] = {"status": load["state"], "load": load}
+    if agent_loader.ready:
+        agent = _agent()
+        info["llm"] = agent.llm.health_info()
+        if agent.intent_llm is not agent.llm:
+            info["intent_llm"] = agent.intent_llm.health_info()
+    return JSONResponse(info, status_code=200 if agent_loader.ready else 503)
+
+@app.get("/llm/queue")
+def llm_queue():
+    """Метрики очереди локальной модели: глубина, ожидающие по кампаниям, p50/p95 ожидания и генерации."""
+    agent = _agent()
+    sched = agent.llm.scheduler
+    if sched is None:
+        return {"enabled": False}
+    pool = agent.llm._pool
+    return {**sched.stats(), **({"pool": pool.stats()} if pool is not None else {})}
+
+@app.get("/llm/backend")
+def llm_backend():
+    """Бэкенд модели; для HTTP — адрес, таймаут, состояние предохранителя и счётчики повторов."""
+    return _agent().llm.backend_info()
+
+@app.get("/llm/stages")
+def llm_stages():
+    """p50/p95 этапов хода: generate и roll (один вызов) или intent, roll, narration (BITD_PIPELINE=two_stage).
+    Ходы /chat/batch — отдельно, в batch."""
+    agent = _agent()
+    return {"pipeline": "two_stage" if agent.two_stage else "single", "stages": agent.stages.summary(),
+            "batch": agent.batch_stages.summary()}
+
+@app.get("/llm/context")
+def llm_context():
+    """Окно контекста: бюджет токенов, покрытие конспектов по кампаниям, свёрнутые и отброшенные реплики."""
+    return _agent().context.info()
+
+@app.get("/llm/responses")
+def llm_responses():
+    """Кэш ответов: режим, попадания в память и на диск, промахи, обходы (temperature > 0), вытеснения."""
+    return _agent().llm.responses.info()
+
+@app.get("/llm/speculative")
+def llm_speculative():
+    """Спекулятивное декодирование llama_cpp: предложенные и принятые токены черновика (LLAMA_SPECULATIVE=off — пусто)."""
+    return _agent().llm.speculative_stats()
+
+@app.get("/llm/cache")
+def llm_cache():
+    """Кэш префиксов llama_cpp: hit_rate, переиспользованные токены, занятый объём (LLAMA_CACHE=off — пусто)."""
+    return _agent().llm.cache_stats()
+
+def _etag(version: int) -> str:
+    return f'W/"{version}"'
+
+def _not_modified(request: Request) -> Response | None:
+    """304 по If-None-Match, если версия состояния не менялась — без чтения и сериализации кампании."""
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return None
+    version = state.current_version()
+    tags = [t.strip() for t in inm.split(",")]
+    if "*" in tags or _etag(version) in tags:
+        return Response(status_code=304, headers={"ETag": _etag(version), "X-State-Version": str(version)})
+    return None
+
+def _validators(response: Response, version: int) -> None:
+    response.headers["ETag"] = _etag(version)
+    response.headers["X-State-Version"] = str(version)
+    response.headers["Cache-Control"] = "no-cache"  # кэшировать можно, но только с перепроверкой
+
+async def _pump(it: Iterator[Any]) -> AsyncIterator[Any]:
+    """Блокирующий итератор (ход ждёт токены модели) — в async-генератор: его читает отдельный поток,
+    элементы передаются в цикл событий через asyncio.Queue. Потоки пула Starlette токенов не ждут.
+    aclose() останавливает чтение: поток закрывает итератор на следующем элементе."""
+    loop = asyncio.get_running_loop()
+    items: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def put(item: Any) -> None:
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, item)
+        except RuntimeError:
+            stop.set()  # цикл событий уже закрыт — читать некому
+
+    def run() -> None:
+        error = None
+        try:
+            for item in it:
+                if stop.is_set():
+                    break
+                put((item, None))
+        except BaseException as e:
+            error = e
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+            put((end, error))
+
+    threading.Thread(target=run, name="chat-stream", daemon=True).start()
+    try:
+        while True:
+            item, error = await items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+@app.post("/chat/stream")
+async def chat_stream(body: ChatReq):
+    """SSE: `token` — куски нарратива, `intent` и `tool_result` — как только закрылся json-блок,
+    `done` — итог в формате /chat. Как и /chat, ход стола ждётся в цикле событий, а токены читает
+    отдельный поток (_pump) — медленные потоки не занимают пул, которым обслуживаются /state и /health."""
+    agent = _agent()
+    session = await _aopen_session(body.session) if body.session else None
+    turn = {"open": session is not None, "done": False, "started": False}
+    events = None
+
+    def close():
+        # из генератора или фоновой задачей ответа (клиент ушёл до первого события) — один раз
+        if events is not None and not turn["started"]:
+            events.close()  # не начатый поток освобождает задачу модели в очереди
+        if turn["open"]:
+            turn["open"] = False
+            sessions.close(session, turn=turn["done"])
+
+    try:
+        history, key, offset = (list(session.history), session.key, session.offset) if session else (body.history, None, 0)
+        events = await run_in_threadpool(agent.step_stream, history, body.user, key=key, offset=offset)
+    except QueueFull as e:
+        close()
+        raise _busy(e)
+    except CircuitOpen as e:
+        close()
+        raise _unavailable(e)
+    except BaseException:
+        close()
+        raise
+
+    async def gen():
+        turn["started"] = True  # дальше итератор хода закрывает поток _pump
+        stream = _pump(events)
+        try:
+            async for event in stream:
+                kind = event.pop("type")
+                if kind == "done" and session:
+                    await run_in_threadpool(session.append, body.user, event["narration"])
+                    turn["done"] = True
+                yield _sse_message(kind, event)
+        finally:
+            await stream.aclose()
+            close()
+    return StreamingResponse(gen(), media_type="text/event-stream", background=BackgroundTask(close),
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    history: List[Dict[str, str]] = []
+    user: str
+
+class BatchReq(BaseModel):
+    items: List[BatchItem]
+    concurrency: int = 4        # одновременных ходов (не больше BITD_BATCH_MAX_CONCURRENCY)
+    apply_state: bool = False   # по умолчанию броски не меняют кампанию
+    log: bool = False           # писать ли ходы в data/logs/chat.jsonl (это и датасет для SFT)
+
+BATCH_PRIORITY = 5  # живые столы (0) идут раньше, фоновые конспекты (10) — позже
+
+async def _batch_step(agent: GMAgent, item: BatchItem, key: str, body: BatchReq) -> Dict[str, Any]:
+    while True:
+        try:
+            return await agent.astep(item.history, item.user, log_dir="data/logs" if body.log else None,
+                                     priority=BATCH_PRIORITY, key=key, commit=body.apply_state, stages=agent.batch_stages)
+        except QueueFull:
+            # очередь занята живыми столами — ждём, а не роняем пункт
+            sched = agent.llm.scheduler
+            await asyncio.sleep(sched.retry_after() if sched else 1)
+
+@app.post("/chat/batch")
+async def chat_batch(body: BatchReq):
+    """Пакетный прогон сценариев (оценка промптов и моделей, повторы логов) через GMAgent.
+
+    Ответ — NDJSON: по строке на пункт в порядке готовности (`id`, `ok`, поля /chat или `error`,
+    `latency_ms`), последней — `{"summary": ...}` с пропускной способностью. Ходы идут параллельно
+    (`concurrency`): пул llama_cpp и серверы вроде vLLM / llama.cpp server пакетируют их сами.
+    Каждый пункт — отдельный стол (`batch/<id>`) с низким приоритетом; кампания не меняется,
+    пока не задан `apply_state`."""
+    agent = _agent()
+    limit = max(1, min(body.concurrency, int(os.getenv("BITD_BATCH_MAX_CONCURRENCY", "32"))))
+    sched = agent.llm.scheduler
+    if sched is not None:
+        limit = min(limit, sched.background_depth)  # больше ходов в полёте очередь фоновых задач всё равно не примет
+    sem = asyncio.Semaphore(limit)
+    done: asyncio.Queue = asyncio.Queue()
+
+    async def run(i: int, item: BatchItem) -> None:
+        rec: Dict[str, Any] = {"id": item.id or str(i)}
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                rec.update(ok=True, **await _batch_step(agent, item, f"batch/{rec['id']}", body))
+            except Exception as e:
+                rec.update(ok=False, error=f"{type(e).__name__}: {e}")
+            rec["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        await done.put(rec)
+
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(body.items)]
+
+    async def gen():
+        ok, latencies = 0, []
+        try:
+            for _ in tasks:
+                rec = await done.get()
+                ok += rec["ok"]
+                latencies.append(rec["latency_ms"])
+                yield json.dumps(rec, ensure_ascii=False) + "\n"
+        finally:
+            for t in tasks:
+                t.cancel()  # клиент ушёл — недоделанные пункты не нужны
+        wall = time.perf_counter() - t0
+        latencies.sort()
+        summary = {"items": len(tasks), "ok": ok, "failed": len(tasks) - ok, "concurrency": limit, "wall_s": round(wall, 3),
+                   "items_per_s": round(len(tasks) / wall, 3) if wall else None,
+                   "latency_ms_p50": latencies[len(latencies) // 2] if latencies else None,
+                   "latency_ms_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None}
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+    return StreamingResponse(gen(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
 @app.get("/state")
-def get_state():
-    return state.get()
+def get_state(request: Request, response: Response):
+    hit = _not_modified(request)
+    if hit is not None:
+        return hit
+    version, cur = state.snapshot()
+    _validators(response, version)
+    return cur
+
+class StateEvents:
+    """Рассылка изменений состояния подписчикам /state/stream.
+
+    Один фоновый поток ждёт записей в хранилище (`wait_changes`) и кладёт события
+    `{"version", "since", "patch"}` (или `{"version", "state"}`, если патча нет)
+    в asyncio-очереди подписчиков. Переполненная очередь сбрасывается маркером None —
+    подписчик тогда заново получает полный снимок.
+    """
+
+    def __init__(self, store, timeout: float = 5.0):
+        self.store = store
+        self.timeout = timeout
+        self._subs: set = set()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=int(os.getenv("BITD_STREAM_QUEUE", "64")))
+        with self._lock:
+            self._subs.add((asyncio.get_running_loop(), q))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="state-events", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        with self._lock:
+            self._subs = {s for s in self._subs if s[1] is not q}
+
+    @staticmethod
+    def _put(q: asyncio.Queue, event: Dict[str, Any]) -> None:
+        try:
+            q.put_nowait(event)
+        except asyncio.QueueFull:
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(None)
+
+    def _run(self) -> None:
+        version = self.store.current_version()
+        while True:
+            try:
+                new, ops = self.store.wait_changes(version, self.timeout)
+                if new == version:
+                    continue
+                if ops is not None:
+                    event = {"version": new, "since": version, "patch": ops}
+                else:
+                    new, cur = self.store.snapshot()
+                    event = {"version": new, "state": cur}
+                version = new
+            except Exception:
+                traceback.print_exc()
+                continue
+            with self._lock:
+                subs = list(self._subs)
+            for loop, q in subs:
+                try:
+                    loop.call_soon_threadsafe(self._put, q, event)
+                except RuntimeError:  # цикл подписчика уже закрыт
+                    self.unsubscribe(q)
+
+events = StateEvents(state)
+
+def _sse_message(kind: str, data: Any, event_id: int | None = None) -> bytes:
+    head = (b"id: %d\n" % event_id) if event_id is not None else b""
+    return head + b"event: " + kind.encode() + b"\ndata: " + json_dumps(data) + b"\n\n"
+
+def _sse(event: Dict[str, Any]) -> bytes:
+    return _sse_message("patch" if "patch" in event else "state", event, event["version"])
+
+@app.get("/state/stream")
+async def state_stream(request: Request):
+    """SSE: сначала `state` (или `patch` от Last-Event-ID), затем `patch`/`state` на каждое изменение."""
+    q = events.subscribe()
+    last = (request.headers.get("last-event-id") or "").strip()
+
+    async def gen():
+        try:
+            version, ops = (await run_in_threadpool(state.changes_since, int(last))) if last.isdigit() else (None, None)
+            if ops is not None:
+                yield _sse({"version": version, "since": int(last), "patch": ops})
+            else:
+                version, cur = await run_in_threadpool(state.snapshot)
+                yield _sse({"version": version, "state": cur})
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(q.get(), 15)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if event is not None and event["version"] <= version:
+                    continue
+                if event is None or ("patch" in event and event["since"] != version):
+                    # пропустили события — догоняем полным снимком
+                    v, cur = await run_in_threadpool(state.snapshot)
+                    event = {"version": v, "state": cur}
+                version = event["version"]
+                yield _sse(event)
+        finally:
+            events.unsubscribe(q)
+
+    return StreamingResponse(gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/state/cache")
+def state_cache_info():
+    return state.cache_info()
 
 # ---------- Config & Rules ----------
 class ConfigUpdate(BaseModel):
@@ -39,26 +517,26 @@ class ConfigUpdate(BaseModel):
     value: Any
 
 @app.post("/config/update")
-def config_update(body: ConfigUpdate):
+def config_update(body: ConfigUpdate, reply: StateReply = Depends()):
     state.set_config(body.path, body.value)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class Thresholds(BaseModel):
     player: Optional[int] = None
     crew: Optional[int] = None
 
 @app.post("/rules/set_thresholds")
-def rules_thresholds(body: Thresholds):
+def rules_thresholds(body: Thresholds, reply: StateReply = Depends()):
     state.set_thresholds(player=body.player, crew=body.crew)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class PresetBody(BaseModel):
     name: str
 
 @app.post("/rules/use_preset")
-def rules_use_preset(body: PresetBody):
+def rules_use_preset(body: PresetBody, reply: StateReply = Depends()):
     state.use_trigger_preset(body.name)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class ConsSuggest(BaseModel):
     position: str
@@ -78,14 +556,14 @@ class ClockFill(BaseModel):
     n: int
 
 @app.post("/clock/create")
-def clock_create(body: ClockCreate):
+def clock_create(body: ClockCreate, reply: StateReply = Depends()):
     state.upsert_clock(body.name, body.segments)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/clock/fill")
-def clock_fill(body: ClockFill):
+def clock_fill(body: ClockFill, reply: StateReply = Depends()):
     state.fill_clock(body.name, body.n)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class MetaUpdate(BaseModel):
     heat: Optional[int] = None
@@ -94,9 +572,9 @@ class MetaUpdate(BaseModel):
     coin: Optional[int] = None
 
 @app.post("/state/update")
-def update_meta(body: MetaUpdate):
+def update_meta(body: MetaUpdate, reply: StateReply = Depends()):
     state.set_meta(heat=body.heat, wanted=body.wanted, rep=body.rep, coin=body.coin)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 # ---------- Dice ----------
 class DiceReq(BaseModel):
@@ -128,11 +606,11 @@ class Flashback(BaseModel):
     stress_cost: int
 
 @app.post("/gm/flashback")
-def gm_flashback(body: Flashback):
-    cur = state.get()
-    old = int(cur.get("players", {}).get(body.name, {}).get("stress", 0))
-    state.set_stress(body.name, old + int(body.stress_cost))
-    return {"ok": True, "state": state.get()}
+def gm_flashback(body: Flashback, reply: StateReply = Depends()):
+    with state.transaction() as cur:
+        old = int(cur.get("players", {}).get(body.name, {}).get("stress", 0))
+        state.set_stress(body.name, old + int(body.stress_cost))
+    return reply(ok=True)
 
 # ---------- Characters ----------
 class PlayerCreate(BaseModel):
@@ -156,29 +634,29 @@ class PlayerConsumePending(BaseModel):
     label: str
 
 @app.post("/player/upsert")
-def player_upsert(body: PlayerCreate):
+def player_upsert(body: PlayerCreate, reply: StateReply = Depends()):
     state.upsert_player(body.name)
-    return {"ok": True, "state": state.get(), "actions": DEFAULT_ACTIONS}
+    return reply(ok=True, actions=DEFAULT_ACTIONS)
 
 @app.post("/player/set_action")
-def player_set_action(body: PlayerSetAction):
+def player_set_action(body: PlayerSetAction, reply: StateReply = Depends()):
     state.set_action(body.name, body.action, body.rating)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/player/set_stress")
-def player_set_stress(body: PlayerStress):
+def player_set_stress(body: PlayerStress, reply: StateReply = Depends()):
     state.set_stress(body.name, body.stress)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/player/add_trauma")
-def player_add_trauma(body: PlayerTrauma):
+def player_add_trauma(body: PlayerTrauma, reply: StateReply = Depends()):
     state.add_trauma(body.name, body.label)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/player/consume_pending_trauma")
-def player_consume_pending(body: PlayerConsumePending):
+def player_consume_pending(body: PlayerConsumePending, reply: StateReply = Depends()):
     state.consume_pending_trauma(body.name, body.label)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 # Resistance that also applies stress directly
 class ResistApply(BaseModel):
@@ -186,15 +664,15 @@ class ResistApply(BaseModel):
     dice: int
 
 @app.post("/roll/resist_apply")
-def roll_resist_apply(body: ResistApply):
+def roll_resist_apply(body: ResistApply, reply: StateReply = Depends()):
     res = resistance_roll(body.dice)
     try:
-        cur = state.get()
-        old = int(cur.get("players", {}).get(body.name, {}).get("stress", 0))
-        state.set_stress(body.name, old + int(res["stress_cost"]))
+        with state.transaction() as cur:
+            old = int(cur.get("players", {}).get(body.name, {}).get("stress", 0))
+            state.set_stress(body.name, old + int(res["stress_cost"]))
     except Exception:
         pass
-    return {"applied_to": body.name, **res, "state": state.get()}
+    return reply(applied_to=body.name, **res)
 
 # ---------- Crew ----------
 class CrewUpdate(BaseModel):
@@ -205,9 +683,9 @@ class CrewUpdate(BaseModel):
     upgrades: Optional[Dict[str, Any]] = None
 
 @app.post("/crew/update")
-def crew_update(body: CrewUpdate):
+def crew_update(body: CrewUpdate, reply: StateReply = Depends()):
     state.set_crew(name=body.name, playbook=body.playbook, tier=body.tier, hold=body.hold, upgrades=body.upgrades or None)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 # ---------- Campaigns ----------
 class CampaignCreate(BaseModel):
@@ -217,18 +695,23 @@ class CampaignSwitch(BaseModel):
     name: str
 
 @app.post("/campaign/create")
-def campaign_create(body: CampaignCreate):
+def campaign_create(body: CampaignCreate, reply: StateReply = Depends()):
     state.create_campaign(body.name)
-    return {"ok": True, "state": state.get(), "campaigns": state.list_campaigns()}
+    return reply(ok=True, campaigns=state.list_campaigns())
 
 @app.post("/campaign/switch")
-def campaign_switch(body: CampaignSwitch):
+def campaign_switch(body: CampaignSwitch, reply: StateReply = Depends()):
     state.switch_campaign(body.name)
-    return {"ok": True, "state": state.get(), "campaigns": state.list_campaigns()}
+    return reply(ok=True, campaigns=state.list_campaigns())
 
 @app.get("/campaign/list")
-def campaign_list():
-    return {"campaigns": state.list_campaigns(), "state": state.get()}
+def campaign_list(request: Request, response: Response):
+    hit = _not_modified(request)
+    if hit is not None:
+        return hit
+    version, cur = state.snapshot()
+    _validators(response, version)
+    return {"campaigns": state.list_campaigns(), "state": cur}
 
 # ---------- Factions ----------
 class FacUpsert(BaseModel):
@@ -249,24 +732,24 @@ class FacClockFill(BaseModel):
     n: int
 
 @app.post("/faction/upsert")
-def faction_upsert(body: FacUpsert):
+def faction_upsert(body: FacUpsert, reply: StateReply = Depends()):
     state.faction_upsert(body.name)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/faction/set_status")
-def faction_set_status(body: FacStatus):
+def faction_set_status(body: FacStatus, reply: StateReply = Depends()):
     state.faction_set_status(body.name, body.status)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/faction/clock_create")
-def faction_clock_create(body: FacClockCreate):
+def faction_clock_create(body: FacClockCreate, reply: StateReply = Depends()):
     state.faction_clock_create(body.name, body.clock, body.segments)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.post("/faction/clock_fill")
-def faction_clock_fill(body: FacClockFill):
+def faction_clock_fill(body: FacClockFill, reply: StateReply = Depends()):
     state.faction_clock_fill(body.name, body.clock, body.n)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 # ---------- Logs export ----------
 @app.get("/logs/export_json")
@@ -323,18 +806,18 @@ class HarmClear(BaseModel):
     idx: int
 
 @app.post("/player/add_harm")
-def player_add_harm(body: HarmAdd):
+def player_add_harm(body: HarmAdd, reply: StateReply = Depends()):
     state.add_harm(body.name, body.level, body.label, body.kind)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.get("/player/list_harms")
 def player_list_harms(name: str):
     return {"harms": state.list_harms(name)}
 
 @app.post("/player/clear_harm")
-def player_clear_harm(body: HarmClear):
+def player_clear_harm(body: HarmClear, reply: StateReply = Depends()):
     state.clear_harm(body.name, body.idx)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class ConseqUpdate(BaseModel):
     position: str        # Контролируемая/Рискованная/Отчаянная
@@ -342,30 +825,29 @@ class ConseqUpdate(BaseModel):
     lines: list[str]     # список строк
 
 @app.post("/rules/update_consequences")
-def rules_update_consequences(body: ConseqUpdate):
-    cur = state.get()
-    cons = cur.setdefault("config", {}).setdefault("rules", {}).setdefault("consequences", {})
-    cons.setdefault(body.position, {})
-    cons[body.position][body.key] = body.lines
-    state.save_current(cur)
-    return {"ok": True, "state": state.get()}
+def rules_update_consequences(body: ConseqUpdate, reply: StateReply = Depends()):
+    with state.transaction() as cur:
+        cons = cur.setdefault("config", {}).setdefault("rules", {}).setdefault("consequences", {})
+        cons.setdefault(body.position, {})
+        cons[body.position][body.key] = body.lines
+    return reply(ok=True)
 
 class XPAward(BaseModel):
     name: str
     n: int
 
 @app.post("/xp/award")
-def xp_award(body: XPAward):
+def xp_award(body: XPAward, reply: StateReply = Depends()):
     state.add_player_xp(body.name, body.n)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class CrewXPAward(BaseModel):
     n: int
 
 @app.post("/xp/crew_award")
-def xp_crew_award(body: CrewXPAward):
+def xp_crew_award(body: CrewXPAward, reply: StateReply = Depends()):
     state.add_crew_xp(body.n)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 class ApplySuggested(BaseModel):
     suggestion: str
@@ -374,7 +856,7 @@ class ApplySuggested(BaseModel):
     default_segments: int | None = None
 
 @app.post("/gm/apply_suggested")
-def gm_apply_suggested(body: ApplySuggested):
+def gm_apply_suggested(body: ApplySuggested, reply: StateReply = Depends()):
     s = body.suggestion
     try:
         # harm N
@@ -383,26 +865,25 @@ def gm_apply_suggested(body: ApplySuggested):
             level = int(m.group(1))
             label = re.sub(r"\(.*?harm.*?\)", "", s, flags=re.IGNORECASE).strip(" -–:")
             state.add_harm(body.actor, level, label or f"Harm {level}")
-            return {"applied": "harm", "level": level, "actor": body.actor, "state": state.get()}
+            return reply(applied="harm", level=level, actor=body.actor)
         # Heat +N
         m = re.search(r"[Hh]eat\s*\+\s*(\d+)", s)
         if m:
             n = int(m.group(1))
-            cur = state.get()
-            state.set_meta(heat=cur.get("heat",0)+n)
-            return {"applied": "heat", "delta": n, "state": state.get()}
+            state.add_heat(n)
+            return reply(applied="heat", delta=n)
         # Clock +N
         m = re.search(r"(час|clock)[^\d+]*\+\s*(\d+)", s, re.IGNORECASE) or re.search(r":\s*(\d+)$", s)
         if m and (body.clock_name or body.default_segments):
             if body.clock_name:
                 state.fill_clock(body.clock_name, int(m.group(2) if m.lastindex else 1))
-                return {"applied": "clock_fill", "clock": body.clock_name, "delta": int(m.group(2) if m.lastindex else 1), "state": state.get()}
+                return reply(applied="clock_fill", clock=body.clock_name, delta=int(m.group(2) if m.lastindex else 1))
             else:
                 # create default and fill
                 nm = "Сцена: последствие"
                 state.upsert_clock(nm, int(body.default_segments or 4))
                 state.fill_clock(nm, int(m.group(2) if m.lastindex else 1))
-                return {"applied": "clock_fill", "clock": nm, "delta": int(m.group(2) if m.lastindex else 1), "state": state.get()}
+                return reply(applied="clock_fill", clock=nm, delta=int(m.group(2) if m.lastindex else 1))
         # Complication → создать короткий час, заполнить +1, если не указано иное
         if re.search(r"компликац|complicat", s, re.IGNORECASE):
             nm = body.clock_name or ("Компликация: " + s[:32])
@@ -411,9 +892,9 @@ def gm_apply_suggested(body: ApplySuggested):
             mfill = re.search(r"\+\s*(\d+)", s)
             fill = int(mfill.group(1)) if mfill else 1
             state.fill_clock(nm, fill)
-            return {"applied": "complication_clock", "clock": nm, "delta": fill, "state": state.get()}
+            return reply(applied="complication_clock", clock=nm, delta=fill)
         # Complication/noop
-        return {"applied": "noop", "note": "Не удалось распознать/требуются параметры (actor/clock) для применения.", "state": state.get()}
+        return reply(applied="noop", note="Не удалось распознать/требуются параметры (actor/clock) для применения.")
     except Exception as e:
         return {"error": str(e), "trace": traceback.format_exc()}
 
@@ -456,9 +937,9 @@ class AddSuggestion(BaseModel):
     line: str
 
 @app.post("/gm/add_suggestion")
-def gm_add_suggestion(body: AddSuggestion):
+def gm_add_suggestion(body: AddSuggestion, reply: StateReply = Depends()):
     state.add_last_roll_suggestion(body.line)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 
 # ---------- Scene consequence presets ----------
@@ -474,9 +955,9 @@ def rules_save_scene_preset(body: ScenePresetSave):
     return {"ok": True, "presets": state.list_scene_consequence_presets()}
 
 @app.post("/rules/apply_scene_preset")
-def rules_apply_scene_preset(body: ScenePresetApply):
+def rules_apply_scene_preset(body: ScenePresetApply, reply: StateReply = Depends()):
     state.apply_scene_consequence_preset(body.name)
-    return {"ok": True, "state": state.get()}
+    return reply(ok=True)
 
 @app.get("/rules/list_scene_presets")
 def rules_list_scene_presets():
@@ -487,15 +968,22 @@ def rules_list_scene_presets():
 
 @app.get("/export")
 def export_state():
-    return state.export_state()
+    # единственное место, где состояние отдаётся в «красивом» JSON
+    return Response(content=PrettyJson().dumps(state.export_state()), media_type="application/json")
 
 class ImportBody(BaseModel):
     payload: Dict[str, Any]
+    expected_version: Optional[int] = None  # X-State-Version из GET /state; 409, если состояние успело измениться
 
 @app.post("/import")
-def import_state(body: ImportBody):
-    state.import_state(body.payload)
-    return {"ok": True, "state": state.get()}
+def import_state(body: ImportBody, reply: StateReply = Depends()):
+    try:
+        with state.locked():
+            state.check_version(body.expected_version)
+            state.import_state(body.payload)
+    except StateConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return reply(ok=True)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
@@ -0,0 +1,275 @@
+from __future__ import annotations
+import asyncio, json, os, re, threading
+from collections import OrderedDict
+from typing import Any, Dict, List
+from urllib.parse import quote
+
+from .utils import getenv_int, getenv_str
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def table_key(sid: str, campaign: str) -> str:
+    """Ключ стола для окна контекста и очереди модели."""
+    return f"{campaign}/{sid}"
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Session:
+    """История одного стола — пары (сессия, кампания). `lock` сериализует ходы стола:
+    второй ход ждёт, пока первый допишет ответ в историю. Отпускается lock через unlock():
+    он будит и ходы, ждущие в цикле событий (aacquire).
+
+    Файл — JSONL реплик; когда строк в нём становится вдвое больше `max_messages`, он переписывается
+    с одними хранимыми репликами, а первой строкой `{"offset": N}` — сколько реплик выброшено."""
+
+    def __init__(self, sid: str, campaign: str, path: str, history: List[Dict[str, str]], max_messages: int,
+                 offset: int = 0, lines: int = 0):
+        self.id = sid
+        self.campaign = campaign
+        self.key = table_key(sid, campaign)
+        self.path = path
+        self.history = history
+        self.max_messages = max_messages
+        # сколько первых реплик стола в памяти уже нет: history[0] — реплика номер offset. По этим
+        # номерам ContextWindow привязывает конспект, так что обрезка истории его не сбрасывает
+        self.offset = offset
+        self.lines = lines  # строк в файле
+        self.lock = threading.Lock()
+        self._waiters: List[tuple] = []  # (цикл событий, future) ждущих lock в async-коде
+        self._waiters_lock = threading.Lock()
+        self.users = 0  # сколько запросов держат сессию — такую не вытесняем
+        self.dropped = False  # стол сброшен (drop): сессия больше не выдаётся и в файл не пишет
+
+    def append(self, user: str, narration: str) -> None:
+        """Дописывает ход (под lock): в память и строками JSONL в файл сессии."""
+        if self.dropped:
+            return  # не воскрешаем удалённый файл
+        turns = [{"role": "user", "content": user}, {"role": "assistant", "content": narration}]
+        with open(self.path, "a", encoding="utf-8") as f:
+            for t in turns:
+                f.write(json.dumps(t, ensure_ascii=False) + "\n")
+        self.lines += len(turns)
+        self.history.extend(turns)
+        trim = len(self.history) - self.max_messages
+        if trim > 0:
+            del self.history[:trim]
+            self.offset += trim
+        if self.lines > 2 * self.max_messages:
+            self._compact()
+
+    def _compact(self) -> None:
+        # временный файл и os.replace: падение посреди перезаписи не теряет историю
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"offset": self.offset}) + "\n")
+            for t in self.history:
+                f.write(json.dumps(t, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        self.lines = len(self.history) + 1
+
+    async def aacquire(self) -> None:
+        """lock для async-кода: ждёт в цикле событий, пока unlock() не разбудит, — без потока и без опроса."""
+        loop = asyncio.get_running_loop()
+        while not self.lock.acquire(blocking=False):
+            waiter = loop.create_future()
+            with self._waiters_lock:
+                self._waiters.append((loop, waiter))
+            if self.lock.acquire(blocking=False):
+                return  # отпустили, пока вставали в очередь
+            await waiter
+
+    def unlock(self) -> None:
+        self.lock.release()
+        with self._waiters_lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # цикл событий ждущего уже закрыт
+
+
+class SessionManager:
+    """Серверная история чата: клиент шлёт только новую реплику и id сессии (вкладка UI, запуск CLI).
+
+    В памяти — LRU на `BITD_SESSIONS_MAX` (256) столов; каждый ход сразу дописывается в
+    `BITD_SESSIONS_DIR/<кампания>/<сессия>.jsonl`, так что вытеснение ничего не теряет, а сессия
+    переживает перезапуск. В памяти держатся последние `BITD_SESSION_MESSAGES` (400) реплик —
+    в модель всё равно идёт окно ContextWindow. Ходы одного стола идут по очереди (`open`/`close`),
+    разные столы — параллельно.
+    """
+
+    def __init__(self, path: str | None = None, max_sessions: int | None = None, max_messages: int | None = None):
+        self.dir = path or getenv_str("BITD_SESSIONS_DIR", "data/sessions")
+        self.max_sessions = max_sessions if max_sessions is not None else getenv_int("BITD_SESSIONS_MAX", 256)
+        self.max_messages = max_messages if max_messages is not None else getenv_int("BITD_SESSION_MESSAGES", 400)
+        self._mem: "OrderedDict[tuple[str, str], Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._drops = 0  # счётчик drop(): aopen читает файл без self._lock и так узнаёт, что стол сбросили
+        self.stats = {"loaded": 0, "created": 0, "evicted": 0, "turns": 0}
+
+    def _file(self, sid: str, campaign: str) -> str:
+        return os.path.join(self.dir, quote(campaign, safe=""), sid + ".jsonl")
+
+    def _load(self, sid: str, campaign: str) -> tuple[Session, bool]:
+        """(сессия из файла, был ли файл). Статистику не трогает: aopen зовёт _load без self._lock."""
+        path = self._file(sid, campaign)
+        history: List[Dict[str, str]] = []
+        base = lines = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        lines += 1
+                        rec = json.loads(line)
+                        if "role" in rec:
+                            history.append(rec)
+                        else:
+                            base = int(rec.get("offset", 0))  # заголовок сжатого файла
+                            history.clear()
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return Session(sid, campaign, path, [], self.max_messages), False
+        trim = max(0, len(history) - self.max_messages)
+        return Session(sid, campaign, path, history[trim:], self.max_messages, offset=base + trim, lines=lines), True
+
+    def _take(self, key: tuple[str, str], s: Session, found: bool | None = None) -> Session:
+        # под self._lock; found — сессию только что прочли с диска (True) или создали (False)
+        if found is not None:
+            self._mem[key] = s
+            self.stats["loaded" if found else "created"] += 1
+        self._mem.move_to_end(key)
+        s.users += 1
+        self._evict()
+        return s
+
+    def _checkout(self, sid: str, campaign: str) -> Session:
+        if not _ID_RE.match(sid):
+            raise ValueError("id сессии: 1–64 символа из латиницы, цифр, _ и -")
+        key = (sid, campaign)
+        with self._lock:
+            s = self._mem.get(key)
+            if s is not None:
+                return self._take(key, s)
+            return self._take(key, *self._load(sid, campaign))
+
+    async def _acheckout(self, sid: str, campaign: str) -> Session:
+        """_checkout для async-кода: файл читается в потоке (asyncio.to_thread), без self._lock."""
+        if not _ID_RE.match(sid):
+            raise ValueError("id сессии: 1–64 символа из латиницы, цифр, _ и -")
+        key = (sid, campaign)
+        while True:
+            with self._lock:
+                s = self._mem.get(key)
+                if s is not None:
+                    return self._take(key, s)
+                drops = self._drops
+            # отмена посреди чтения просто выбросит прочитанное: users ещё не увеличен
+            s, found = await asyncio.to_thread(self._load, sid, campaign)
+            with self._lock:
+                if key in self._mem:
+                    return self._take(key, self._mem[key])  # загрузил параллельный запрос
+                if self._drops == drops:
+                    return self._take(key, s, found)
+            # стол сбросили, пока читали файл: прочитанное устарело
+
+    def _evict(self) -> None:
+        over = len(self._mem) - self.max_sessions
+        for k in [k for k, s in self._mem.items() if s.users == 0][:max(0, over)]:
+            del self._mem[k]
+            self.stats["evicted"] += 1
+
+    def open(self, sid: str, campaign: str) -> Session:
+        """Сессия стола с захваченным lock (ждёт текущий ход стола). Обязательно close()."""
+        while True:
+            s = self._checkout(sid, campaign)
+            try:
+                s.lock.acquire()
+            except BaseException:
+                self._release(s)
+                raise
+            if not s.dropped:
+                return s
+            # стол сбросили, пока ждали: следующий _checkout даст новую сессию
+            s.unlock()
+            self._release(s)
+
+    async def aopen(self, sid: str, campaign: str) -> Session:
+        """open() для async-кода: файл стола читается в потоке, а очередь стола ждётся в цикле событий
+        (Session.aacquire) — ожидающий хода стол не отнимает потоки у остальных запросов."""
+        while True:
+            s = await self._acheckout(sid, campaign)
+            try:
+                await s.aacquire()
+            except BaseException:
+                self._release(s)
+                raise
+            if not s.dropped:
+                return s
+            s.unlock()
+            self._release(s)
+
+    def close(self, s: Session, turn: bool = False) -> None:
+        if turn:
+            with self._lock:
+                self.stats["turns"] += 1
+        s.unlock()
+        self._release(s)
+
+    def _release(self, s: Session) -> None:
+        with self._lock:
+            s.users -= 1
+            self._evict()
+
+    def history(self, sid: str, campaign: str) -> List[Dict[str, str]]:
+        s = self.open(sid, campaign)
+        try:
+            return list(s.history)
+        finally:
+            self.close(s)
+
+    def drop(self, sid: str, campaign: str) -> bool:
+        """Забывает сессию стола (память и файл). Идущий ход сначала доигрывается: drop ждёт lock стола,
+        а ждущие следом ходы получат уже новую, пустую сессию."""
+        if not _ID_RE.match(sid):
+            raise ValueError("id сессии: 1–64 символа из латиницы, цифр, _ и -")
+        key = (sid, campaign)
+        with self._lock:
+            s = self._mem.get(key)
+            if s is not None:
+                s.users += 1
+        if s is None:
+            with self._lock:
+                self._drops += 1
+                return self._remove_file(sid, campaign)
+        try:
+            s.lock.acquire()
+            try:
+                # файл удаляется под self._lock: _checkout (и _load) не прочтёт его посередине
+                with self._lock:
+                    self._drops += 1
+                    s.dropped = True
+                    if self._mem.get(key) is s:
+                        del self._mem[key]
+                    return self._remove_file(sid, campaign)
+            finally:
+                s.unlock()
+        finally:
+            self._release(s)
+
+    def _remove_file(self, sid: str, campaign: str) -> bool:
+        try:
+            os.remove(self._file(sid, campaign))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_memory": len(self._mem), "max_sessions": self.max_sessions,
+                    "busy": sum(1 for s in self._mem.values() if s.lock.locked()), **self.stats}
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import os, threading
+from typing import Any, Dict
+
+# Спекулятивное декодирование для llama_cpp: черновик предлагает несколько токенов, основная модель
+# проверяет их одним проходом и принимает совпавший префикс. Вывод не меняется, меняется скорость.
+#   LLAMA_SPECULATIVE=off | lookup | draft
+#     lookup — prompt-lookup decoding (n-граммы из самого промпта; для нарратива, который повторяет
+#              имена, часы и реплики из истории, — бесплатный черновик)
+#     draft  — маленькая GGUF-модель LLAMA_DRAFT_MODEL_PATH с тем же словарём, что у основной
+#   LLAMA_DRAFT_TOKENS — сколько токенов предлагать за раз (10)
+
+_KINDS = ("off", "lookup", "draft")
+
+LLAMA_OK = True
+try:
+    import numpy as np
+    from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+except Exception:
+    LLAMA_OK = False
+    LlamaDraftModel = object  # type: ignore[assignment,misc]
+
+
+class CountingDraft(LlamaDraftModel):
+    """Обёртка над черновиком: считает предложенные и принятые токены.
+
+    Принятые видны на следующем вызове: вход тогда продолжает прошлый вход и начинается
+    с тех токенов черновика, которые основная модель подтвердила. Если вход прошлый не продолжает,
+    это уже другая генерация: её черновик не сверяется, а последнее предложение прошлой генерации
+    (исход которого неизвестен) в счётчики не попадает.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self._last: tuple[list, list] | None = None  # (вход, предложенные токены) прошлого вызова
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "generations": 0, "drafted": 0, "accepted": 0}
+
+    def __call__(self, input_ids, /, **kwargs):
+        ids = input_ids.tolist()
+        with self._lock:
+            last = self._last
+            n = len(last[0]) if last is not None else 0
+            if last is not None and len(ids) > n and ids[:n] == last[0]:
+                accepted = 0
+                for got, proposed in zip(ids[n:], last[1]):
+                    if got != proposed:
+                        break
+                    accepted += 1
+                self.stats["drafted"] += len(last[1])
+                self.stats["accepted"] += accepted
+            else:
+                self.stats["generations"] += 1
+        out = self.inner(input_ids, **kwargs)
+        with self._lock:
+            self.stats["calls"] += 1
+            self._last = (ids, [int(t) for t in out])
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.stats)
+        out["acceptance_rate"] = round(out["accepted"] / out["drafted"], 3) if out["drafted"] else None
+        return out
+
+
+class GGUFDraft(LlamaDraftModel):
+    """Черновик из маленькой GGUF-модели: жадно продолжает вход на k токенов.
+    Общий префикс с прошлым вызовом не пересчитывается (Llama.generate сам его находит)."""
+
+    def __init__(self, path: str, num_pred_tokens: int, n_ctx: int):
+        self.model = Llama(model_path=path, n_ctx=n_ctx, logits_all=False, verbose=False)
+        self.k = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        out = []
+        for tok in self.model.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            out.append(tok)
+            if len(out) >= self.k:
+                break
+        return np.array(out, dtype=np.intc)
+
+
+def make_draft_model(kind: str | None = None, num_pred_tokens: int | None = None, path: str | None = None,
+                     n_ctx: int | None = None):
+    """Черновик по настройкам LLAMA_SPECULATIVE / LLAMA_DRAFT_TOKENS / LLAMA_DRAFT_MODEL_PATH
+    (обёрнутый счётчиком принятых токенов) или None."""
+    kind = (kind or os.getenv("LLAMA_SPECULATIVE", "off")).strip().lower()
+    if kind not in _KINDS:
+        raise ValueError(f"LLAMA_SPECULATIVE: ожидалось одно из {', '.join(_KINDS)}, получено {kind!r}")
+    if kind == "off":
+        return None
+    if num_pred_tokens is None:
+        num_pred_tokens = int(os.getenv("LLAMA_DRAFT_TOKENS", "10"))
+    if not LLAMA_OK:
+        raise RuntimeError("llama-cpp-python не установлен")
+    if kind == "lookup":
+        inner = LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens)
+    else:
+        path = path or os.getenv("LLAMA_DRAFT_MODEL_PATH")
+        if not path or not os.path.exists(path):
+            raise RuntimeError("LLAMA_SPECULATIVE=draft: укажите LLAMA_DRAFT_MODEL_PATH")
+        inner = GGUFDraft(path, num_pred_tokens, n_ctx or int(os.getenv("LLAMA_CTX_SIZE", "4096")))
+    return CountingDraft(inner)
@@ -1,7 +1,11 @@
 
 from __future__ import annotations
-import json, os, re
-from typing import Dict, Any, List
+import functools, os, re, threading, time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List
+
+from . import jsonpatch, serializers
 
 DEFAULT_PATH = os.getenv("BITD_STATE_PATH", "data/state.json")
 
@@ -52,6 +56,91 @@ DEFAULT_CONSEQUENCES = {
     }
 }
 
+class StateConflict(ValueError):
+    """Состояние изменилось после чтения (не совпала ожидаемая версия)."""
+
+
+class _FileLock:
+    """Межпроцессная эксклюзивная блокировка на отдельном файле (fcntl / msvcrt)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = None
+
+    def acquire(self, blocking: bool = True) -> None:
+        fh = open(self.path, "a+b")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                while True:
+                    fh.seek(0)
+                    try:
+                        msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.01)
+            else:
+                import fcntl
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BaseException:
+            fh.close()
+            raise
+        self._fh = fh
+
+    def release(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            fh.close()
+
+
+def _replace(src: str, dst: str) -> None:
+    # на Windows os.replace падает, пока файл открыт читателем — немного подождём
+    for attempt in range(50):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if os.name != "nt" or attempt == 49:
+                raise
+            time.sleep(0.01)
+
+
+def _locked(fn):
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self.locked():
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+def _clone(obj: Any) -> Any:
+    # Быстрее copy.deepcopy: в состоянии только dict/list/скаляры
+    if serializers.ORJSON_OK:
+        try:
+            return serializers.orjson.loads(serializers.orjson.dumps(obj))
+        except TypeError:
+            pass
+    return _clone_tree(obj)
+
+def _clone_tree(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: _clone_tree(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_clone_tree(v) for v in obj]
+    return obj
+
 def default_campaign():
     return {
         "players": {},
@@ -77,27 +166,139 @@ def default_campaign():
     }
 
 class StateStore:
-    def __init__(self, path: str = DEFAULT_PATH):
+    def __init__(self, path: str = DEFAULT_PATH, cache: bool | None = None, fmt: str | None = None):
         self.path = path
+        self.serializer = serializers.get_serializer(fmt)
+        if cache is None:
+            cache = os.getenv("BITD_STATE_CACHE", "1").strip().lower() not in ("0", "false", "no")
+        self.cache = cache
+        self._init_runtime()
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        if not os.path.exists(self.path):
-            root = {"current_campaign": "default", "campaigns": {"default": default_campaign()}}
-            self.save(root)
+        self._flock = _FileLock(self.path + ".lock")
+        with self.locked():
+            if not os.path.exists(self.path):
+                root = {"current_campaign": "default", "campaigns": {"default": default_campaign()}}
+                self.save(root)
+            self.current_version()
+
+    def _init_runtime(self) -> None:
+        """Общее для всех движков: журнал изменений, счётчики кэша, блокировки, вид транзакции."""
+        self.version = 0
+        self._changes: deque = deque(maxlen=int(os.getenv("BITD_STATE_JOURNAL", "256")))
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self._files: Dict[str, tuple] = {}  # path -> ((mtime_ns, inode, size), разобранный JSON или None)
+        self._tx = threading.local()
+        # потоки процесса сериализуются RLock-ом, процессы — блокировкой <path>.lock (_flock)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._changed = threading.Condition(self._lock)  # будит wait_changes после записи
+        self._flock: _FileLock | None = None
+        self._copy_memo: tuple | None = None  # (объект кэша, его байты orjson) — см. _copy
+
+    # ---- locking ----
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Реентерабельная блокировка записи: RLock + файловая блокировка на внешнем уровне."""
+        with self._lock:
+            if self._lock_depth == 0 and self._flock is not None:
+                self._flock.acquire()
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    if self._flock is not None:
+                        self._flock.release()
+                    self._changed.notify_all()
+
+    def current_version(self) -> int:
+        """Версия с учётом внешних правок; без копирования кампании (для ETag и проверок)."""
+        with self._lock:
+            self._load_file(self.path)
+            return self.version
+
+    def check_version(self, expected: int | None) -> None:
+        if expected is None:
+            return
+        if int(expected) != self.current_version():
+            raise StateConflict(f"Состояние изменилось: версия {self.version}, ожидалась {expected}")
+
+    # ---- file cache ----
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _load_file(self, path: str) -> Dict[str, Any]:
+        """В режиме кэша возвращает общий объект: менять его можно только перед _dump_file."""
+        sig = self._signature(path)
+        hit = self._files.get(path)
+        if self.cache and hit is not None and hit[0] == sig:
+            self.cache_stats["hits"] += 1
+            return hit[1]
+        self.cache_stats["misses"] += 1
+        with open(path, "rb") as f:
+            data = serializers.loads(f.read())  # формат определяется автоматически
+        self._files[path] = (sig, data if self.cache else None)
+        if hit is None or hit[0] != sig:
+            mtime = sig[0] // 1000
+            if mtime > self.version:
+                self.version = mtime
+            elif hit is not None:
+                self.version += 1  # файл поменяли снаружи, но mtime старый (скопирован с сохранением времени)
+        return data
+
+    def _dump_file(self, path: str, data: Dict[str, Any]) -> None:
+        # пишем во временный файл и атомарно подменяем: падение посреди записи не портит состояние
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            prev = max(self.version, os.stat(path).st_mtime_ns // 1000)
+        except FileNotFoundError:
+            prev = self.version
+        try:
+            with open(tmp, "wb") as f:
+                f.write(self.serializer.dumps(data))
+                f.flush()
+                os.fsync(f.fileno())
+            _replace(tmp, path)
+        except Exception:
+            self._files.pop(path, None)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.version = self._stamp(path, prev)
+        self._files[path] = (self._signature(path), data if self.cache else None)
+
+    @staticmethod
+    def _stamp(path: str, prev: int) -> int:
+        """Версия — mtime записанного файла в микросекундах: у всех процессов, которые читают файл,
+        она одна и та же. Если часы не ушли дальше prev (та же тиковая метка ФС), mtime сдвигается вручную."""
+        version = os.stat(path).st_mtime_ns // 1000
+        if version <= prev:
+            version = prev + 1
+            os.utime(path, ns=(version * 1000, version * 1000))
+        return version
+
+    def cache_info(self) -> Dict[str, Any]:
+        return {"enabled": self.cache, "version": self.version, "format": self.serializer.name, **self.cache_stats}
 
     # ---- core io ----
     def load_root(self) -> Dict[str, Any]:
-        with open(self.path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        root = self._load_file(self.path)
+        return _clone(root) if self.cache else root
 
     def save(self, root: Dict[str, Any]) -> None:
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(root, f, ensure_ascii=False, indent=2)
+        self._dump_file(self.path, root)
 
     def _get_cur(self, root: Dict[str, Any]) -> Dict[str, Any]:
         cur = root.get("current_campaign", "default")
         return root.setdefault("campaigns", {}).setdefault(cur, default_campaign())
 
     # ---- campaigns ----
+    @_locked
     def create_campaign(self, name: str) -> None:
         root = self.load_root()
         root.setdefault("campaigns", {})
@@ -105,6 +306,7 @@ class StateStore:
         root["current_campaign"] = name
         self.save(root)
 
+    @_locked
     def switch_campaign(self, name: str) -> None:
         root = self.load_root()
         if name not in root.get("campaigns", {}):
@@ -113,113 +315,228 @@ class StateStore:
         self.save(root)
 
     def list_campaigns(self) -> List[str]:
-        root = self.load_root()
+        root = self._load_file(self.path)
         return list(root.get("campaigns", {}).keys())
 
     # ---- current get/save ----
+    def _read_current(self) -> tuple[str, Dict[str, Any]]:
+        # клонируем только текущую кампанию, а не весь архив
+        root = self._load_file(self.path)
+        name = root.get("current_campaign", "default")
+        cur = root.get("campaigns", {}).get(name)
+        return name, (self._copy(cur) if cur is not None else default_campaign())
+
+    def _copy(self, obj: Dict[str, Any]) -> Dict[str, Any]:
+        """Копия кампании из кэша для get(). Объекты кэша не меняются на месте (запись кладёт новый
+        dict), поэтому байты orjson последнего объекта запоминаются: повторный get() — один разбор."""
+        if not self.cache:
+            return obj  # без кэша объект и так свежий
+        if not serializers.ORJSON_OK:
+            return _clone_tree(obj)
+        memo = self._copy_memo
+        if memo is None or memo[0] is not obj:
+            try:
+                memo = self._copy_memo = (obj, serializers.orjson.dumps(obj))
+            except TypeError:
+                return _clone_tree(obj)
+        return serializers.orjson.loads(memo[1])
+
+    def _write_current(self, name: str, cur: Dict[str, Any]) -> None:
+        root = self._load_file(self.path)
+        root.setdefault("campaigns", {})[name] = cur
+        self.save(root)
+
+    def current_campaign(self) -> str:
+        return self._load_file(self.path).get("current_campaign", "default")
+
     def get(self) -> Dict[str, Any]:
-        root = self.load_root()
-        cur_name = root.get("current_campaign", "default")
-        cur = self._get_cur(root)
+        tx = self._tx_view()
+        if tx is not None:
+            return tx
+        cur_name, cur = self._read_current()
         return {"current_campaign": cur_name, **cur}
 
-    def save_current(self, cur: Dict[str, Any]) -> None:
-        root = self.load_root()
-        root["campaigns"][root.get("current_campaign","default")] = cur
-        self.save(root)
+    def snapshot(self) -> tuple[int, Dict[str, Any]]:
+        """(версия, get()) — запись из этого процесса между ними не вклинится, а чужая
+        может лишь сделать данные новее версии (тогда клиент просто перечитает их)."""
+        with self._lock:
+            version = self.current_version()
+            return version, self.get()
+
+    # ---- change journal ----
+    def _committed(self, name: str) -> Dict[str, Any] | None:
+        """Кампания в памяти хранилища (без копии), если есть; нужна как «до» для журнала."""
+        hit = self._files.get(self.path)
+        if hit is None or hit[1] is None:
+            return None
+        return hit[1].get("campaigns", {}).get(name)
+
+    def _journal(self, before: int, ops: List[Dict[str, Any]] | None) -> None:
+        self._changes.append((before, self.version, ops))
+
+    def _commit_current(self, name: str, cur: Dict[str, Any], old: Dict[str, Any] | None) -> None:
+        before = self.version
+        self._write_current(name, cur)
+        self._journal(before, jsonpatch.diff(old, cur) if old is not None else None)
+
+    def changes_since(self, version: int) -> tuple[int, List[Dict[str, Any]] | None]:
+        """(текущая версия, JSON Patch текущей кампании от version до неё).
+
+        Вместо патча None, если цепочка прервана: запись без журнала (смена кампании,
+        импорт, внешняя правка файла) или version старше журнала — тогда нужен полный снимок.
+        """
+        with self._lock:
+            cur_version = self.version
+            at, ops = int(version), []
+            for before, after, change in self._changes:
+                if after <= at:
+                    continue
+                if before != at or change is None:
+                    return cur_version, None
+                ops.extend(change)
+                at = after
+            return cur_version, (ops if at == cur_version else None)
+
+    def wait_changes(self, version: int, timeout: float | None = None) -> tuple[int, List[Dict[str, Any]] | None]:
+        """Ждёт записи после version (не дольше timeout) и возвращает changes_since(version).
+
+        Запись из этого процесса будит сразу; правки других процессов видны по истечении timeout.
+        Если ничего не изменилось — (version, []).
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+        self.current_version()
+        return self.changes_since(version)
+
+    def save_current(self, cur: Dict[str, Any], expected_version: int | None = None) -> None:
+        tx = self._tx_view()
+        if tx is not None:
+            if cur is not tx:
+                name = tx["current_campaign"]
+                tx.clear()
+                tx.update(cur)
+                tx["current_campaign"] = name
+            return
+        with self.locked():
+            self.check_version(expected_version)
+            cur_name = cur.get("current_campaign") or self._read_current()[0]
+            self._commit_current(cur_name, {k: v for k, v in cur.items() if k != "current_campaign"}, self._committed(cur_name))
+
+    # ---- transactions ----
+    def _tx_view(self) -> Dict[str, Any] | None:
+        return getattr(self._tx, "view", None)
+
+    @contextmanager
+    def transaction(self, expected_version: int | None = None) -> Iterator[Dict[str, Any]]:
+        """Одно чтение и одна запись на любое число мутаций текущей кампании.
+
+        Внутри `with state.transaction() as cur:` get() отдаёт тот же dict, а мутаторы
+        не пишут на диск; вложенные транзакции присоединяются к внешней. Запись — при
+        выходе без исключения. Всё время транзакции держится блокировка записи;
+        expected_version даёт оптимистичную проверку (StateConflict при расхождении).
+        """
+        view = self._tx_view()
+        if view is not None:
+            yield view
+            return
+        with self.locked():
+            self.check_version(expected_version)
+            name, cur = self._read_current()
+            old = self._committed(name)
+            if old is None:
+                old = _clone(cur)  # без кэша «до» для журнала берём копией
+            view = {"current_campaign": name, **cur}
+            self._tx.view = view
+            try:
+                yield view
+            finally:
+                self._tx.view = None
+            self._commit_current(name, {k: v for k, v in view.items() if k != "current_campaign"}, old)
 
     # ---------- clocks ----------
     def upsert_clock(self, name: str, segments: int) -> None:
-        cur = self.get()
-        for c in cur["clocks"]:
-            if c["name"] == name:
-                c["segments"] = segments
-                self.save_current(cur); return
-        cur["clocks"].append({"name": name, "segments": segments, "filled": 0})
-        self.save_current(cur)
+        with self.transaction() as cur:
+            for c in cur["clocks"]:
+                if c["name"] == name:
+                    c["segments"] = segments
+                    return
+            cur["clocks"].append({"name": name, "segments": segments, "filled": 0})
 
     def fill_clock(self, name: str, n: int) -> None:
-        cur = self.get()
-        for c in cur["clocks"]:
-            if c["name"] == name:
-                c["filled"] = min(c["segments"], c["filled"] + n)
-                self.save_current(cur); return
-        raise ValueError(f"Clock '{name}' not found")
+        with self.transaction() as cur:
+            for c in cur["clocks"]:
+                if c["name"] == name:
+                    c["filled"] = min(c["segments"], c["filled"] + n)
+                    return
+            raise ValueError(f"Clock '{name}' not found")
 
     # ---------- meta ----------
     def set_meta(self, **kwargs):
-        cur = self.get()
-        for k in ["heat", "wanted", "rep", "coin"]:
-            if k in kwargs and kwargs[k] is not None:
-                cur[k] = int(kwargs[k])
-        self.save_current(cur)
+        with self.transaction() as cur:
+            for k in ["heat", "wanted", "rep", "coin"]:
+                if k in kwargs and kwargs[k] is not None:
+                    cur[k] = int(kwargs[k])
 
     def add_rep(self, n: int):
-        cur = self.get()
-        cur["rep"] = int(cur.get("rep",0)) + int(n)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            cur["rep"] = int(cur.get("rep",0)) + int(n)
 
     def add_heat(self, n: int):
-        cur = self.get()
-        cur["heat"] = int(cur.get("heat",0)) + int(n)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            cur["heat"] = int(cur.get("heat",0)) + int(n)
 
     # ---------- players ----------
-    def upsert_player(self, name: str):
-        cur = self.get()
-        cur.setdefault("players", {})
-        if name not in cur["players"]:
-            cur["players"][name] = {
+    @staticmethod
+    def _player(cur: Dict[str, Any], name: str) -> Dict[str, Any]:
+        players = cur.setdefault("players", {})
+        if name not in players:
+            players[name] = {
                 "harms": [],
                 "actions": {a: 0 for a in DEFAULT_ACTIONS},
                 "stress": 0, "trauma": [], "pending_trauma": 0, "xp": 0, "advances": 0
             }
-            self.save_current(cur)
+        return players[name]
+
+    def upsert_player(self, name: str):
+        if name in self.get().get("players", {}):
+            return
+        with self.transaction() as cur:
+            self._player(cur, name)
 
     def set_action(self, name: str, action: str, rating: int):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        cur["players"][name]["actions"][action] = int(rating)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            self._player(cur, name)["actions"][action] = int(rating)
 
     def get_action(self, name: str, action: str) -> int:
         cur = self.get()
         return int(cur.get("players", {}).get(name, {}).get("actions", {}).get(action, 0))
 
     def set_stress(self, name: str, stress: int):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        stress = int(stress)
-        if stress > 9:
-            cur["players"][name]["pending_trauma"] = int(cur["players"][name].get("pending_trauma",0)) + 1
-            stress = 0
-        cur["players"][name]["stress"] = max(0, min(9, stress))
-        self.save_current(cur)
+        with self.transaction() as cur:
+            p = self._player(cur, name)
+            stress = int(stress)
+            if stress > 9:
+                p["pending_trauma"] = int(p.get("pending_trauma",0)) + 1
+                stress = 0
+            p["stress"] = max(0, min(9, stress))
 
     def add_trauma(self, name: str, label: str):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        tr = cur["players"][name].setdefault("trauma", [])
-        if label and label not in tr:
-            tr.append(label)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            tr = self._player(cur, name).setdefault("trauma", [])
+            if label and label not in tr:
+                tr.append(label)
 
     def consume_pending_trauma(self, name: str, label: str):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        pt = int(cur["players"][name].get("pending_trauma", 0))
-        if pt <= 0:
-            return
-        cur["players"][name]["pending_trauma"] = pt - 1
-        if label:
-            tr = cur["players"][name].setdefault("trauma", [])
-            if label not in tr:
-                tr.append(label)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            p = self._player(cur, name)
+            pt = int(p.get("pending_trauma", 0))
+            if pt <= 0:
+                return
+            p["pending_trauma"] = pt - 1
+            if label:
+                tr = p.setdefault("trauma", [])
+                if label not in tr:
+                    tr.append(label)
 
     def _advance_rollover(self, cur: Dict[str, Any], who: str, is_crew: bool = False):
         if is_crew:
@@ -240,80 +557,68 @@ class StateStore:
                 cur["players"][who]["xp"] = xp % th
 
     def add_player_xp(self, name: str, n: int):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        cur["players"][name]["xp"] = int(cur["players"][name].get("xp",0)) + int(n)
-        self._advance_rollover(cur, name, is_crew=False)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            p = self._player(cur, name)
+            p["xp"] = int(p.get("xp",0)) + int(n)
+            self._advance_rollover(cur, name, is_crew=False)
 
     def add_crew_xp(self, n: int):
-        cur = self.get()
-        cur["crew"]["xp"] = int(cur["crew"].get("xp",0)) + int(n)
-        self._advance_rollover(cur, who="", is_crew=True)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            cur["crew"]["xp"] = int(cur["crew"].get("xp",0)) + int(n)
+            self._advance_rollover(cur, who="", is_crew=True)
 
     # ---------- crew ----------
     def set_crew(self, name: str | None=None, playbook: str | None=None, tier: int | None=None, hold: str | None=None, upgrades: dict | None=None):
-        cur = self.get()
-        if name is not None: cur["crew"]["name"] = name
-        if playbook is not None: cur["crew"]["playbook"] = playbook
-        if tier is not None: cur["crew"]["tier"] = int(tier)
-        if hold is not None: cur["crew"]["hold"] = hold
-        if upgrades is not None: cur["crew"]["upgrades"] = upgrades
-        self.save_current(cur)
+        with self.transaction() as cur:
+            if name is not None: cur["crew"]["name"] = name
+            if playbook is not None: cur["crew"]["playbook"] = playbook
+            if tier is not None: cur["crew"]["tier"] = int(tier)
+            if hold is not None: cur["crew"]["hold"] = hold
+            if upgrades is not None: cur["crew"]["upgrades"] = upgrades
 
     # ---------- factions ----------
+    @staticmethod
+    def _faction(cur: Dict[str, Any], name: str) -> Dict[str, Any]:
+        return cur.setdefault("factions", {}).setdefault(name, {"status": 0, "clocks": []})
+
     def faction_upsert(self, name: str):
-        cur = self.get()
-        facs = cur.setdefault("factions", {})
-        facs.setdefault(name, {"status": 0, "clocks": []})
-        self.save_current(cur)
+        with self.transaction() as cur:
+            self._faction(cur, name)
 
     def faction_set_status(self, name: str, status: int):
-        cur = self.get()
-        self.faction_upsert(name)
-        cur = self.get()
-        cur["factions"][name]["status"] = int(status)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            self._faction(cur, name)["status"] = int(status)
 
     def faction_clock_create(self, name: str, clock: str, segments: int):
-        cur = self.get()
-        self.faction_upsert(name)
-        cur = self.get()
-        clocks = cur["factions"][name].setdefault("clocks", [])
-        for c in clocks:
-            if c["name"] == clock:
-                c["segments"] = int(segments)
-                self.save_current(cur); return
-        clocks.append({"name": clock, "segments": int(segments), "filled": 0})
-        self.save_current(cur)
+        with self.transaction() as cur:
+            clocks = self._faction(cur, name).setdefault("clocks", [])
+            for c in clocks:
+                if c["name"] == clock:
+                    c["segments"] = int(segments)
+                    return
+            clocks.append({"name": clock, "segments": int(segments), "filled": 0})
 
     def faction_clock_fill(self, name: str, clock: str, n: int):
-        cur = self.get()
-        self.faction_upsert(name)
-        cur = self.get()
-        for c in cur["factions"][name].setdefault("clocks", []):
-            if c["name"] == clock:
-                c["filled"] = min(c["segments"], c["filled"] + int(n))
-                self.save_current(cur); return
-        raise ValueError("Clock not found")
+        with self.transaction() as cur:
+            for c in self._faction(cur, name).setdefault("clocks", []):
+                if c["name"] == clock:
+                    c["filled"] = min(c["segments"], c["filled"] + int(n))
+                    return
+            raise ValueError("Clock not found")
 
     # ---------- rules & suggestions ----------
     def use_trigger_preset(self, name: str):
-        cur = self.get()
         if name not in TRIG_PRESETS:
             raise ValueError("Неизвестный пресет")
-        cur["config"]["rules"]["triggers"] = TRIG_PRESETS[name]
-        self.save_current(cur)
+        with self.transaction() as cur:
+            cur["config"]["rules"]["triggers"] = TRIG_PRESETS[name]
 
     def set_thresholds(self, player: int | None=None, crew: int | None=None):
-        cur = self.get()
-        if player is not None:
-            cur["config"]["house_rules"]["advance_threshold_player"] = int(player)
-        if crew is not None:
-            cur["config"]["house_rules"]["advance_threshold_crew"] = int(crew)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            if player is not None:
+                cur["config"]["house_rules"]["advance_threshold_player"] = int(player)
+            if crew is not None:
+                cur["config"]["house_rules"]["advance_threshold_crew"] = int(crew)
 
     def consequence_suggest(self, position: str, quality: str):
         cur = self.get()
@@ -324,14 +629,14 @@ class StateStore:
 
     # ---------- last roll ----------
     def set_last_roll(self, payload: Dict[str, Any] | None):
-        cur = self.get()
-        cur["last_roll"] = payload
-        self.save_current(cur)
+        with self.transaction() as cur:
+            cur["last_roll"] = payload
 
     # ---------- import/export ----------
     def export_state(self) -> Dict[str, Any]:
         return self.get()
 
+    @_locked
     def import_state(self, payload: Dict[str, Any]):
         if not isinstance(payload, dict):
             raise ValueError("Неверный формат")
@@ -345,21 +650,15 @@ class StateStore:
 
     # ---------- harms ----------
     def add_harm(self, name: str, level: int, label: str, kind: str | None=None):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        h = cur["players"][name].setdefault("harms", [])
-        h.append({"level": int(level), "label": label, "kind": (kind or "generic")})
-        self.save_current(cur)
+        with self.transaction() as cur:
+            h = self._player(cur, name).setdefault("harms", [])
+            h.append({"level": int(level), "label": label, "kind": (kind or "generic")})
 
     def clear_harm(self, name: str, idx: int):
-        cur = self.get()
-        self.upsert_player(name)
-        cur = self.get()
-        harms = cur["players"][name].setdefault("harms", [])
-        if 0 <= int(idx) < len(harms):
-            harms.pop(int(idx))
-        self.save_current(cur)
+        with self.transaction() as cur:
+            harms = self._player(cur, name).setdefault("harms", [])
+            if 0 <= int(idx) < len(harms):
+                harms.pop(int(idx))
 
 
     def harm_penalty(self, name: str) -> int:
@@ -379,13 +678,12 @@ class StateStore:
             return 0
 
     def add_last_roll_suggestion(self, line: str):
-        cur = self.get()
-        if not cur.get("last_roll"):
+        if not self.get().get("last_roll"):
             return
-        cons = cur["last_roll"].setdefault("consequences", [])
-        if line and line not in cons:
-            cons.append(line)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            cons = cur["last_roll"].setdefault("consequences", [])
+            if line and line not in cons:
+                cons.append(line)
 
 
     def list_harms(self, name: str):
@@ -393,22 +691,38 @@ class StateStore:
         return cur.get("players", {}).get(name, {}).get("harms", [])
 
     def save_scene_consequence_preset(self, name: str):
-        cur = self.get()
-        lr = cur.get("last_roll") or {}
-        lines = lr.get("consequences", [])
-        pres = cur["config"]["rules"].setdefault("consequence_presets", {})
-        pres[name] = list(lines)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            lr = cur.get("last_roll") or {}
+            lines = lr.get("consequences", [])
+            pres = cur["config"]["rules"].setdefault("consequence_presets", {})
+            pres[name] = list(lines)
 
     def apply_scene_consequence_preset(self, name: str):
-        cur = self.get()
-        pres = cur.get("config", {}).get("rules", {}).get("consequence_presets", {})
-        lines = pres.get(name, [])
-        if not cur.get("last_roll"):
-            cur["last_roll"] = {"kind":"system"}
-        cur["last_roll"]["consequences"] = list(lines)
-        self.save_current(cur)
+        with self.transaction() as cur:
+            pres = cur.get("config", {}).get("rules", {}).get("consequence_presets", {})
+            lines = pres.get(name, [])
+            if not cur.get("last_roll"):
+                cur["last_roll"] = {"kind":"system"}
+            cur["last_roll"]["consequences"] = list(lines)
 
     def list_scene_consequence_presets(self):
         cur = self.get()
         return list(cur.get("config", {}).get("rules", {}).get("consequence_presets", {}).keys())
+
+
+def open_store(path: str | None = None) -> StateStore:
+    """Хранилище по BITD_STATE_BACKEND: json (по умолчанию), wal, sharded или sqlite."""
+    path = path or os.getenv("BITD_STATE_PATH", "data/state.json")
+    backend = (os.getenv("BITD_STATE_BACKEND") or "json").strip().lower()
+    if backend == "json":
+        return StateStore(path)
+    if backend == "wal":
+        from .state_wal import LoggedStateStore
+        return LoggedStateStore(path)
+    if backend == "sharded":
+        from .state_sharded import ShardedStateStore
+        return ShardedStateStore(path)
+    if backend == "sqlite":
+        from .state_sqlite import SqliteStateStore
+        return SqliteStateStore(path)
+    raise ValueError(f"Неизвестный BITD_STATE_BACKEND: {backend}")
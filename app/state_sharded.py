@@ -0,0 +1,115 @@
+from __future__ import annotations
+import os
+from typing import Dict, Any, List
+from urllib.parse import quote
+
+from .state import StateStore, default_campaign, _clone, _locked
+
+
+class ShardedStateStore(StateStore):
+    """Одна кампания — один файл.
+
+    Раскладка для `BITD_STATE_PATH=data/state.json`:
+        data/state.d/index.json            {"current_campaign": ..., "campaigns": [...]}
+        data/state.d/campaigns/<имя>.json  данные кампании
+
+    Чтение и запись текущей кампании трогают только индекс и её шард, так что
+    стоимость ввода-вывода не зависит от размера архива.
+    """
+
+    def __init__(self, path: str, cache: bool | None = None):
+        base = path[:-len(".json")] if path.endswith(".json") else path
+        self.dir = base + ".d"
+        os.makedirs(os.path.join(self.dir, "campaigns"), exist_ok=True)
+        super().__init__(os.path.join(self.dir, "index.json"), cache=cache)
+
+    def _shard(self, name: str) -> str:
+        return os.path.join(self.dir, "campaigns", quote(name, safe="") + ".json")
+
+    def _index(self) -> Dict[str, Any]:
+        return self._load_file(self.path)
+
+    def _write_index(self, current: str, names: List[str]) -> None:
+        self._dump_file(self.path, {"current_campaign": current, "campaigns": list(names)})
+
+    def _load_campaign(self, name: str) -> Dict[str, Any] | None:
+        shard = self._shard(name)
+        if not os.path.exists(shard):
+            return None
+        return self._load_file(shard)
+
+    def _committed(self, name: str) -> Dict[str, Any] | None:
+        hit = self._files.get(self._shard(name))
+        return hit[1] if hit is not None else None
+
+    def current_version(self) -> int:
+        with self._lock:
+            self._load_campaign(self._index().get("current_campaign", "default"))
+            return self.version
+
+    # ---- core io ----
+    def load_root(self) -> Dict[str, Any]:
+        idx = self._index()
+        campaigns = {}
+        for name in idx.get("campaigns", []):
+            data = self._load_campaign(name)
+            campaigns[name] = _clone(data) if data is not None else default_campaign()
+        return {"current_campaign": idx.get("current_campaign", "default"), "campaigns": campaigns}
+
+    def save(self, root: Dict[str, Any]) -> None:
+        campaigns = root.get("campaigns", {})
+        old = set(self._index().get("campaigns", [])) if os.path.exists(self.path) else set()
+        for name, data in campaigns.items():
+            self._dump_file(self._shard(name), data)
+        for name in old - set(campaigns):
+            try:
+                os.remove(self._shard(name))
+            except FileNotFoundError:
+                pass
+            self._files.pop(self._shard(name), None)
+        self._write_index(root.get("current_campaign", "default"), list(campaigns))
+
+    # ---- campaigns ----
+    @_locked
+    def create_campaign(self, name: str) -> None:
+        idx = self._index()
+        names = list(idx.get("campaigns", []))
+        self._dump_file(self._shard(name), default_campaign())
+        if name not in names:
+            names.append(name)
+        self._write_index(name, names)
+
+    @_locked
+    def switch_campaign(self, name: str) -> None:
+        idx = self._index()
+        if name not in idx.get("campaigns", []):
+            raise ValueError("Кампания не найдена")
+        self._write_index(name, idx["campaigns"])
+
+    def list_campaigns(self) -> List[str]:
+        return list(self._index().get("campaigns", []))
+
+    # ---- current get/save ----
+    def _read_current(self) -> tuple[str, Dict[str, Any]]:
+        name = self._index().get("current_campaign", "default")
+        data = self._load_campaign(name)
+        return name, (self._copy(data) if data is not None else default_campaign())
+
+    def _write_current(self, name: str, cur: Dict[str, Any]) -> None:
+        self._dump_file(self._shard(name), cur)
+        idx = self._index()
+        names = idx.get("campaigns", [])
+        if name not in names:
+            self._write_index(idx.get("current_campaign", name), list(names) + [name])
+
+    # ---------- import/export ----------
+    @_locked
+    def import_state(self, payload: Dict[str, Any]):
+        if not isinstance(payload, dict):
+            raise ValueError("Неверный формат")
+        cur_name = payload.get("current_campaign", "imported")
+        self._dump_file(self._shard(cur_name), {k:v for k,v in payload.items() if k != "current_campaign"})
+        names = self.list_campaigns()
+        if cur_name not in names:
+            names.append(cur_name)
+        self._write_index(cur_name, names)
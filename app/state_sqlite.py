@@ -0,0 +1,406 @@
+from __future__ import annotations
+import os, sqlite3
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List
+
+from . import jsonpatch, serializers
+from .state import StateStore, default_campaign, DEFAULT_ACTIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS campaigns (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS players (
+    campaign TEXT NOT NULL, name TEXT NOT NULL, pos INTEGER NOT NULL,
+    stress INTEGER, pending_trauma INTEGER, xp INTEGER, advances INTEGER,
+    actions TEXT, trauma TEXT, extra TEXT,
+    PRIMARY KEY (campaign, name)
+);
+CREATE TABLE IF NOT EXISTS harms (
+    id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, player TEXT NOT NULL, pos INTEGER NOT NULL,
+    level INTEGER, label TEXT, kind TEXT
+);
+CREATE INDEX IF NOT EXISTS harms_player ON harms (campaign, player, pos);
+CREATE TABLE IF NOT EXISTS clocks (
+    id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, pos INTEGER NOT NULL,
+    name TEXT, segments INTEGER, filled INTEGER
+);
+CREATE INDEX IF NOT EXISTS clocks_name ON clocks (campaign, name);
+CREATE TABLE IF NOT EXISTS factions (
+    campaign TEXT NOT NULL, name TEXT NOT NULL, pos INTEGER NOT NULL, status INTEGER, extra TEXT,
+    PRIMARY KEY (campaign, name)
+);
+CREATE TABLE IF NOT EXISTS faction_clocks (
+    id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, faction TEXT NOT NULL, pos INTEGER NOT NULL,
+    name TEXT, segments INTEGER, filled INTEGER
+);
+CREATE INDEX IF NOT EXISTS faction_clocks_name ON faction_clocks (campaign, faction, name);
+"""
+
+# поля, разложенные по таблицам; всё остальное лежит JSON-ом в campaigns.data / extra
+_ENTITY_KEYS = ("players", "clocks", "factions")
+_PLAYER_COLS = ("stress", "pending_trauma", "xp", "advances")
+_PLAYER_JSON = ("actions", "trauma")
+_FIRST_CLOCK = "campaign=? AND name=? AND pos=(SELECT MIN(pos) FROM clocks WHERE campaign=? AND name=?)"
+
+
+def _dumps(x: Any) -> str:
+    return serializers.json_dumps(x).decode("utf-8")
+
+
+class SqliteStateStore(StateStore):
+    """SQLite (WAL) с отдельными таблицами для игроков, ран, часов и фракций.
+
+    Частые мутации (часы, раны, стресс, статус фракции) — однострочные UPDATE/INSERT
+    вместо перезаписи документа. Внутри `transaction()` работает общая логика на dict,
+    и кампания записывается целиком при коммите.
+    """
+
+    def __init__(self, path: str):
+        self.path = path[:-len(".json")] + ".sqlite3" if path.endswith(".json") else path
+        self.cache = False
+        self._init_runtime()  # _flock не нужен: межпроцессную изоляцию даёт BEGIN IMMEDIATE
+        self._write_depth = 0
+        self._pending_ops: List[Any] = []
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # BEGIN IMMEDIATE ждёт чужую запись до BITD_SQLITE_TIMEOUT секунд
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                   timeout=float(os.getenv("BITD_SQLITE_TIMEOUT", "60")))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        if self._db.execute("SELECT COUNT(*) FROM campaigns").fetchone()[0] == 0:
+            self.save({"current_campaign": "default", "campaigns": {"default": default_campaign()}})
+        self.version = int(self._meta("version") or 0)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # ---- helpers ----
+    def _meta(self, key: str) -> str | None:
+        row = self._db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._db.execute("INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Одна SQL-транзакция записи; вложенные вызовы присоединяются к внешней.
+        Увеличивает версию состояния."""
+        with self._lock:
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield self._db
+                finally:
+                    self._write_depth -= 1
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            start = int(self._meta("version") or 0)
+            self._write_depth = 1
+            self._pending_ops = []
+            try:
+                yield self._db
+                version = start + 1
+                self._set_meta("version", str(version))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            finally:
+                self._write_depth = 0
+            self.version = version
+            # запись без патча (смена кампании, импорт, save) рвёт цепочку журнала
+            pending = self._pending_ops
+            ops = None if not pending or any(o is None for o in pending) else [op for o in pending for op in o]
+            self._changes.append((start, version, ops))
+            self._changed.notify_all()
+
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        """Несколько SELECT-ов одним снимком: без транзакции чужой COMMIT может попасть между ними."""
+        with self._lock:
+            if self._db.in_transaction:
+                yield self._db  # уже внутри _write или внешнего _read
+                return
+            self._db.execute("BEGIN")
+            try:
+                yield self._db
+            finally:
+                self._db.execute("COMMIT")
+
+    def _journal(self, before: int, ops: List[Dict[str, Any]] | None) -> None:
+        # вызывается внутри _write: в журнал патч попадёт при COMMIT вместе с новой версией
+        self._pending_ops.append(ops)
+
+    def _committed(self, name: str) -> Dict[str, Any] | None:
+        return None
+
+    def _commit_current(self, name: str, cur: Dict[str, Any], old: Dict[str, Any] | None) -> None:
+        with self._write():
+            super()._commit_current(name, cur, old)
+
+    def _track(self, path: str, before: Any, after: Any) -> None:
+        if before is None:
+            self._journal(0, [{"op": "add", "path": path, "value": after}])
+        else:
+            self._journal(0, jsonpatch.diff(before, after, path))
+
+    @contextmanager
+    def transaction(self, expected_version: int | None = None) -> Iterator[Dict[str, Any]]:
+        # чтение и запись кампании — внутри одной BEGIN IMMEDIATE, чтобы другой процесс не вклинился
+        if self._tx_view() is not None:
+            with super().transaction() as cur:
+                yield cur
+            return
+        with self._write():
+            with super().transaction(expected_version) as cur:
+                yield cur
+
+    def current_version(self) -> int:
+        with self._lock:
+            self.version = int(self._meta("version") or 0)  # другой процесс мог записать
+            return self.version
+
+    def _current_name(self) -> str:
+        return self._meta("current_campaign") or "default"
+
+    def current_campaign(self) -> str:
+        with self._lock:
+            return self._current_name()
+
+    def _assemble(self, db, name: str) -> Dict[str, Any] | None:
+        row = db.execute("SELECT data FROM campaigns WHERE name=?", (name,)).fetchone()
+        if row is None:
+            return None
+        self.cache_stats["misses"] += 1
+        cur = serializers.json_loads(row[0])
+        players: Dict[str, Any] = {}
+        for pname, stress, pt, xp, adv, actions, trauma, extra in db.execute(
+                "SELECT name, stress, pending_trauma, xp, advances, actions, trauma, extra FROM players WHERE campaign=? ORDER BY pos", (name,)):
+            players[pname] = {
+                "harms": [],
+                "actions": serializers.json_loads(actions) if actions else {},
+                "stress": stress, "trauma": serializers.json_loads(trauma) if trauma else [],
+                "pending_trauma": pt, "xp": xp, "advances": adv,
+                **(serializers.json_loads(extra) if extra else {}),
+            }
+        for player, level, label, kind in db.execute(
+                "SELECT player, level, label, kind FROM harms WHERE campaign=? ORDER BY player, pos", (name,)):
+            if player in players:
+                players[player]["harms"].append({"level": level, "label": label, "kind": kind})
+        cur["players"] = players
+        cur["clocks"] = [{"name": n, "segments": s, "filled": f} for n, s, f in db.execute(
+            "SELECT name, segments, filled FROM clocks WHERE campaign=? ORDER BY pos", (name,))]
+        factions: Dict[str, Any] = {}
+        for fname, status, extra in db.execute(
+                "SELECT name, status, extra FROM factions WHERE campaign=? ORDER BY pos", (name,)):
+            factions[fname] = {"status": status, "clocks": [], **(serializers.json_loads(extra) if extra else {})}
+        for faction, n, s, f in db.execute(
+                "SELECT faction, name, segments, filled FROM faction_clocks WHERE campaign=? ORDER BY faction, pos", (name,)):
+            if faction in factions:
+                factions[faction]["clocks"].append({"name": n, "segments": s, "filled": f})
+        cur["factions"] = factions
+        return cur
+
+    def _clocks(self, db, campaign: str) -> List[Dict[str, Any]]:
+        return [{"name": n, "segments": s, "filled": f} for n, s, f in db.execute(
+            "SELECT name, segments, filled FROM clocks WHERE campaign=? ORDER BY pos", (campaign,))]
+
+    def _player_tree(self, db, campaign: str, name: str) -> Dict[str, Any] | None:
+        row = db.execute("SELECT stress, pending_trauma, xp, advances, actions, trauma, extra FROM players WHERE campaign=? AND name=?",
+                         (campaign, name)).fetchone()
+        if row is None:
+            return None
+        stress, pt, xp, adv, actions, trauma, extra = row
+        harms = [{"level": l, "label": lb, "kind": k} for l, lb, k in db.execute(
+            "SELECT level, label, kind FROM harms WHERE campaign=? AND player=? ORDER BY pos", (campaign, name))]
+        return {
+            "harms": harms,
+            "actions": serializers.json_loads(actions) if actions else {},
+            "stress": stress, "trauma": serializers.json_loads(trauma) if trauma else [],
+            "pending_trauma": pt, "xp": xp, "advances": adv,
+            **(serializers.json_loads(extra) if extra else {}),
+        }
+
+    def _faction_tree(self, db, campaign: str, name: str) -> Dict[str, Any] | None:
+        row = db.execute("SELECT status, extra FROM factions WHERE campaign=? AND name=?", (campaign, name)).fetchone()
+        if row is None:
+            return None
+        clocks = [{"name": n, "segments": s, "filled": f} for n, s, f in db.execute(
+            "SELECT name, segments, filled FROM faction_clocks WHERE campaign=? AND faction=? ORDER BY pos", (campaign, name))]
+        return {"status": row[0], "clocks": clocks, **(serializers.json_loads(row[1]) if row[1] else {})}
+
+    def _insert_player(self, db, campaign: str, name: str, p: Dict[str, Any], pos: int) -> None:
+        known = set(_PLAYER_COLS) | set(_PLAYER_JSON) | {"harms"}
+        extra = {k: v for k, v in p.items() if k not in known}
+        db.execute("INSERT OR REPLACE INTO players VALUES (?,?,?,?,?,?,?,?,?,?)", (
+            campaign, name, pos, p.get("stress", 0), p.get("pending_trauma", 0), p.get("xp", 0), p.get("advances", 0),
+            _dumps(p.get("actions", {})), _dumps(p.get("trauma", [])), _dumps(extra) if extra else None))
+        db.executemany("INSERT INTO harms(campaign, player, pos, level, label, kind) VALUES (?,?,?,?,?,?)", [
+            (campaign, name, i, h.get("level"), h.get("label"), h.get("kind")) for i, h in enumerate(p.get("harms", []))])
+
+    def _replace_campaign(self, db, name: str, cur: Dict[str, Any]) -> None:
+        for table in ("players", "harms", "clocks", "factions", "faction_clocks"):
+            db.execute(f"DELETE FROM {table} WHERE campaign=?", (name,))
+        data = {k: v for k, v in cur.items() if k not in _ENTITY_KEYS and k != "current_campaign"}
+        db.execute("INSERT OR REPLACE INTO campaigns(name, data) VALUES (?, ?)", (name, _dumps(data)))
+        for i, (pname, p) in enumerate((cur.get("players") or {}).items()):
+            self._insert_player(db, name, pname, p, i)
+        db.executemany("INSERT INTO clocks(campaign, pos, name, segments, filled) VALUES (?,?,?,?,?)", [
+            (name, i, c.get("name"), c.get("segments"), c.get("filled", 0)) for i, c in enumerate(cur.get("clocks") or [])])
+        for i, (fname, f) in enumerate((cur.get("factions") or {}).items()):
+            extra = {k: v for k, v in f.items() if k not in ("status", "clocks")}
+            db.execute("INSERT INTO factions VALUES (?,?,?,?,?)", (name, fname, i, f.get("status", 0), _dumps(extra) if extra else None))
+            db.executemany("INSERT INTO faction_clocks(campaign, faction, pos, name, segments, filled) VALUES (?,?,?,?,?,?)", [
+                (name, fname, j, c.get("name"), c.get("segments"), c.get("filled", 0)) for j, c in enumerate(f.get("clocks") or [])])
+
+    def _ensure_player(self, db, campaign: str, name: str) -> None:
+        if db.execute("SELECT 1 FROM players WHERE campaign=? AND name=?", (campaign, name)).fetchone() is None:
+            pos = db.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM players WHERE campaign=?", (campaign,)).fetchone()[0]
+            self._insert_player(db, campaign, name, {"actions": {a: 0 for a in DEFAULT_ACTIONS}}, pos)
+
+    def _ensure_faction(self, db, campaign: str, name: str) -> None:
+        if db.execute("SELECT 1 FROM factions WHERE campaign=? AND name=?", (campaign, name)).fetchone() is None:
+            pos = db.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM factions WHERE campaign=?", (campaign,)).fetchone()[0]
+            db.execute("INSERT INTO factions VALUES (?,?,?,?,NULL)", (campaign, name, pos, 0))
+
+    # ---- core io ----
+    def load_root(self) -> Dict[str, Any]:
+        with self._read() as db:
+            names = [r[0] for r in db.execute("SELECT name FROM campaigns ORDER BY rowid")]
+            return {"current_campaign": self._current_name(), "campaigns": {n: self._assemble(db, n) for n in names}}
+
+    def save(self, root: Dict[str, Any]) -> None:
+        with self._write() as db:
+            campaigns = root.get("campaigns", {})
+            for (name,) in db.execute("SELECT name FROM campaigns").fetchall():
+                if name not in campaigns:
+                    self._replace_campaign(db, name, {})
+                    db.execute("DELETE FROM campaigns WHERE name=?", (name,))
+            for name, cur in campaigns.items():
+                self._replace_campaign(db, name, cur)
+            self._set_meta("current_campaign", root.get("current_campaign", "default"))
+
+    # ---- campaigns ----
+    def create_campaign(self, name: str) -> None:
+        with self._write() as db:
+            self._replace_campaign(db, name, default_campaign())
+            self._set_meta("current_campaign", name)
+
+    def switch_campaign(self, name: str) -> None:
+        with self._write() as db:
+            if db.execute("SELECT 1 FROM campaigns WHERE name=?", (name,)).fetchone() is None:
+                raise ValueError("Кампания не найдена")
+            self._set_meta("current_campaign", name)
+
+    def list_campaigns(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT name FROM campaigns ORDER BY rowid")]
+
+    # ---- current get/save ----
+    def _read_current(self) -> tuple[str, Dict[str, Any]]:
+        with self._read() as db:
+            name = self._current_name()
+            return name, (self._assemble(db, name) or default_campaign())
+
+    def _write_current(self, name: str, cur: Dict[str, Any]) -> None:
+        with self._write() as db:
+            self._replace_campaign(db, name, cur)
+
+    # ---------- однострочные мутации ----------
+    def upsert_clock(self, name: str, segments: int) -> None:
+        if self._tx_view() is not None:
+            return super().upsert_clock(name, segments)
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._clocks(db, camp)
+            # одноимённых часов может быть несколько — как и общая логика, трогаем только первые
+            if db.execute(f"UPDATE clocks SET segments=? WHERE {_FIRST_CLOCK}", (segments, camp, name, camp, name)).rowcount == 0:
+                pos = db.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM clocks WHERE campaign=?", (camp,)).fetchone()[0]
+                db.execute("INSERT INTO clocks(campaign, pos, name, segments, filled) VALUES (?,?,?,?,0)", (camp, pos, name, segments))
+            self._track("/clocks", before, self._clocks(db, camp))
+
+    def fill_clock(self, name: str, n: int) -> None:
+        if self._tx_view() is not None:
+            return super().fill_clock(name, n)
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._clocks(db, camp)
+            cur = db.execute(f"UPDATE clocks SET filled=MIN(segments, filled + ?) WHERE {_FIRST_CLOCK}",
+                             (int(n), camp, name, camp, name))
+            if cur.rowcount == 0:
+                raise ValueError(f"Clock '{name}' not found")
+            self._track("/clocks", before, self._clocks(db, camp))
+
+    def upsert_player(self, name: str):
+        if self._tx_view() is not None:
+            return super().upsert_player(name)
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM players WHERE campaign=? AND name=?", (self._current_name(), name)).fetchone():
+                return  # игрок уже есть: без записи версия не меняется
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._player_tree(db, camp, name)
+            self._ensure_player(db, camp, name)
+            self._track(jsonpatch.pointer("players", name), before, self._player_tree(db, camp, name))
+
+    def set_stress(self, name: str, stress: int):
+        if self._tx_view() is not None:
+            return super().set_stress(name, stress)
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._player_tree(db, camp, name)
+            self._ensure_player(db, camp, name)
+            stress = int(stress)
+            if stress > 9:
+                db.execute("UPDATE players SET pending_trauma=COALESCE(pending_trauma, 0) + 1 WHERE campaign=? AND name=?", (camp, name))
+                stress = 0
+            db.execute("UPDATE players SET stress=? WHERE campaign=? AND name=?", (max(0, min(9, stress)), camp, name))
+            self._track(jsonpatch.pointer("players", name), before, self._player_tree(db, camp, name))
+
+    def add_harm(self, name: str, level: int, label: str, kind: str | None=None):
+        if self._tx_view() is not None:
+            return super().add_harm(name, level, label, kind)
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._player_tree(db, camp, name)
+            self._ensure_player(db, camp, name)
+            pos = db.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM harms WHERE campaign=? AND player=?", (camp, name)).fetchone()[0]
+            db.execute("INSERT INTO harms(campaign, player, pos, level, label, kind) VALUES (?,?,?,?,?,?)",
+                       (camp, name, pos, int(level), label, kind or "generic"))
+            self._track(jsonpatch.pointer("players", name), before, self._player_tree(db, camp, name))
+
+    def faction_set_status(self, name: str, status: int):
+        if self._tx_view() is not None:
+            return super().faction_set_status(name, status)
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._faction_tree(db, camp, name)
+            self._ensure_faction(db, camp, name)
+            db.execute("UPDATE factions SET status=? WHERE campaign=? AND name=?", (int(status), camp, name))
+            self._track(jsonpatch.pointer("factions", name), before, self._faction_tree(db, camp, name))
+
+    def faction_clock_fill(self, name: str, clock: str, n: int):
+        if self._tx_view() is not None:
+            return super().faction_clock_fill(name, clock, n)
+        with self._write() as db:
+            camp = self._current_name()
+            before = self._faction_tree(db, camp, name)
+            self._ensure_faction(db, camp, name)
+            cur = db.execute("UPDATE faction_clocks SET filled=MIN(segments, filled + ?) WHERE campaign=? AND faction=? AND name=? "
+                             "AND pos=(SELECT MIN(pos) FROM faction_clocks WHERE campaign=? AND faction=? AND name=?)",
+                             (int(n), camp, name, clock, camp, name, clock))
+            if cur.rowcount == 0:
+                raise ValueError("Clock not found")
+            self._track(jsonpatch.pointer("factions", name), before, self._faction_tree(db, camp, name))
+
+    # ---------- import/export ----------
+    def import_state(self, payload: Dict[str, Any]):
+        if not isinstance(payload, dict):
+            raise ValueError("Неверный формат")
+        cur_name = payload.get("current_campaign", "imported")
+        with self._write() as db:
+            self._replace_campaign(db, cur_name, payload)
+            self._set_meta("current_campaign", cur_name)
@@ -0,0 +1,219 @@
+from __future__ import annotations
+import os, threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List
+
+from . import jsonpatch, serializers
+from .state import StateStore, default_campaign, _clone, _replace, _FileLock
+
+
+class LoggedStateStore(StateStore):
+    """Состояние в памяти + журнал мутаций.
+
+    Каждая мутация дописывает в `<path>.log` одну компактную строку
+    `{"seq": N, "ops": [...]}` (JSON Patch относительно корня). Фоновый компактор
+    сворачивает журнал в снапшот `<path>`; при старте снапшот + хвост журнала проигрываются.
+    Блокировка `<path>.lock` берётся на каждую запись и компакцию, как у StateStore: взяв её,
+    хранилище сначала дочитывает чужие записи (хвост журнала или новый снапшот).
+    """
+
+    def __init__(self, path: str, compact_every: int | None = None, fsync: bool | None = None):
+        self.path = path
+        self.log_path = path + ".log"
+        if compact_every is None:
+            compact_every = int(os.getenv("BITD_WAL_COMPACT_EVERY", "500"))
+        if fsync is None:
+            fsync = os.getenv("BITD_WAL_FSYNC", "0").strip().lower() in ("1", "true", "yes")
+        self.compact_every = max(1, int(compact_every))
+        self.fsync = fsync
+        self.serializer = serializers.get_serializer()
+        self.cache = True  # всё и так в памяти; разбор JSON только при старте и после чужой компакции
+        self._init_runtime()
+        self._compact_lock = threading.Lock()
+        self._compacting = False
+        self._log = None
+        self._log_size = 0  # сколько байт журнала уже проиграно (свои записи + чужие)
+        self._seen = None   # (сигнатура снапшота, inode журнала) последнего полного проигрывания
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._flock = _FileLock(self.path + ".lock")
+        with self.locked():
+            pass  # первый захват проигрывает снапшот и журнал
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        with super().locked():
+            if self._lock_depth == 1:
+                self._sync()
+            yield
+
+    # ---- replay ----
+    @staticmethod
+    def _apply_log(root: Dict[str, Any], seq: int, data: bytes) -> tuple[Dict[str, Any], int, int, int]:
+        """Проигрывает строки журнала новее seq: (корень, seq, сколько применено, байт целых строк)."""
+        applied = good = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # недописанная запись (падение посреди append)
+            try:
+                rec = serializers.json_loads(line)
+            except ValueError:
+                break
+            good += len(line)
+            if int(rec["seq"]) <= seq:
+                continue  # уже в снапшоте
+            root = jsonpatch.apply(root, rec["ops"])
+            seq = int(rec["seq"])
+            applied += 1
+        return root, seq, applied, good
+
+    def _replay(self):
+        with open(self.path, "rb") as f:
+            root = serializers.loads(f.read())
+        seq = int(root.pop("log_seq", 0) or 0)
+        pending = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                data = f.read()
+            root, seq, pending, good = self._apply_log(root, seq, data)
+            if good < len(data):
+                # под блокировкой чужих записей нет — это хвост упавшего процесса
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(good)
+        return root, seq, pending
+
+    def _reload(self) -> None:
+        if self._log is not None:
+            self._log.close()
+        self._root, self._seq, self._pending = self._replay()
+        self._log = open(self.log_path, "ab")
+        self._log_size = self._log.tell()
+        self._seen = (self._signature(self.path), os.fstat(self._log.fileno()).st_ino)
+        self.version = self._seq
+
+    def _sync(self) -> None:
+        """Вызывается под блокировкой: подхватывает записи других процессов."""
+        if not os.path.exists(self.path):
+            self._write_snapshot({"current_campaign": "default", "campaigns": {"default": default_campaign()}, "log_seq": 0})
+        try:
+            seen = (self._signature(self.path), os.stat(self.log_path).st_ino)
+        except FileNotFoundError:
+            seen = None
+        if seen is None or seen != self._seen:
+            self._reload()  # первый запуск или чужая компакция
+            return
+        size = os.path.getsize(self.log_path)
+        if size > self._log_size:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_size)
+                data = f.read()
+            self._root, self._seq, applied, good = self._apply_log(self._root, self._seq, data)
+            self._log_size += good
+            self._pending += applied
+            self._copy_memo = None  # патчи применились к кампании на месте
+            self.version = self._seq  # чужие записи без патча в _changes: цепочка журнала прервана
+
+    # ---- log ----
+    def _append(self, ops: List[Dict[str, Any]]) -> None:
+        self._seq += 1
+        self._log.write(serializers.json_dumps({"seq": self._seq, "ops": ops}) + b"\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_size = self._log.tell()
+        self._pending += 1
+        self.version = self._seq
+        if self._pending >= self.compact_every and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact_bg, name="state-wal-compactor", daemon=True).start()
+
+    def _compact_bg(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def _dump_tmp(self, path: str, data: bytes) -> str:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp
+
+    def _write_snapshot(self, root: Dict[str, Any]) -> None:
+        _replace(self._dump_tmp(self.path, self.serializer.dumps(root)), self.path)
+
+    def compact(self) -> None:
+        """Сворачивает журнал в снапшот. Сериализация и запись идут без удержания блокировки."""
+        with self._compact_lock:
+            with self.locked():
+                mark, seen = self._log_size, self._seen
+                snap = {**_clone(self._root), "log_seq": self._seq}
+            tmp = self._dump_tmp(self.path, self.serializer.dumps(snap))
+            with self.locked():
+                if self._seen != seen:
+                    os.remove(tmp)  # другой процесс уже свернул журнал
+                    return
+                _replace(tmp, self.path)
+                # всё, что дописано после mark (нами или другими процессами), переносим в новый журнал
+                self._log.close()
+                with open(self.log_path, "rb") as f:
+                    f.seek(mark)
+                    tail = f.read()
+                _replace(self._dump_tmp(self.log_path, tail), self.log_path)
+                self._log = open(self.log_path, "ab")
+                self._log_size = self._log.tell()
+                self._seen = (self._signature(self.path), os.fstat(self._log.fileno()).st_ino)
+                self._pending = tail.count(b"\n")
+
+    def close(self) -> None:
+        self.compact()
+        with self._lock:
+            self._log.close()
+
+    # ---- core io ----
+    def load_root(self) -> Dict[str, Any]:
+        with self.locked():
+            self.cache_stats["hits"] += 1
+            return _clone(self._root)
+
+    def save(self, root: Dict[str, Any]) -> None:
+        with self.locked():
+            ops = jsonpatch.diff(self._root, root)
+            if ops:
+                self._append(ops)
+            self._root = root
+
+    def _read_current(self) -> tuple[str, Dict[str, Any]]:
+        with self.locked():
+            self.cache_stats["hits"] += 1
+            name = self._root.get("current_campaign", "default")
+            cur = self._root.get("campaigns", {}).get(name)
+            return name, (self._copy(cur) if cur is not None else default_campaign())
+
+    def _write_current(self, name: str, cur: Dict[str, Any]) -> None:
+        with self.locked():
+            campaigns = self._root.setdefault("campaigns", {})
+            old = campaigns.get(name)
+            if old is None:
+                ops = [{"op": "add", "path": jsonpatch.pointer("campaigns", name), "value": cur}]
+            else:
+                ops = jsonpatch.diff(old, cur, jsonpatch.pointer("campaigns", name))
+            if ops:
+                self._append(ops)
+            campaigns[name] = cur
+
+    def current_campaign(self) -> str:
+        with self.locked():
+            return self._root.get("current_campaign", "default")
+
+    def current_version(self) -> int:
+        with self.locked():
+            return self.version
+
+    def _committed(self, name: str) -> Dict[str, Any] | None:
+        return self._root.get("campaigns", {}).get(name)
+
+    def list_campaigns(self) -> List[str]:
+        with self.locked():
+            return list(self._root.get("campaigns", {}).keys())
@@ -1,15 +1,22 @@
 
 import gradio as gr
-import requests, os, json, math
+import requests, os, json, math, time, uuid
+
+from . import jsonpatch
 
 API = os.getenv("GM_API", "http://127.0.0.1:8000")
 
-history: list[dict[str,str]] = []
+# последний ответ /state и его ETag: повторный запрос без изменений — 304 без тела
+_state_cache: dict = {"etag": None, "body": None}
 
 def get_state():
-    r = requests.get(f"{API}/state", timeout=30)
+    headers = {"If-None-Match": _state_cache["etag"]} if _state_cache["etag"] else {}
+    r = requests.get(f"{API}/state", headers=headers, timeout=30)
+    if r.status_code == 304 and _state_cache["body"] is not None:
+        return _state_cache["body"]
     r.raise_for_status()
-    return r.json()
+    _state_cache["etag"], _state_cache["body"] = r.headers.get("ETag"), r.json()
+    return _state_cache["body"]
 
 def donut_svg(name, filled, total, size=96, stroke=12):
     radius = (size - stroke) / 2
@@ -118,9 +125,16 @@ def render_factions(s):
 """
     return html
 
+def render_meta(s):
+    return f"**Кампания:** {s.get('current_campaign')}  |  **Coin:** {s.get('coin',0)} | **Rep:** {s.get('rep',0)} | **Heat:** {s.get('heat',0)} | **Wanted:** {s.get('wanted',0)}"
+
+_render_cache: dict = {"etag": None, "out": None}
+
 def refresh_all():
     s = get_state()
-    meta = f"**Кампания:** {s.get('current_campaign')}  |  **Coin:** {s.get('coin',0)} | **Rep:** {s.get('rep',0)} | **Heat:** {s.get('heat',0)} | **Wanted:** {s.get('wanted',0)}"
+    if _render_cache["etag"] and _render_cache["etag"] == _state_cache["etag"]:
+        return _render_cache["out"]
+    meta = render_meta(s)
     clocks_html = render_clocks_svg(s)
     players_html = render_players_cards(s) + crew_card(s)
     factions_html = render_factions(s)
@@ -129,16 +143,121 @@ def refresh_all():
     cfg_auto_xp = bool(cfg.get("auto_xp_desperate", True))
     presets = s.get("config", {}).get("rules", {}).get("trigger_presets", ["Стандарт"])
     banner = last_roll_banner(s)
-    return meta, clocks_html, players_html, factions_html, json.dumps(s, ensure_ascii=False, indent=2), cfg_auto, cfg_auto_xp, presets, banner
-
-def chat(user_text: str):
-    global history
-    payload = {"history": history, "user": user_text}
-    r = requests.post(f"{API}/chat", json=payload, timeout=120)
-    r.raise_for_status()
-    data = r.json()
-    history.append({"role": "user", "content": user_text})
-    history.append({"role": "assistant", "content": data["narration"]})
+    out = meta, clocks_html, players_html, factions_html, json.dumps(s, ensure_ascii=False, indent=2), cfg_auto, cfg_auto_xp, presets, banner
+    _render_cache["etag"], _render_cache["out"] = _state_cache["etag"], out
+    return out
+
+# ----- push-обновления из /state/stream -----
+# какие ключи кампании влияют на какую панель
+_PANEL_KEYS = {
+    "meta": {"current_campaign", "coin", "rep", "heat", "wanted"},
+    "clocks": {"clocks"},
+    "players": {"players", "crew", "config"},
+    "factions": {"factions"},
+    "banner": {"last_roll"},
+}
+
+def _render_panels(s, keys):
+    def pick(panel, render):
+        return render(s) if "*" in keys or keys & _PANEL_KEYS[panel] else gr.update()
+    return (
+        pick("meta", render_meta),
+        pick("clocks", render_clocks_svg),
+        pick("players", lambda s: render_players_cards(s) + crew_card(s)),
+        pick("factions", render_factions),
+        json.dumps(s, ensure_ascii=False, indent=2),
+        pick("banner", last_roll_banner),
+    )
+
+def _sse_events(resp):
+    kind, data = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield kind, json.loads("\n".join(data))
+            kind, data = "message", []
+        elif line.startswith("event:"):
+            kind = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+
+def stream_state():
+    """Подписка на GET /state/stream: изменения из других вкладок и /chat приходят сами,
+    перерисовываются только затронутые панели. При обрыве — переподключение с Last-Event-ID."""
+    s, last_id = None, None
+    while True:
+        try:
+            headers = {"Last-Event-ID": str(last_id)} if s is not None else {}
+            with requests.get(f"{API}/state/stream", headers=headers, stream=True, timeout=(5, 60)) as r:
+                r.raise_for_status()
+                for kind, ev in _sse_events(r):
+                    if kind == "patch" and s is not None:
+                        s = jsonpatch.apply(s, ev["patch"])
+                        keys = {(jsonpatch.split_pointer(op["path"]) or ["*"])[0] for op in ev["patch"]}
+                    else:
+                        s, keys = ev["state"], {"*"}
+                    last_id = ev["version"]
+                    if keys:
+                        yield _render_panels(s, keys)
+        except requests.RequestException:
+            time.sleep(2)
+
+_MODEL_STAGES = {
+    "idle": "загрузится при первом сообщении в чат",
+    "loading": "загружается",
+    "warming": "прогревается",
+    "ready": "готова",
+}
+
+def _model_status(info: dict) -> str:
+    status = info.get("status")
+    load = info.get("load") or {}
+    if status == "failed":
+        return f"**Модель:** не загрузилась — {load.get('error')}"
+    text = "**Модель:** " + _MODEL_STAGES.get(status, str(status))
+    secs = load.get("load_s", load.get("elapsed_s"))
+    if secs is not None and status != "idle":
+        text += f" ({secs:.0f} с)"
+    if status in ("loading", "warming"):
+        text += " — механика уже работает, чат ответит, когда модель будет готова"
+    return text
+
+def watch_model():
+    """Стадия модели из GET /health (503, пока она не прогрета): опрос раз в 2 с до ready или failed."""
+    last = None
+    while True:
+        try:
+            info = requests.get(f"{API}/health", timeout=5).json()
+        except (requests.RequestException, ValueError):
+            info = {"status": "сервер недоступен"}
+        text = _model_status(info)
+        if text != last:
+            last = text
+            yield text
+        if info.get("status") in ("ready", "failed"):
+            return
+        time.sleep(2)
+
+def chat(user_text: str, history: list[dict[str, str]], session_id: str):
+    # история хода — на сервере (сессия вкладки); здесь только её копия для отображения
+    payload = {"session": session_id, "user": user_text}
+    # нарратив показываем по мере генерации (POST /chat/stream), итог — как раньше
+    data, text, blocks = None, "", []
+    with requests.post(f"{API}/chat/stream", json=payload, stream=True, timeout=(5, 120)) as r:
+        r.raise_for_status()
+        for kind, ev in _sse_events(r):
+            if kind == "token":
+                text += ev["text"]
+            elif kind == "tool_result":
+                blocks.append("**TOOL RESULT:**\n```json\n" + json.dumps(ev["tool_result"], ensure_ascii=False, indent=2) + "\n```")
+            elif kind == "done":
+                data = ev
+                break
+            partial = history + [{"role": "user", "content": user_text}, {"role": "assistant", "content": text}]
+            yield (partial, text + ("\n\n" + "\n\n".join(blocks) if blocks else ""), *([gr.update()] * 10))
+    if data is None:
+        raise RuntimeError("Поток /chat/stream оборвался до события done")
+    history = history + [{"role": "user", "content": user_text}, {"role": "assistant", "content": data["narration"]}]
     blocks = []
     if data.get("intent"):
         blocks.append("**INTENT:**\n```json\n" + json.dumps(data["intent"], ensure_ascii=False, indent=2) + "\n```");
@@ -146,7 +265,7 @@ def chat(user_text: str):
         blocks.append("**TOOL RESULT:**\n```json\n" + json.dumps(data["tool_result"], ensure_ascii=False, indent=2) + "\n```");
     pretty = data["narration"] + ("\n\n" + "\n\n".join(blocks) if blocks else "")
     meta, clocks_html, players_html, factions_html, state_json, cfg_auto, cfg_auto_xp, presets, banner = refresh_all()
-    return history, pretty, meta, clocks_html, players_html, factions_html, state_json, cfg_auto, cfg_auto_xp, gr.Dropdown.update(choices=presets), banner
+    yield history, pretty, meta, clocks_html, players_html, factions_html, state_json, cfg_auto, cfg_auto_xp, gr.Dropdown.update(choices=presets), banner, history
 
 # --- API helpers ---
 def create_clock(name, segments): requests.post(f"{API}/clock/create", json={"name": name, "segments": int(segments)}, timeout=30).raise_for_status(); return refresh_all()
@@ -240,6 +359,7 @@ def do_import(state_json_text):
 
 with gr.Blocks(title="BitD GM AI — правила, пресеты, мастер-панель") as demo:
     gr.Markdown("# BitD GM AI — Consequences, Presets, GM Panel")
+    model_box = gr.Markdown()
     banner_box = gr.Markdown()
 
     # Quick actions under banner
@@ -281,6 +401,9 @@ with gr.Blocks(title="BitD GM AI — правила, пресеты, масте
     btn_use_preset = gr.Button("Применить пресет")
 
     chatbot = gr.Chatbot(height=260, label="Диалог")
+    # своя серверная сессия у каждой вкладки: столы не делят историю
+    session_id = gr.State(lambda: uuid.uuid4().hex)
+    chat_history = gr.State([])
     msg = gr.Textbox(placeholder="Опишите действие/сцену… (actor/action/assist/push/bargain/bonus приветствуются)", label="Сообщение")
     send = gr.Button("Отправить")
 
@@ -371,7 +494,7 @@ with gr.Blocks(title="BitD GM AI — правила, пресеты, масте
         logs_csv = gr.Code(label="Логи (CSV)", language="csv")
 
     # wiring
-    send.click(chat, inputs=[msg], outputs=[chatbot, chatbot, meta_box, clocks_box, players_box, factions_box, state_json, cfg_auto, cfg_auto_xp, presets_dd, banner_box])
+    send.click(chat, inputs=[msg, chat_history, session_id], outputs=[chatbot, chatbot, meta_box, clocks_box, players_box, factions_box, state_json, cfg_auto, cfg_auto_xp, presets_dd, banner_box, chat_history])
     cfg_auto.change(cfg_toggle_auto, inputs=[cfg_auto], outputs=[meta_box, clocks_box, players_box, factions_box, state_json, cfg_auto, cfg_auto_xp, presets_dd, banner_box])
     cfg_auto_xp.change(cfg_toggle_auto_xp, inputs=[cfg_auto_xp], outputs=[meta_box, clocks_box, players_box, factions_box, state_json, cfg_auto, cfg_auto_xp, presets_dd, banner_box])
     btn_set_th.click(set_thresholds, inputs=[th_player, th_crew], outputs=[meta_box, clocks_box, players_box, factions_box, state_json, cfg_auto, cfg_auto_xp, presets_dd, banner_box])
@@ -407,6 +530,8 @@ with gr.Blocks(title="BitD GM AI — правила, пресеты, масте
     cfg_auto_xp.value = cfg_xp_flag
     presets_dd.choices = presets
     presets_dd.value = presets[0] if presets else "Стандарт"
+    demo.load(stream_state, outputs=[meta_box, clocks_box, players_box, factions_box, state_json, banner_box])
+    demo.load(watch_model, outputs=[model_box])
 
 # ----- Consequences editor & applier -----
 def load_consequences(position, key):
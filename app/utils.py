@@ -16,5 +16,17 @@ def getenv_int(name: str, default: int) -> int:
     except Exception:
         return default
 
+def getenv_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+def getenv_bool(name: str, default: bool = False) -> bool:
+    val = os.getenv(name)
+    if val is None:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
 def clamp(n: int, lo: int, hi: int) -> int:
     return max(lo, min(hi, n))
@@ -24,7 +24,8 @@ def start_ui():
         pass
     demo.launch(server_name="127.0.0.1", server_port=7860, prevent_thread_lock=True, show_error=True)
 
-def wait_for(url, timeout=15.0):
+def wait_for(url, timeout=15.0, interval=0.2):
+    # ждёт 200
     import time, urllib.request
     deadline = time.time() + timeout
     while time.time() < deadline:
@@ -33,7 +34,8 @@ def wait_for(url, timeout=15.0):
                 if resp.status == 200:
                     return True
         except Exception:
-            time.sleep(0.2)
+            pass
+        time.sleep(interval)
     return False
 
 def main():
@@ -43,7 +45,11 @@ def main():
     t2.start()
 
     url = "http://127.0.0.1:7860"
-    # Wait for UI to be live, then open a native window
+    # Окно открываем, как только отвечает механика (/state); модель догружается в фоне,
+    # её стадию (загрузка, прогрев, готова) UI показывает сам, опрашивая /health
+    api_state = f"http://127.0.0.1:{os.getenv('PORT', '8000')}/state"
+    if not wait_for(api_state, timeout=float(os.getenv("BITD_READY_TIMEOUT", "60")), interval=0.2):
+        print("Сервер не ответил:", api_state)
     ok = wait_for(url, timeout=20.0)
     try:
         import webview
@@ -58,4 +64,9 @@ def main():
     webview.start(gui='edgechromium')  # blocks until closed
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["--model-pool-worker"]:
+        # собранное приложение запускает само себя процессом модели (app.model_pool.WORKER_FLAG)
+        from app.model_pool import main as model_pool_main
+        model_pool_main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,59 @@
+"""Бенчмарк пула процессов llama_cpp: суммарные токены/с при 1..N воркерах.
+
+    python tools/bench_pool.py --model models/tiny.gguf --workers 1,2,4 --requests 16 --max-tokens 64
+
+Для каждого числа воркеров поднимает ModelPool (ядра делятся поровну, если не задан
+--threads) и InferenceScheduler с тем же числом рабочих потоков, отправляет --requests
+одинаковых запросов сразу и меряет время до последнего ответа. Для честного сравнения
+берите маленькую модель (TinyLlama/Qwen 0.5B в Q4) — важен рост, а не абсолютные числа.
+"""
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.model_pool import ModelPool
+from app.scheduler import InferenceScheduler
+from app.prompts import SYSTEM_PROMPT_RU
+
+USER = "Кот пытается вскрыть замок на складе Ламповых, пока стража на обходе."
+
+def run(model: str, workers: int, requests: int, max_tokens: int, threads: int | None, ctx: int):
+    t0 = time.perf_counter()
+    pool = ModelPool(model, workers, n_ctx=ctx, n_threads=threads, sampling={"temperature": 0.7, "top_p": 0.95})
+    load = time.perf_counter() - t0
+    sched = InferenceScheduler(name="bench", workers=workers, max_depth=requests)
+    messages = [{"role": "system", "content": SYSTEM_PROMPT_RU}, {"role": "user", "content": USER}]
+    try:
+        t0 = time.perf_counter()
+        futures = [sched.submit(pool.chat, messages, max_tokens, key=f"table-{i % workers}") for i in range(requests)]
+        for f in futures:
+            f.result()
+        wall = time.perf_counter() - t0
+        st, q = pool.stats(), sched.stats()
+    finally:
+        pool.close()
+    return {"workers": workers, "threads": st["threads_per_worker"], "load_s": load, "wall_s": wall,
+            "tokens": st["tokens"], "tps": st["tokens"] / wall if wall else 0.0, "wait_p95": q["queue_wait_ms"]["p95"]}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default=os.getenv("LLAMA_MODEL_PATH"), help="GGUF-файл (по умолчанию LLAMA_MODEL_PATH)")
+    ap.add_argument("--workers", default="1,2,4", help="через запятую")
+    ap.add_argument("--requests", type=int, default=16)
+    ap.add_argument("--max-tokens", type=int, default=64)
+    ap.add_argument("--threads", type=int, default=0, help="потоков на воркер (0 — cpu_count // N)")
+    ap.add_argument("--ctx", type=int, default=2048)
+    args = ap.parse_args()
+    if not args.model or not os.path.exists(args.model):
+        sys.exit("Укажите --model или LLAMA_MODEL_PATH")
+
+    base = None
+    print(f"{'воркеров':>8} {'потоков':>7} {'загрузка, с':>11} {'время, с':>9} {'токенов':>8} {'ток/с':>8} {'рост':>6} {'p95 ожид., мс':>14}")
+    for n in [int(x) for x in args.workers.split(",") if x.strip()]:
+        r = run(args.model, n, args.requests, args.max_tokens, args.threads or None, args.ctx)
+        base = base or r["tps"]
+        print(f"{r['workers']:>8} {r['threads']:>7} {r['load_s']:>11.1f} {r['wall_s']:>9.1f} {r['tokens']:>8} "
+              f"{r['tps']:>8.1f} {r['tps'] / base if base else 0:>5.2f}x {r['wait_p95'] or 0:>14.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Бенчмарк спекулятивного декодирования llama_cpp на записанных промптах.
+
+    python tools/bench_speculative.py --model models/llama-8b.gguf --modes off,lookup,draft \
+        --draft-model models/llama-1b.gguf --prompts 20 --max-tokens 256
+
+Промпты — из `data/logs/chat.jsonl` (системный промпт + история + реплика игрока, как их видела
+модель). Для каждого режима (off — обычное декодирование, lookup — prompt-lookup, draft — черновая
+GGUF-модель) поднимается своя Llama, промпты прогоняются по очереди при temperature 0 (так выход
+спекулятивного декодирования обязан совпасть с обычным — это тоже проверяется). Меряется скорость
+декодирования (токены после первого / время после первого токена, без обработки промпта), время
+до первого токена и доля принятых токенов черновика.
+"""
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.prompts import SYSTEM_PROMPT_RU
+from app.speculative import make_draft_model
+
+def load_prompts(path: str, limit: int, history: int):
+    if not os.path.exists(path):
+        sys.exit(f"Не найден лог {path}")
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            turns = [{"role": h["role"], "content": h["content"]} for h in rec.get("history", [])][-history:] if history else []
+            prompts.append([{"role": "system", "content": SYSTEM_PROMPT_RU}] + turns + [{"role": "user", "content": rec["user"]}])
+    return prompts[-limit:]
+
+def run(mode: str, args, prompts):
+    from llama_cpp import Llama
+    draft = make_draft_model(mode, args.draft_tokens, args.draft_model, args.ctx)
+    model = Llama(model_path=args.model, n_ctx=args.ctx, draft_model=draft, logits_all=False, verbose=False)
+    outputs, decode_tokens, decode_s, ttft = [], 0, 0.0, []
+    for messages in prompts:
+        t0 = time.perf_counter()
+        first, n, parts = None, 0, []
+        for chunk in model.create_chat_completion(messages=messages, max_tokens=args.max_tokens, temperature=0.0, stream=True):
+            piece = chunk["choices"][0]["delta"].get("content")
+            if not piece:
+                continue
+            if first is None:
+                first = time.perf_counter()
+            n += 1
+            parts.append(piece)
+        end = time.perf_counter()
+        if first is not None:
+            ttft.append((first - t0) * 1000)
+            decode_tokens += max(0, n - 1)
+            decode_s += end - first
+        outputs.append("".join(parts))
+    spec = draft.snapshot() if draft is not None else {}
+    ttft.sort()
+    return {"mode": mode, "tps": decode_tokens / decode_s if decode_s else 0.0, "tokens": decode_tokens,
+            "ttft_p50": ttft[len(ttft) // 2] if ttft else 0.0, "acceptance": spec.get("acceptance_rate"),
+            "outputs": outputs}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default=os.getenv("LLAMA_MODEL_PATH"), help="GGUF-файл (по умолчанию LLAMA_MODEL_PATH)")
+    ap.add_argument("--draft-model", default=os.getenv("LLAMA_DRAFT_MODEL_PATH"), help="черновая GGUF для режима draft")
+    ap.add_argument("--modes", default="off,lookup", help="через запятую: off, lookup, draft")
+    ap.add_argument("--draft-tokens", type=int, default=int(os.getenv("LLAMA_DRAFT_TOKENS", "10")))
+    ap.add_argument("--log", default="data/logs/chat.jsonl")
+    ap.add_argument("--prompts", type=int, default=20, help="сколько последних записей лога взять")
+    ap.add_argument("--history", type=int, default=6, help="сколько реплик истории оставить в промпте")
+    ap.add_argument("--max-tokens", type=int, default=256)
+    ap.add_argument("--ctx", type=int, default=int(os.getenv("LLAMA_CTX_SIZE", "4096")))
+    args = ap.parse_args()
+    if not args.model or not os.path.exists(args.model):
+        sys.exit("Укажите --model или LLAMA_MODEL_PATH")
+    prompts = load_prompts(args.log, args.prompts, args.history)
+    if not prompts:
+        sys.exit(f"В {args.log} нет записей")
+
+    base = None
+    print(f"промптов: {len(prompts)}, max_tokens: {args.max_tokens}, черновик: {args.draft_tokens} ток.")
+    print(f"{'режим':>8} {'ток/с':>8} {'рост':>6} {'токенов':>8} {'TTFT p50, мс':>13} {'принято':>8} {'совпадает':>10}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        r = run(mode, args, prompts)
+        if base is None:
+            base = r
+        same = sum(a == b for a, b in zip(r["outputs"], base["outputs"]))
+        acc = f"{r['acceptance']:.0%}" if r["acceptance"] is not None else "—"
+        print(f"{mode:>8} {r['tps']:>8.1f} {r['tps'] / base['tps'] if base['tps'] else 0:>5.2f}x {r['tokens']:>8} "
+              f"{r['ttft_p50']:>13.0f} {acc:>8} {same:>5}/{len(prompts)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Бенчмарк запуска сервера: время импорта и время до первого ответа.
+
+    python tools/bench_startup.py --runs 5
+    python tools/bench_startup.py --runs 3 --load on_demand
+
+Каждый прогон — свежий процесс (импорты не кэшированы в памяти). Меряется:
+  import   — `import app.server` в отдельном интерпретаторе;
+  first    — от запуска uvicorn до первого 200 на дешёвый эндпоинт (`GET /state`);
+  ready    — от запуска до 200 на `GET /ready` (модель загружена; с `--load on_demand` — не ждётся).
+Выводятся медиана и максимум по прогонам. Состояние пишется во временный каталог.
+"""
+import argparse, json, os, socket, statistics, subprocess, sys, tempfile, time, urllib.error, urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time(env) -> float:
+    code = "import time; t = time.perf_counter(); import app.server; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, timeout=600)
+    if out.returncode != 0:
+        sys.exit(out.stderr)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def poll(url: str, deadline: float) -> float | None:
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def serve_times(env, timeout: float, wait_ready: bool):
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.server:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=ROOT, env=env)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        first = poll(base + "/state", t0 + timeout)
+        ready = poll(base + "/ready", t0 + timeout) if wait_ready and first is not None else None
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    return (first - t0 if first else None), (ready - t0 if ready else None)
+
+
+def fmt(xs) -> str:
+    xs = [x for x in xs if x is not None]
+    if not xs:
+        return f"{'—':>8} {'—':>8}"
+    return f"{statistics.median(xs):>8.2f} {max(xs):>8.2f}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--load", default="startup", choices=["startup", "on_demand"], help="BITD_LLM_LOAD")
+    ap.add_argument("--timeout", type=float, default=300.0, help="сколько ждать ответа, с")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bitd-startup-")
+    env = {**os.environ, "BITD_STATE_PATH": os.path.join(tmp, "state.json"), "BITD_LLM_LOAD": args.load,
+           "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    imports, firsts, readies = [], [], []
+    for i in range(args.runs):
+        imports.append(import_time(env))
+        first, ready = serve_times(env, args.timeout, args.load == "startup")
+        firsts.append(first)
+        readies.append(ready)
+        print(json.dumps({"run": i + 1, "import_s": round(imports[-1], 3),
+                          "first_response_s": first and round(first, 3), "ready_s": ready and round(ready, 3)}))
+    print(f"{'':>16} {'медиана':>8} {'макс':>8}")
+    print(f"{'import, с':>16} {fmt(imports)}")
+    print(f"{'первый ответ, с':>16} {fmt(firsts)}")
+    print(f"{'модель готова, с':>16} {fmt(readies)}")
+
+
+if __name__ == "__main__":
+    main()
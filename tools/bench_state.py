@@ -0,0 +1,67 @@
+"""Бенчмарк сериализации и хранилища состояния.
+
+    python tools/bench_state.py [--repeat 20]
+
+Для кампаний с 10, 100 и 1000 игроков/часов/фракций меряет размер файла и задержку
+load/save каждого доступного формата (json-pretty — прежний формат с indent=2),
+а также get() и одну мутацию через StateStore с выключенным и включённым кэшем.
+"""
+import argparse, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import serializers
+from app.state import StateStore, default_campaign, DEFAULT_ACTIONS
+
+def make_campaign(n: int):
+    cur = default_campaign()
+    for i in range(n):
+        cur["players"][f"Игрок {i}"] = {
+            "harms": [{"level": 1 + i % 3, "label": "Порез", "kind": "physical"}],
+            "actions": {a: i % 4 for a in DEFAULT_ACTIONS},
+            "stress": i % 9, "trauma": ["Холодный"], "pending_trauma": 0, "xp": i % 8, "advances": i // 8,
+        }
+        cur["clocks"].append({"name": f"Час {i}", "segments": 8, "filled": i % 8})
+        cur["factions"][f"Фракция {i}"] = {"status": i % 7 - 3, "clocks": [{"name": "План", "segments": 6, "filled": i % 6}]}
+    return cur
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+    formats = ["json-pretty", "json"] + (["orjson"] if serializers.ORJSON_OK else []) + (["msgpack"] if serializers.MSGPACK_OK else [])
+
+    print(f"{'N':>5} {'формат':<12} {'размер, КБ':>10} {'load, мс':>9} {'save, мс':>9}")
+    for n in (10, 100, 1000):
+        root = {"current_campaign": "default", "campaigns": {"default": make_campaign(n)}}
+        for fmt in formats:
+            ser = serializers.SERIALIZERS[fmt]()
+            blob = ser.dumps(root)
+            load = timeit(lambda: serializers.loads(blob), args.repeat)
+            save = timeit(lambda: ser.dumps(root), args.repeat)
+            print(f"{n:>5} {fmt:<12} {len(blob) / 1024:>10.1f} {load:>9.2f} {save:>9.2f}")
+
+    print()
+    print(f"{'N':>5} {'формат':<12} {'кэш':<4} {'get, мс':>9} {'fill_clock, мс':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (10, 100, 1000):
+            root = {"current_campaign": "default", "campaigns": {"default": make_campaign(n)}}
+            for fmt in formats:
+                for cache in (False, True):
+                    path = os.path.join(tmp, f"{n}-{fmt}-{cache}.json")
+                    st = StateStore(path, cache=cache, fmt=fmt)
+                    st.save(root)
+                    get = timeit(st.get, args.repeat)
+                    fill = timeit(lambda: st.fill_clock("Час 0", 1), args.repeat)
+                    print(f"{n:>5} {fmt:<12} {'да' if cache else 'нет':<4} {get:>9.2f} {fill:>15.2f}")
+
+if __name__ == "__main__":
+    main()
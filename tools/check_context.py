@@ -0,0 +1,86 @@
+"""Проверка окна контекста на длинной сессии: конспект переживает обрезку истории стола.
+
+    python tools/check_context.py --turns 200 --max-messages 40 --budget 1000
+
+Сессия (SessionManager во временном каталоге) играет --turns ходов при BITD_SESSION_MESSAGES = --max-messages,
+так что история обрезается на каждом ходу задолго до конца. Вместо модели — заглушка: токен ≈ 3 символа,
+конспект — короткая строка. После первого конспекта каждый ход должен идти с ним, реплики не должны
+отбрасываться, а конспект — пересчитываться раз в несколько ходов, а не на каждом. В конце сессия
+поднимается с диска заново: номера реплик (offset) должны совпасть, и конспект годится и для неё.
+"""
+import argparse, os, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.context import ContextWindow
+from app.sessions import SessionManager
+
+SUMMARY_HEAD = "Краткое содержание предыдущих событий:"
+
+
+class FakeLLM:
+    def __init__(self, n_ctx: int):
+        self.n_ctx = n_ctx
+        self.calls = 0
+
+    def count_tokens(self, text: str) -> int:
+        return len(text) // 3 + 1
+
+    def chat(self, system_prompt, turns, max_tokens=800, **kwargs) -> str:
+        self.calls += 1
+        return f"конспект №{self.calls}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--turns", type=int, default=200)
+    ap.add_argument("--max-messages", type=int, default=40)
+    ap.add_argument("--budget", type=int, default=1000)
+    args = ap.parse_args()
+
+    sessions = SessionManager(tempfile.mkdtemp(), max_messages=args.max_messages)
+    llm = FakeLLM(args.budget)
+    window = ContextWindow(llm, reply_tokens=50)
+    window.summary_tokens = 40
+    with_summary = 0
+    for i in range(args.turns):
+        s = sessions.open("t", "camp")
+        try:
+            ready = window.stats["summaries"] > 0  # конспект уже был к началу хода
+            turns = window.build("Ты — Мастер.", list(s.history), f"ход {i}: " + "слово " * 8, s.key, s.offset)
+            window._executor.submit(lambda: None).result()  # дождаться фонового конспекта
+            if turns[0].content.startswith(SUMMARY_HEAD):
+                with_summary += 1
+            elif ready:
+                raise SystemExit(f"ход {i}: конспект есть, но в окно не попал (offset {s.offset})")
+            s.append(f"ход {i}: " + "слово " * 8, f"ответ {i}: " + "нарратив " * 8)
+        finally:
+            sessions.close(s, turn=True)
+
+    s = sessions.open("t", "camp")
+    offset = s.offset
+    sessions.close(s)
+    fresh = SessionManager(sessions.dir, max_messages=args.max_messages).open("t", "camp")
+    turns = window.build("Ты — Мастер.", list(fresh.history), "ещё ход", fresh.key, fresh.offset)
+    stats = window.info()
+    print(f"ходов {args.turns}, с конспектом {with_summary}, конспектов {stats['summaries']}, "
+          f"отброшено реплик {stats['dropped_turns']}, offset {offset}")
+    problems = []
+    if offset == 0:
+        problems.append("история ни разу не обрезалась — увеличьте --turns")
+    if stats["dropped_turns"]:
+        problems.append(f"отброшено реплик: {stats['dropped_turns']}")
+    if stats["summaries"] * 2 > args.turns:
+        problems.append(f"конспект пересчитывается почти на каждом ходу ({stats['summaries']})")
+    if fresh.offset != offset:
+        problems.append(f"после загрузки с диска offset {fresh.offset}, а был {offset}")
+    if not turns[0].content.startswith(SUMMARY_HEAD):
+        problems.append("конспект не подошёл сессии, поднятой с диска")
+    if problems:
+        print("ОШИБКА: " + "; ".join(problems))
+        sys.exit(1)
+    print("OK: конспект переживает обрезку истории")
+
+
+if __name__ == "__main__":
+    main()
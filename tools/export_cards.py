@@ -1,7 +1,7 @@
 
 import os, json, pathlib
 
-from app.state import StateStore
+from app.state import open_store
 
 OUT_DIR = pathlib.Path("exports")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -23,7 +23,7 @@ def donut_svg(filled, total, size=72, stroke=10):
 </svg>'''
 
 def main():
-    st = StateStore().get()
+    st = open_store().get()
     parts = ['''<meta charset="utf-8"><style>
 body{font-family:Inter,Arial,sans-serif}
 .card{border:1px solid #e5e7eb;border-radius:12px;padding:10px;margin:6px;display:inline-block;min-width:220px}
@@ -0,0 +1,41 @@
+"""Перенос состояния между движками хранилища.
+
+    python tools/migrate_state.py --src data/state.json --to sharded
+
+Источник читается движком --from (по умолчанию json), результат пишется движком --to
+по пути --dst (по умолчанию тот же путь: для sharded это каталог data/state.d/).
+Исходные файлы не удаляются.
+"""
+import argparse, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.state import open_store
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--src", default=os.getenv("BITD_STATE_PATH", "data/state.json"))
+    ap.add_argument("--dst", default=None)
+    ap.add_argument("--from", dest="src_backend", default="json")
+    ap.add_argument("--to", dest="dst_backend", required=True)
+    args = ap.parse_args()
+    if args.src_backend == args.dst_backend and not args.dst:
+        ap.error("--from и --to совпадают: укажите --dst")
+
+    os.environ["BITD_STATE_BACKEND"] = args.src_backend
+    src = open_store(args.src)
+    root = src.load_root()
+    if "campaigns" not in root:
+        # самый старый формат: одна кампания прямо в корне файла
+        root = {"current_campaign": "default", "campaigns": {"default": {**src.get(), **root}}}
+        root["campaigns"]["default"].pop("current_campaign", None)
+
+    os.environ["BITD_STATE_BACKEND"] = args.dst_backend
+    dst = open_store(args.dst or args.src)
+    dst.save(root)
+    if hasattr(dst, "close"):
+        dst.close()
+    print(f"{len(root.get('campaigns', {}))} кампаний: {args.src_backend} -> {args.dst_backend}")
+
+if __name__ == "__main__":
+    main()
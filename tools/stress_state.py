@@ -0,0 +1,87 @@
+"""Нагрузочная проверка StateStore: сотни параллельных мутаций не должны теряться.
+
+    python tools/stress_state.py --backend json --threads 16 --procs 4 --ops 25
+
+Каждый поток (в каждом процессе) делает --ops раз: add_heat(1), fill_clock(+1),
+add_harm своему персонажу и read-modify-write стресса в transaction(). В конце
+состояние открывается заново и сверяется с ожидаемыми суммами.
+"""
+import argparse, multiprocessing as mp, os, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.state import open_store
+
+CLOCK = "Нагрузка"
+
+def hammer(store, worker: str, ops: int):
+    for i in range(ops):
+        store.add_heat(1)
+        store.fill_clock(CLOCK, 1)
+        store.add_harm(worker, 1, f"h{i}")
+        with store.transaction() as cur:
+            old = int(cur["players"][worker].get("xp", 0))
+            cur["players"][worker]["xp"] = old + 1
+
+def run_process(path: str, backend: str, proc: int, threads: int, ops: int, store=None):
+    os.environ["BITD_STATE_BACKEND"] = backend
+    store = store or open_store(path)
+    ts = [threading.Thread(target=hammer, args=(store, f"p{proc}t{t}", ops)) for t in range(threads)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backend", default="json", choices=["json", "wal", "sharded", "sqlite"])
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--ops", type=int, default=25)
+    args = ap.parse_args()
+    procs = max(1, args.procs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.json")
+        os.environ["BITD_STATE_BACKEND"] = args.backend
+        store = open_store(path)
+        # большой час, чтобы не упереться в сегменты; персонажи заводятся заранее
+        store.upsert_clock(CLOCK, 10**9)
+        for p in range(procs):
+            for t in range(args.threads):
+                store.upsert_player(f"p{p}t{t}")
+
+        t0 = time.perf_counter()
+        if procs == 1:
+            run_process(path, args.backend, 0, args.threads, args.ops, store=store)
+        else:
+            if hasattr(store, "close"):
+                store.close()
+            ctx = mp.get_context("spawn")
+            ps = [ctx.Process(target=run_process, args=(path, args.backend, p, args.threads, args.ops)) for p in range(procs)]
+            for p in ps: p.start()
+            for p in ps: p.join()
+            if any(p.exitcode for p in ps):
+                sys.exit("воркер упал")
+        dt = time.perf_counter() - t0
+        if hasattr(store, "close"):
+            store.close()
+
+        cur = open_store(path).get()
+        total = procs * args.threads * args.ops
+        clock = next(c for c in cur["clocks"] if c["name"] == CLOCK)
+        errors = []
+        if cur["heat"] != total:
+            errors.append(f"heat {cur['heat']} != {total}")
+        if clock["filled"] != total:
+            errors.append(f"clock {clock['filled']} != {total}")
+        for name, p in cur["players"].items():
+            if len(p["harms"]) != args.ops or p["xp"] != args.ops:
+                errors.append(f"{name}: harms {len(p['harms'])}, xp {p['xp']} != {args.ops}")
+        muts = total * 4
+        print(f"{args.backend}: {muts} мутаций за {dt:.2f} с ({muts / dt:.0f}/с), процессов {procs}, потоков {args.threads}")
+        if errors:
+            print("ПОТЕРИ:\n  " + "\n  ".join(errors[:20]))
+            sys.exit(1)
+        print("OK: ничего не потеряно")
+
+if __name__ == "__main__":
+    main()
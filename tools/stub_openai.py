@@ -0,0 +1,107 @@
+"""Заглушка OpenAI-совместимого сервера для ручной проверки HTTP-бэкендов (таймауты, повторы, предохранитель).
+
+    python tools/stub_openai.py --port 8099 --delay 0.2 --fail-rate 0.3
+    LLM_BACKEND=openai_compat OPENAI_BASE_URL=http://127.0.0.1:8099/v1 python -m app.server
+
+`POST /v1/chat/completions` отвечает эхом последней реплики (обычным JSON или SSE при `"stream": true`).
+`--delay` — пауза перед ответом (проверка LLM_TIMEOUT), `--fail-rate` — доля ответов 503 (повторы и
+предохранитель), `--chunk` — символов в куске потока. Счётчики запросов — `GET /stats`.
+"""
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+stats = {"requests": 0, "failed": 0, "streamed": 0}
+_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _lock:
+        stats[name] += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящих серверов
+    args: argparse.Namespace
+
+    def log_message(self, fmt, *a):
+        if self.args.verbose:
+            super().log_message(fmt, *a)
+
+    def _json(self, code: int, obj) -> None:
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with _lock:
+                self._json(200, dict(stats))
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._json(404, {"error": {"message": "not found"}})
+            return
+        _count("requests")
+        time.sleep(self.args.delay)
+        if random.random() < self.args.fail_rate:
+            _count("failed")
+            self._json(503, {"error": {"message": "stub: overloaded", "type": "server_error"}})
+            return
+        messages = body.get("messages") or [{"content": ""}]
+        text = "Эхо: " + str(messages[-1].get("content", ""))
+        model = body.get("model", "stub")
+        if body.get("stream"):
+            _count("streamed")
+            self._stream(model, text)
+            return
+        self._json(200, {"id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "finish_reason": "stop",
+                                      "message": {"role": "assistant", "content": text}}],
+                         "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+
+    def _stream(self, model: str, text: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload: str) -> None:
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        n = self.args.chunk
+        for i in range(0, len(text), n):
+            send(json.dumps({"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "delta": {"content": text[i:i + n]}, "finish_reason": None}]},
+                            ensure_ascii=False))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--delay", type=float, default=0.0, help="пауза перед ответом, с")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов 503")
+    ap.add_argument("--chunk", type=int, default=8, help="символов в куске потока")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+    Handler.args = args
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"заглушка OpenAI: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()